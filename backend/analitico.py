@@ -0,0 +1,161 @@
+"""
+Painel da turma: contadores por curso e tópico mantidos na escrita.
+
+Cada turno do `/its/chat` soma seus efeitos (tentativa, acerto, compreensão,
+tempo gasto, avanço no funil) em `estatisticas_topicos` e
+`estatisticas_cursos`, na mesma transação do turno. A leitura do painel só
+percorre essas linhas, uma por tópico de cada curso, então o custo não
+depende de quantas sessões existem.
+
+"Curso" é o conjunto de aulas da sessão (`audio_ids` ordenados).
+"""
+
+import json
+from datetime import datetime
+
+from sqlalchemy import select
+
+from backend.database import (
+    ClassCourseStats,
+    ClassTopicStats,
+    insert_upsert,
+)
+
+# Intervalos maiores que isto entre dois turnos contam como pausa, não estudo
+MAX_SEGUNDOS_POR_TURNO = 15 * 60
+
+
+def chave_curso(audio_ids):
+    """Identificador do curso a partir dos audio_ids (lista ou JSON)."""
+    if isinstance(audio_ids, str):
+        audio_ids = json.loads(audio_ids or "[]")
+    return json.dumps(sorted(audio_ids))
+
+
+async def _somar(db, modelo, chaves, incrementos):
+    """
+    INSERT ... ON CONFLICT DO UPDATE somando `incrementos` à linha de `chaves`.
+    A soma acontece no banco, então turnos simultâneos não perdem contagens.
+    """
+    agora = datetime.utcnow()
+    tabela = modelo.__table__
+    comando = insert_upsert(db, modelo).values(
+        **chaves, **incrementos, atualizado_em=agora
+    )
+    comando = comando.on_conflict_do_update(
+        index_elements=list(chaves),
+        set_={
+            **{campo: tabela.c[campo] + valor for campo, valor in incrementos.items()},
+            "atualizado_em": agora,
+        },
+    )
+    await db.execute(comando)
+
+
+async def registrar_inicio_sessao(db, curso, primeiro_topico, quantidade=1):
+    """`quantidade` sessões novas: entram no funil do curso e do primeiro tópico."""
+    await _somar(
+        db, ClassCourseStats, {"curso": curso}, {"sessoes_iniciadas": quantidade}
+    )
+    await registrar_chegada_topico(db, curso, primeiro_topico, quantidade)
+
+
+async def registrar_chegada_topico(db, curso, topico, quantidade=1):
+    await _somar(
+        db,
+        ClassTopicStats,
+        {"curso": curso, "topico": topico},
+        {"alunos_chegaram": quantidade},
+    )
+
+
+async def registrar_conclusao(db, curso):
+    await _somar(db, ClassCourseStats, {"curso": curso}, {"sessoes_concluidas": 1})
+
+
+async def registrar_avaliacao(db, curso, topico, anterior, atual):
+    """
+    Soma uma avaliação do tópico. `anterior` e `atual` são as estatísticas do
+    aluno no tópico antes e depois dela (formato de `topicos_status`).
+    """
+    await _somar(
+        db,
+        ClassTopicStats,
+        {"curso": curso, "topico": topico},
+        {
+            "tentativas": 1,
+            "acertos": atual["acertos"] - anterior["acertos"],
+            "soma_compreensao": atual["compreensao"],
+            "alunos_tentaram": 1 if not anterior["tentativas"] else 0,
+            "alunos_compreenderam": 1
+            if atual["status"] == "compreendido" and anterior["status"] != "compreendido"
+            else 0,
+        },
+    )
+
+
+def segundos_desde(ultima):
+    """Tempo desde `ultima` (limitado a uma pausa máxima); 0 se não houver."""
+    if not ultima:
+        return 0
+    return min((datetime.utcnow() - ultima).total_seconds(), MAX_SEGUNDOS_POR_TURNO)
+
+
+async def registrar_tempo(db, curso, topico, segundos):
+    if segundos > 0:
+        await _somar(
+            db,
+            ClassTopicStats,
+            {"curso": curso, "topico": topico},
+            {"segundos_no_topico": segundos},
+        )
+
+
+async def painel(db, curso=None):
+    """Contadores agregados por curso e tópico, prontos para exibir."""
+    consulta_cursos = select(ClassCourseStats).order_by(ClassCourseStats.curso)
+    consulta_topicos = select(ClassTopicStats).order_by(ClassTopicStats.id)
+    if curso is not None:
+        consulta_cursos = consulta_cursos.where(ClassCourseStats.curso == curso)
+        consulta_topicos = consulta_topicos.where(ClassTopicStats.curso == curso)
+
+    topicos = {}
+    for t in (await db.scalars(consulta_topicos)).all():
+        topicos.setdefault(t.curso, []).append(
+            {
+                "topico": t.topico,
+                "tentativas": t.tentativas,
+                "acertos": t.acertos,
+                "taxa_acerto": round(t.acertos / t.tentativas * 100, 1)
+                if t.tentativas
+                else 0,
+                "compreensao_media": round(t.soma_compreensao / t.tentativas, 1)
+                if t.tentativas
+                else 0,
+                "minutos_no_topico": round(t.segundos_no_topico / 60, 1),
+                "minutos_por_aluno": round(
+                    t.segundos_no_topico / 60 / t.alunos_chegaram, 1
+                )
+                if t.alunos_chegaram
+                else 0,
+                "funil": {
+                    "chegaram": t.alunos_chegaram,
+                    "tentaram": t.alunos_tentaram,
+                    "compreenderam": t.alunos_compreenderam,
+                },
+            }
+        )
+
+    return [
+        {
+            "curso": c.curso,
+            "audio_ids": json.loads(c.curso),
+            "sessoes_iniciadas": c.sessoes_iniciadas,
+            "sessoes_concluidas": c.sessoes_concluidas,
+            "taxa_conclusao": round(c.sessoes_concluidas / c.sessoes_iniciadas * 100, 1)
+            if c.sessoes_iniciadas
+            else 0,
+            "topicos": topicos.get(c.curso, []),
+        }
+        for c in (await db.scalars(consulta_cursos)).all()
+    ]
@@ -0,0 +1,288 @@
+"""
+Arquivo frio das sessões de tutoria.
+
+Sessões concluídas ou abandonadas ficavam para sempre em `sessoes_tutoria`,
+com os JSONs completos, além das suas linhas em `mensagens_chat` e
+`progresso_topicos`. O job de arquivamento move cada uma delas para uma única
+linha de `sessoes_arquivadas`: um documento JSON com a sessão, as mensagens e
+o progresso, comprimido com zstd. As tabelas quentes ficam só com as sessões
+em uso, não importa quantos anos de histórico se acumulem.
+
+- Quais: concluídas sem mensagens há `ARQUIVO_DIAS_CONCLUIDA` dias e
+  quaisquer outras sem mensagens há `ARQUIVO_DIAS_OCIOSA` dias.
+- Como: cada sessão é arquivada segurando o lease de turno dela (ver
+  backend/concorrencia.py), numa transação própria; uma sessão com turno em
+  andamento fica para a próxima rodada.
+- Leitura: `/its/sessao/{id}` e a lista de sessões leem o arquivo quando a
+  sessão não está na tabela quente. Um novo turno do chat numa sessão
+  arquivada a `restaurar` de volta para as tabelas quentes.
+- Ids: `sessoes_tutoria` usa AUTOINCREMENT no SQLite, então uma sessão
+  nova nunca recebe o id de uma arquivada.
+
+O job roda periodicamente no backend (`ARQUIVO_INTERVALO_HORAS`; 0 desliga)
+e também pode ser executado manualmente:
+
+    python -m backend.arquivo
+"""
+
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+
+import zstandard
+from sqlalchemy import and_, delete, func, insert, or_, select
+from sqlalchemy.orm import undefer_group
+from sqlalchemy.orm.exc import StaleDataError
+
+from backend import cache_sessoes, concorrencia, progresso
+from backend.database import (
+    AsyncSessionLocal,
+    CONTEUDO,
+    ChatMessage,
+    SessaoArquivada,
+    TopicProgress,
+    TutoriaSession,
+)
+
+log = logging.getLogger(__name__)
+
+DIAS_CONCLUIDA = float(os.getenv("ARQUIVO_DIAS_CONCLUIDA", "7"))
+DIAS_OCIOSA = float(os.getenv("ARQUIVO_DIAS_OCIOSA", "180"))
+INTERVALO_HORAS = float(os.getenv("ARQUIVO_INTERVALO_HORAS", "24"))
+NIVEL_ZSTD = int(os.getenv("ARQUIVO_NIVEL_ZSTD", "10"))
+# Quantas sessões candidatas são buscadas por consulta
+LOTE = 100
+
+# Campos da sessão guardados no documento (além das mensagens e do progresso)
+CAMPOS_SESSAO = (
+    "id",
+    "modelo_dominio",
+    "modelo_aluno",
+    "topico_atual",
+    "status",
+    "audio_ids",
+    "aluno",
+    "data_criacao",
+    "versao",
+)
+
+
+def _data(valor):
+    return valor.isoformat() if valor else None
+
+
+def _ler_data(valor):
+    return datetime.fromisoformat(valor) if valor else None
+
+
+def comprimir(documento):
+    dados = json.dumps(documento, ensure_ascii=False).encode("utf-8")
+    return zstandard.ZstdCompressor(level=NIVEL_ZSTD).compress(dados)
+
+
+def descomprimir(conteudo):
+    return json.loads(zstandard.ZstdDecompressor().decompress(conteudo))
+
+
+async def _documento(db, sessao):
+    """Sessão, mensagens e progresso num dicionário serializável em JSON."""
+    mensagens = (
+        await db.execute(
+            select(
+                ChatMessage.seq,
+                ChatMessage.role,
+                ChatMessage.texto,
+                ChatMessage.data_criacao,
+            )
+            .where(ChatMessage.session_id == sessao.id)
+            .order_by(ChatMessage.seq)
+        )
+    ).all()
+    topicos = (
+        await db.execute(
+            select(
+                TopicProgress.topico,
+                TopicProgress.updated_at,
+                *[getattr(TopicProgress, c) for c in progresso.CAMPOS],
+            )
+            .where(TopicProgress.session_id == sessao.id)
+            .order_by(TopicProgress.id)
+        )
+    ).all()
+    return {
+        "sessao": {
+            **{campo: getattr(sessao, campo) for campo in CAMPOS_SESSAO},
+            "data_criacao": _data(sessao.data_criacao),
+        },
+        "mensagens": [
+            {
+                "seq": m.seq,
+                "role": m.role,
+                "texto": m.texto,
+                "data_criacao": _data(m.data_criacao),
+            }
+            for m in mensagens
+        ],
+        "progresso": [
+            {
+                "topico": t.topico,
+                **{campo: getattr(t, campo) for campo in progresso.CAMPOS},
+                "updated_at": _data(t.updated_at),
+            }
+            for t in topicos
+        ],
+    }
+
+
+async def _candidatas(db, agora, depois_de):
+    """Ids de sessões paradas há tempo suficiente, em ordem de id."""
+    ultima_mensagem = (
+        select(func.max(ChatMessage.data_criacao))
+        .where(ChatMessage.session_id == TutoriaSession.id)
+        .scalar_subquery()
+    )
+    atividade = func.coalesce(ultima_mensagem, TutoriaSession.data_criacao)
+    return (
+        await db.scalars(
+            select(TutoriaSession.id)
+            .where(
+                TutoriaSession.id > depois_de,
+                or_(
+                    and_(
+                        TutoriaSession.status == "concluido",
+                        atividade < agora - timedelta(days=DIAS_CONCLUIDA),
+                    ),
+                    atividade < agora - timedelta(days=DIAS_OCIOSA),
+                ),
+            )
+            .order_by(TutoriaSession.id)
+            .limit(LOTE)
+        )
+    ).all()
+
+
+async def arquivar_sessao(session_id):
+    """
+    Move uma sessão para o arquivo. Devolve False se ela estava ocupada,
+    mudou durante o arquivamento ou já não existia.
+    """
+    try:
+        async with concorrencia.turno_exclusivo(session_id, espera=0):
+            async with AsyncSessionLocal() as db:
+                sessao = await db.get(
+                    TutoriaSession, session_id, options=[undefer_group(CONTEUDO)]
+                )
+                if not sessao:
+                    return False
+
+                db.add(
+                    SessaoArquivada(
+                        id=sessao.id,
+                        topico_atual=sessao.topico_atual,
+                        status=sessao.status,
+                        aluno=sessao.aluno,
+                        data_criacao=sessao.data_criacao,
+                        conteudo=comprimir(await _documento(db, sessao)),
+                    )
+                )
+                await db.execute(
+                    delete(ChatMessage).where(ChatMessage.session_id == session_id)
+                )
+                await db.execute(
+                    delete(TopicProgress).where(TopicProgress.session_id == session_id)
+                )
+                # O DELETE confere a versão lida
+                await db.delete(sessao)
+                await db.commit()
+    except (concorrencia.SessaoOcupadaError, StaleDataError):
+        return False
+
+    cache_sessoes.invalidar(session_id)
+    return True
+
+
+async def arquivar(agora=None):
+    """Uma rodada do job: arquiva todas as sessões candidatas. Devolve quantas."""
+    agora = agora or datetime.utcnow()
+    arquivadas = 0
+    ultimo_id = 0
+    while True:
+        async with AsyncSessionLocal() as db:
+            ids = await _candidatas(db, agora, ultimo_id)
+        if not ids:
+            break
+        for session_id in ids:
+            if await arquivar_sessao(session_id):
+                arquivadas += 1
+        ultimo_id = ids[-1]
+
+    if arquivadas:
+        log.info("Sessões movidas para o arquivo frio", extra={"sessoes": arquivadas})
+    return arquivadas
+
+
+async def rodar_periodicamente():
+    """Tarefa de fundo do backend: uma rodada a cada INTERVALO_HORAS."""
+    while True:
+        try:
+            await arquivar()
+        except Exception:
+            log.exception("Erro no arquivamento de sessões")
+        await asyncio.sleep(INTERVALO_HORAS * 3600)
+
+
+async def obter(db, session_id):
+    """Documento de uma sessão arquivada, ou None se ela não está no arquivo."""
+    # populate_existing: a linha pode já estar na sessão sem o conteúdo
+    arquivada = await db.get(
+        SessaoArquivada,
+        session_id,
+        options=[undefer_group(CONTEUDO)],
+        populate_existing=True,
+    )
+    if not arquivada:
+        return None
+    return descomprimir(arquivada.conteudo)
+
+
+async def restaurar(db, session_id):
+    """
+    Devolve uma sessão arquivada às tabelas quentes (sem commit) e retorna a
+    TutoriaSession, ou None se ela não está no arquivo. A versão avança, então
+    estados antigos em memória de qualquer worker deixam de valer.
+    """
+    documento = await obter(db, session_id)
+    if documento is None:
+        return None
+
+    dados = {
+        **documento["sessao"],
+        "data_criacao": _ler_data(documento["sessao"]["data_criacao"]),
+        "versao": (documento["sessao"]["versao"] or 0) + 1,
+    }
+    await db.execute(insert(TutoriaSession).values(**dados))
+    if documento["mensagens"]:
+        await db.execute(
+            insert(ChatMessage),
+            [
+                {**m, "session_id": session_id, "data_criacao": _ler_data(m["data_criacao"])}
+                for m in documento["mensagens"]
+            ],
+        )
+    if documento["progresso"]:
+        await db.execute(
+            insert(TopicProgress),
+            [
+                {**t, "session_id": session_id, "updated_at": _ler_data(t["updated_at"])}
+                for t in documento["progresso"]
+            ],
+        )
+    await db.execute(delete(SessaoArquivada).where(SessaoArquivada.id == session_id))
+    log.info("Sessão restaurada do arquivo frio", extra={"session_id": session_id})
+    return await db.get(TutoriaSession, session_id)
+
+
+if __name__ == "__main__":
+    asyncio.run(arquivar())
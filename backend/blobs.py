@@ -0,0 +1,256 @@
+"""
+Armazenamento de arquivos endereçado por conteúdo (PDFs e imagens do ITS).
+
+Antes, cada envio virava um `uploads/temp_...` e o frontend mandava o caminho
+no disco para o backend, o que só funcionava com os dois serviços
+compartilhando a mesma pasta (e nomes iguais se sobrescreviam). Agora o
+arquivo sobe para o backend, que o grava com o sha256 do conteúdo como
+identificador, e os endpoints trocam só esse id:
+
+- Envio em streaming: o conteúdo é copiado em blocos para um arquivo
+  temporário enquanto o hash é calculado (numa thread), e só então movido
+  para `BLOBS_DIR/<2 primeiros>/<sha256>`. O mesmo arquivo enviado duas vezes
+  ocupa o disco uma vez só.
+- Referências: quem precisa guardar o conteúdo (ex.: o modelo de domínio
+  gerado a partir do PDF) soma uma referência e a devolve quando deixa de
+  precisar dele.
+- Coleta de lixo: primeiro saem do cache do pipeline os modelos de domínio
+  sem uso há `MODELOS_DOMINIO_RETENCAO_DIAS` (as sessões guardam a própria
+  cópia do modelo), devolvendo as referências aos PDFs de onde vieram; depois
+  são apagados os arquivos sem referência e sem uso há `BLOBS_RETENCAO_HORAS`,
+  assim como temporários de envios interrompidos.
+
+A impressão de um blob é o sha256 do arquivo, igual à que o pipeline já
+calculava para os PDFs, então modelos de domínio já gerados continuam
+reaproveitados.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import delete, func, select, update
+
+from backend.database import AsyncSessionLocal, Blob, ModeloDominioCache, insert_upsert
+from backend.observabilidade import medir
+
+PASTA = os.getenv("BLOBS_DIR", "uploads/blobs")
+PASTA_TEMPORARIA = os.path.join(PASTA, "tmp")
+MAX_BYTES = int(float(os.getenv("BLOBS_MAX_MB", "50")) * 1024 * 1024)
+RETENCAO_HORAS = float(os.getenv("BLOBS_RETENCAO_HORAS", "24"))
+INTERVALO_HORAS = float(os.getenv("BLOBS_INTERVALO_HORAS", "6"))
+MODELOS_RETENCAO_DIAS = float(os.getenv("MODELOS_DOMINIO_RETENCAO_DIAS", "90"))
+TAMANHO_BLOCO = 1024 * 1024
+
+_ID_VALIDO = re.compile(r"^[0-9a-f]{64}$")
+
+log = logging.getLogger(__name__)
+
+
+class ArquivoGrandeDemaisError(Exception):
+    """O envio passou de BLOBS_MAX_MB."""
+
+
+def caminho(blob_id):
+    """Onde o conteúdo do blob fica no disco."""
+    if not _ID_VALIDO.match(blob_id or ""):
+        raise ValueError(f"Id de blob inválido: {blob_id!r}")
+    return os.path.join(PASTA, blob_id[:2], blob_id)
+
+
+def _copiar_com_hash(origem, destino):
+    """Copia `origem` (arquivo aberto) para `destino` em blocos. Retorna (sha256, bytes)."""
+    h = hashlib.sha256()
+    tamanho = 0
+    with open(destino, "wb") as saida:
+        for bloco in iter(lambda: origem.read(TAMANHO_BLOCO), b""):
+            tamanho += len(bloco)
+            if tamanho > MAX_BYTES:
+                raise ArquivoGrandeDemaisError(
+                    f"Arquivo maior que {MAX_BYTES // (1024 * 1024)} MB"
+                )
+            h.update(bloco)
+            saida.write(bloco)
+    return h.hexdigest(), tamanho
+
+
+async def guardar(db, arquivo):
+    """
+    Grava o conteúdo de `arquivo` (UploadFile) e devolve o Blob. Conteúdo
+    repetido não é gravado de novo; só atualiza o último uso. Faz commit.
+    """
+    os.makedirs(PASTA_TEMPORARIA, exist_ok=True)
+    temporario = os.path.join(PASTA_TEMPORARIA, uuid.uuid4().hex)
+    try:
+        with medir("salvar_arquivo"):
+            blob_id, tamanho = await run_in_threadpool(
+                _copiar_com_hash, arquivo.file, temporario
+            )
+
+        # Primeiro o registro (marca o blob como em uso), depois o arquivo:
+        # a coleta de lixo só apaga o que não tem registro recente
+        agora = datetime.utcnow()
+        comando = insert_upsert(db, Blob).values(
+            id=blob_id,
+            tamanho=tamanho,
+            mime=mimetypes.guess_type(arquivo.filename or "")[0]
+            or "application/octet-stream",
+            nome_original=arquivo.filename,
+            referencias=0,
+            ultimo_uso=agora,
+            data_criacao=agora,
+        )
+        await db.execute(
+            comando.on_conflict_do_update(
+                index_elements=["id"], set_={"ultimo_uso": agora}
+            )
+        )
+        await db.commit()
+
+        destino = caminho(blob_id)
+        if os.path.exists(destino):
+            os.remove(temporario)
+        else:
+            os.makedirs(os.path.dirname(destino), exist_ok=True)
+            os.replace(temporario, destino)
+    finally:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+
+    return await db.get(Blob, blob_id, populate_existing=True)
+
+
+async def obter(db, blob_ids):
+    """
+    Os Blobs de `blob_ids`, na mesma ordem, com o último uso atualizado.
+    Retorna (blobs, ids_que_faltam); ids inválidos ou sem arquivo faltam.
+    """
+    validos = [i for i in blob_ids if _ID_VALIDO.match(i or "")]
+    encontrados = {
+        b.id: b
+        for b in (await db.scalars(select(Blob).where(Blob.id.in_(validos)))).all()
+    }
+    blobs, faltando = [], []
+    for blob_id in blob_ids:
+        blob = encontrados.get(blob_id)
+        if blob and os.path.exists(caminho(blob_id)):
+            blobs.append(blob)
+        else:
+            faltando.append(blob_id)
+    if encontrados:
+        await db.execute(
+            update(Blob)
+            .where(Blob.id.in_(list(encontrados)))
+            .values(ultimo_uso=datetime.utcnow())
+        )
+    return blobs, faltando
+
+
+async def adicionar_referencias(db, blob_ids, quantidade=1):
+    """Soma (ou subtrai, com quantidade negativa) referências. Sem commit."""
+    if blob_ids:
+        await db.execute(
+            update(Blob)
+            .where(Blob.id.in_(list(blob_ids)))
+            .values(
+                referencias=Blob.referencias + quantidade,
+                ultimo_uso=datetime.utcnow(),
+            )
+        )
+
+
+async def podar_modelos_dominio(db, agora):
+    """
+    Tira do cache do pipeline os modelos de domínio sem uso há
+    MODELOS_RETENCAO_DIAS e devolve as referências que eles tinham aos
+    arquivos. Sem commit. Devolve quantos modelos saíram.
+    """
+    limite = agora - timedelta(days=MODELOS_RETENCAO_DIAS)
+    ultimo_uso = func.coalesce(ModeloDominioCache.ultimo_uso, ModeloDominioCache.data_criacao)
+    podados = (
+        await db.scalars(
+            delete(ModeloDominioCache)
+            .where(ultimo_uso < limite)
+            .returning(ModeloDominioCache.blob_ids)
+        )
+    ).all()
+
+    # Cada modelo somou uma referência por arquivo distinto
+    liberadas = Counter(
+        blob_id for blob_ids in podados for blob_id in set(json.loads(blob_ids or "[]"))
+    )
+    for quantidade in set(liberadas.values()):
+        await adicionar_referencias(
+            db, [b for b, q in liberadas.items() if q == quantidade], -quantidade
+        )
+
+    if podados:
+        log.info(
+            "Coleta de lixo: modelos de domínio sem uso tirados do cache",
+            extra={"modelos": len(podados)},
+        )
+    return len(podados)
+
+
+async def coletar_lixo(agora=None):
+    """Apaga blobs sem referências e sem uso recente. Devolve quantos."""
+    agora = agora or datetime.utcnow()
+    limite = agora - timedelta(hours=RETENCAO_HORAS)
+    async with AsyncSessionLocal() as db:
+        await podar_modelos_dominio(db, agora)
+        await db.commit()
+
+        apagados = (
+            await db.scalars(
+                delete(Blob)
+                .where(Blob.referencias <= 0, Blob.ultimo_uso < limite)
+                .returning(Blob.id)
+            )
+        ).all()
+        await db.commit()
+
+        for blob_id in apagados:
+            # Um envio do mesmo conteúdo pode ter recriado o registro
+            if await db.get(Blob, blob_id) is None:
+                try:
+                    os.remove(caminho(blob_id))
+                    os.rmdir(os.path.dirname(caminho(blob_id)))
+                except OSError:
+                    pass  # Já apagado, ou a pasta ainda tem outros blobs
+
+    # Temporários de envios que não terminaram
+    if os.path.isdir(PASTA_TEMPORARIA):
+        for nome in os.listdir(PASTA_TEMPORARIA):
+            temporario = os.path.join(PASTA_TEMPORARIA, nome)
+            if os.path.getmtime(temporario) < time.time() - RETENCAO_HORAS * 3600:
+                os.remove(temporario)
+
+    if apagados:
+        log.info(
+            "Coleta de lixo: arquivos sem referência apagados",
+            extra={"arquivos": len(apagados)},
+        )
+    return len(apagados)
+
+
+async def rodar_periodicamente():
+    """Tarefa de fundo do backend: uma coleta a cada INTERVALO_HORAS."""
+    while True:
+        try:
+            await coletar_lixo()
+        except Exception:
+            log.exception("Erro na coleta de lixo de arquivos")
+        await asyncio.sleep(INTERVALO_HORAS * 3600)
+
+
+if __name__ == "__main__":
+    asyncio.run(coletar_lixo())
@@ -0,0 +1,188 @@
+"""
+Busca textual nas transcrições das aulas (SQLite FTS5).
+
+O índice `audios_fts` usa a view `audios_texto` como conteúdo externo, então
+o texto não é duplicado no banco: o FTS guarda só o índice invertido e lê os
+trechos da própria tabela `audios` para montar os snippets. Triggers mantêm o
+índice em dia a cada INSERT/UPDATE/DELETE em `audios` (inclusive na edição
+da transcrição), sem depender de quem escreveu.
+
+Em bancos sem FTS5 (ex.: PostgreSQL) a busca cai para um LIKE simples.
+"""
+
+import re
+from datetime import datetime
+
+from sqlalchemy import func, or_, select, text
+
+from backend.database import AudioLog
+
+# Marcadores do termo encontrado no snippet (markdown, exibido pelo Streamlit)
+MARCA_INICIO = "**"
+MARCA_FIM = "**"
+PALAVRAS_SNIPPET = 24
+# Peso do nome da aula em relação ao texto no ranking BM25
+PESO_NOME = 4.0
+PESO_TEXTO = 1.0
+
+_TEXTO_NOVO = "coalesce(new.transcricao_editada, new.transcricao, '')"
+_TEXTO_ANTIGO = "coalesce(old.transcricao_editada, old.transcricao, '')"
+
+_DDL = [
+    """
+    CREATE VIEW IF NOT EXISTS audios_texto AS
+    SELECT id, filename_original,
+           coalesce(transcricao_editada, transcricao, '') AS texto
+    FROM audios
+    """,
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS audios_fts USING fts5(
+        filename_original, texto,
+        content='audios_texto', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS audios_fts_insert AFTER INSERT ON audios BEGIN
+        INSERT INTO audios_fts(rowid, filename_original, texto)
+        VALUES (new.id, new.filename_original, {_TEXTO_NOVO});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS audios_fts_delete AFTER DELETE ON audios BEGIN
+        INSERT INTO audios_fts(audios_fts, rowid, filename_original, texto)
+        VALUES ('delete', old.id, old.filename_original, {_TEXTO_ANTIGO});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS audios_fts_update AFTER UPDATE ON audios BEGIN
+        INSERT INTO audios_fts(audios_fts, rowid, filename_original, texto)
+        VALUES ('delete', old.id, old.filename_original, {_TEXTO_ANTIGO});
+        INSERT INTO audios_fts(rowid, filename_original, texto)
+        VALUES (new.id, new.filename_original, {_TEXTO_NOVO});
+    END
+    """,
+]
+
+
+def fts_disponivel(db):
+    return db.bind.dialect.name == "sqlite"
+
+
+async def criar_indice(db):
+    """
+    Cria view, índice e triggers (idempotente). Se o índice acabou de ser
+    criado num banco que já tinha aulas, reconstrói a partir da tabela.
+    Retorna True quando houve reconstrução.
+    """
+    if not fts_disponivel(db):
+        return False
+
+    existia = await db.scalar(
+        text("SELECT 1 FROM sqlite_master WHERE type='table' AND name='audios_fts'")
+    )
+    for comando in _DDL:
+        await db.execute(text(comando))
+
+    reconstruir = not existia and await db.scalar(select(AudioLog.id).limit(1))
+    if reconstruir:
+        await db.execute(text("INSERT INTO audios_fts(audios_fts) VALUES ('rebuild')"))
+    await db.commit()
+    return bool(reconstruir)
+
+
+def montar_consulta(termos):
+    """
+    Converte o texto digitado numa consulta FTS5 segura: cada palavra vira um
+    termo entre aspas com busca por prefixo ("fotoss"* acha fotossíntese), e
+    todos os termos precisam aparecer.
+    """
+    palavras = re.findall(r"\w+", termos or "")
+    return " ".join(f'"{p}"*' for p in palavras)
+
+
+async def buscar(db, termos, limite, offset=0):
+    """
+    Retorna (resultados, ha_mais). Cada resultado traz id, nome, data, score
+    (menor é melhor, padrão do bm25) e um snippet com os termos marcados.
+    A ordenação por `rank` fica dentro do FTS5, e os snippets e o JOIN com
+    `audios` só são calculados para a página pedida.
+    """
+    consulta = montar_consulta(termos)
+    if not consulta:
+        return [], False
+
+    if not fts_disponivel(db):
+        return await _buscar_like(db, termos, limite, offset)
+
+    linhas = (
+        await db.execute(
+            text(
+                """
+                SELECT a.id, a.filename_original, a.data_criacao,
+                       r.rank AS score, r.snippet
+                FROM (
+                    SELECT rowid, rank,
+                           snippet(audios_fts, 1, :inicio, :fim, '…', :palavras) AS snippet
+                    FROM audios_fts
+                    WHERE audios_fts MATCH :consulta AND rank MATCH :ranking
+                    ORDER BY rank
+                    LIMIT :limite OFFSET :offset
+                ) r
+                JOIN audios a ON a.id = r.rowid
+                ORDER BY r.rank
+                """
+            ),
+            {
+                "consulta": consulta,
+                "ranking": f"bm25({PESO_NOME}, {PESO_TEXTO})",
+                "inicio": MARCA_INICIO,
+                "fim": MARCA_FIM,
+                "palavras": PALAVRAS_SNIPPET,
+                "limite": limite + 1,
+                "offset": offset,
+            },
+        )
+    ).all()
+
+    return [
+        {
+            "id": linha.id,
+            "filename_original": linha.filename_original,
+            # SQL textual: o SQLite devolve a data como texto
+            "data_criacao": datetime.fromisoformat(linha.data_criacao).isoformat()
+            if linha.data_criacao
+            else None,
+            "score": round(linha.score, 4),
+            "snippet": linha.snippet,
+        }
+        for linha in linhas[:limite]
+    ], len(linhas) > limite
+
+
+async def _buscar_like(db, termos, limite, offset):
+    """Alternativa sem FTS: todas as palavras precisam aparecer, sem ranking."""
+    texto = func.coalesce(AudioLog.transcricao_editada, AudioLog.transcricao, "")
+    condicoes = [
+        or_(texto.ilike(f"%{p}%"), AudioLog.filename_original.ilike(f"%{p}%"))
+        for p in re.findall(r"\w+", termos)
+    ]
+    linhas = (
+        await db.execute(
+            select(AudioLog.id, AudioLog.filename_original, AudioLog.data_criacao)
+            .where(*condicoes)
+            .order_by(AudioLog.id.desc())
+            .limit(limite + 1)
+            .offset(offset)
+        )
+    ).all()
+    return [
+        {
+            "id": linha.id,
+            "filename_original": linha.filename_original,
+            "data_criacao": linha.data_criacao.isoformat() if linha.data_criacao else None,
+            "score": None,
+            "snippet": None,
+        }
+        for linha in linhas[:limite]
+    ], len(linhas) > limite
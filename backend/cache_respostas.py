@@ -0,0 +1,184 @@
+"""
+Cache de avaliações de respostas, por versão do modelo de domínio e tópico.
+
+Alunos da mesma turma mandam respostas quase iguais para o mesmo exercício
+(só mudam maiúsculas, acentos, pontuação ou a ordem das palavras). Antes de
+chamar o LLM, a resposta é normalizada e comparada com as já avaliadas no
+mesmo escopo:
+
+- igual depois de normalizada: acerto exato (similaridade 1.0);
+- quase igual: similaridade de Jaccard estimada por MinHash sobre palavras e
+  pares de palavras, com limiar conservador, e só se as duas respostas têm as
+  mesmas negações ("não", "nunca"...), que mudam o sentido com uma palavra.
+
+O escopo inclui a impressão do modelo de domínio, então um modelo regerado
+não reaproveita avaliações antigas. O cache é limitado por escopo e no total;
+ao passar do limite saem as entradas usadas há mais tempo.
+"""
+
+import hashlib
+import json
+import os
+import re
+import unicodedata
+from datetime import datetime
+
+from sqlalchemy import delete, func, select, true, update
+
+from backend.database import RespostaCache
+from backend.pipeline import impressao
+
+LIMIAR_SIMILARIDADE = float(os.getenv("CACHE_RESPOSTAS_LIMIAR", "0.85"))
+MAX_POR_ESCOPO = int(os.getenv("CACHE_RESPOSTAS_POR_ESCOPO", "200"))
+MAX_TOTAL = int(os.getenv("CACHE_RESPOSTAS_TOTAL", "20000"))
+# Respostas muito curtas ("sim", "não sei") só casam de forma exata
+MIN_PALAVRAS_APROXIMADO = 4
+
+NUM_PERMUTACOES = 64
+_PRIMO = (1 << 61) - 1
+_PERMUTACOES = [
+    (
+        int.from_bytes(hashlib.blake2b(f"a{i}".encode(), digest_size=8).digest(), "big")
+        % _PRIMO
+        | 1,
+        int.from_bytes(hashlib.blake2b(f"b{i}".encode(), digest_size=8).digest(), "big")
+        % _PRIMO,
+    )
+    for i in range(NUM_PERMUTACOES)
+]
+
+NEGACOES = {"nao", "nunca", "nem", "nenhum", "nenhuma", "jamais", "sem"}
+
+
+def escopo(impressao_dominio, topico):
+    """Chave do escopo: versão (impressão) do modelo de domínio + tópico."""
+    return impressao(impressao_dominio, topico)
+
+
+def normalizar(texto):
+    """Minúsculas, sem acentos, sem pontuação e com espaços simples."""
+    texto = unicodedata.normalize("NFKD", (texto or "").lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return " ".join(re.findall(r"\w+", texto))
+
+
+def _shingles(palavras):
+    return set(palavras) | {f"{a} {b}" for a, b in zip(palavras, palavras[1:])}
+
+
+def assinatura(normalizada):
+    """MinHash da resposta normalizada (lista de NUM_PERMUTACOES inteiros)."""
+    hashes = [
+        int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "big")
+        for s in _shingles(normalizada.split())
+    ]
+    if not hashes:
+        return []
+    return [min((a * h + b) % _PRIMO for h in hashes) for a, b in _PERMUTACOES]
+
+
+def similaridade(assinatura_a, assinatura_b):
+    """Jaccard estimado: fração de posições iguais nas duas assinaturas."""
+    if not assinatura_a or len(assinatura_a) != len(assinatura_b):
+        return 0.0
+    iguais = sum(1 for x, y in zip(assinatura_a, assinatura_b) if x == y)
+    return iguais / len(assinatura_a)
+
+
+def _negacoes(normalizada):
+    return sorted(p for p in normalizada.split() if p in NEGACOES)
+
+
+async def buscar(db, escopo_cache, resposta):
+    """
+    Procura uma avaliação reaproveitável para `resposta`. Só lê o banco; quem
+    usar o resultado chama `registrar_uso` junto com as demais escritas.
+    Retorna (resultado, similaridade, id) ou (None, similaridade_maxima_vista, None).
+    """
+    normalizada = normalizar(resposta)
+    if not normalizada:
+        return None, 0.0, None
+
+    entrada = await db.scalar(
+        select(RespostaCache).where(
+            RespostaCache.escopo == escopo_cache,
+            RespostaCache.impressao == impressao(normalizada),
+        )
+    )
+    melhor = 1.0 if entrada else 0.0
+
+    if not entrada and len(normalizada.split()) >= MIN_PALAVRAS_APROXIMADO:
+        minha = assinatura(normalizada)
+        negacoes = _negacoes(normalizada)
+        candidatas = (
+            await db.execute(
+                select(
+                    RespostaCache.id,
+                    RespostaCache.resposta_normalizada,
+                    RespostaCache.assinatura,
+                ).where(RespostaCache.escopo == escopo_cache)
+            )
+        ).all()
+        melhor_id = None
+        for c in candidatas:
+            s = similaridade(minha, json.loads(c.assinatura or "[]"))
+            if s > melhor and _negacoes(c.resposta_normalizada) == negacoes:
+                melhor, melhor_id = s, c.id
+        if melhor_id is not None and melhor >= LIMIAR_SIMILARIDADE:
+            entrada = await db.get(RespostaCache, melhor_id)
+
+    if not entrada:
+        return None, melhor, None
+    return json.loads(entrada.resultado), round(melhor, 3), entrada.id
+
+
+async def registrar_uso(db, id_entrada):
+    """Conta o reaproveitamento (e adia o despejo da entrada)."""
+    await db.execute(
+        update(RespostaCache)
+        .where(RespostaCache.id == id_entrada)
+        .values(usos=RespostaCache.usos + 1, ultimo_uso=datetime.utcnow())
+    )
+
+
+async def guardar(db, escopo_cache, resposta, resultado):
+    """Grava a avaliação de `resposta` e aplica os limites de tamanho."""
+    normalizada = normalizar(resposta)
+    if not normalizada:
+        return
+
+    chave = impressao(normalizada)
+    existente = await db.scalar(
+        select(RespostaCache.id).where(
+            RespostaCache.escopo == escopo_cache, RespostaCache.impressao == chave
+        )
+    )
+    if existente:
+        return
+
+    db.add(
+        RespostaCache(
+            escopo=escopo_cache,
+            impressao=chave,
+            resposta_normalizada=normalizada,
+            assinatura=json.dumps(assinatura(normalizada)),
+            resultado=json.dumps(resultado, ensure_ascii=False),
+        )
+    )
+    await db.flush()
+    await _despejar(db, RespostaCache.escopo == escopo_cache, MAX_POR_ESCOPO)
+    await _despejar(db, true(), MAX_TOTAL)
+
+
+async def _despejar(db, filtro, limite):
+    """Remove as entradas usadas há mais tempo além de `limite`."""
+    total = await db.scalar(select(func.count()).select_from(RespostaCache).where(filtro))
+    if total <= limite:
+        return
+    antigas = (
+        select(RespostaCache.id)
+        .where(filtro)
+        .order_by(RespostaCache.ultimo_uso, RespostaCache.id)
+        .limit(total - limite)
+    )
+    await db.execute(delete(RespostaCache).where(RespostaCache.id.in_(antigas)))
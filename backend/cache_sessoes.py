@@ -0,0 +1,183 @@
+"""
+Estado decodificado das sessões de tutoria, em memória (um cache por worker).
+
+Sem ele, todo turno do chat relê o modelo de domínio da sessão (o maior JSON
+do banco), decodifica os dois JSONs, monta `topicos_status` a partir de
+`progresso_topicos`, calcula a impressão do modelo de domínio para o cache de
+avaliações e procura o último `seq` e o horário da última mensagem. Nada
+disso muda entre dois turnos da mesma sessão.
+
+- Validade: o turno lê só as colunas leves da sessão; se a `versao` for a do
+  estado guardado, o estado vale. Todo UPDATE da sessão, em qualquer worker,
+  incrementa a versão, então um estado velho é detectado e recarregado.
+  Quem altera progresso ou histórico de uma sessão fora do turno do chat
+  chama `incrementar_versao`.
+- Escrita: write-through. O turno continua gravando sessão, progresso e
+  mensagens numa única transação; só depois do commit o estado guardado
+  passa para a nova versão (`guardar`). Um turno que falha não deixa rastro.
+- Modelo de domínio: sessões criadas das mesmas aulas compartilham o mesmo
+  objeto decodificado (pela impressão do JSON). As etapas do ITS só o leem.
+
+O cache guarda no máximo `SESSOES_CACHE` sessões (LRU); 0 desliga.
+"""
+
+import os
+import weakref
+from collections import OrderedDict
+
+from sqlalchemy import select, update
+
+from backend import its, progresso
+from backend.database import ChatMessage, TutoriaSession
+from backend.pipeline import impressao
+
+MAX_SESSOES = int(os.getenv("SESSOES_CACHE", "1024"))
+
+_sessoes = OrderedDict()  # session_id -> EstadoSessao
+# Modelos de domínio decodificados; cada um vive enquanto alguma sessão o usa
+_modelos = weakref.WeakValueDictionary()  # impressao -> _ModeloDominio
+
+
+class _ModeloDominio(dict):
+    """dict comum que aceita referência fraca (para ficar em `_modelos`)."""
+
+
+class EstadoSessao:
+    """O que um turno precisa da sessão, já decodificado."""
+
+    __slots__ = (
+        "versao",
+        "modelo_dominio",
+        "impressao_dominio",
+        "modelo_aluno",
+        "proximo_seq",
+        "ultima_mensagem_em",
+    )
+
+    def __init__(
+        self,
+        versao,
+        modelo_dominio,
+        impressao_dominio,
+        modelo_aluno,
+        proximo_seq,
+        ultima_mensagem_em,
+    ):
+        self.versao = versao
+        self.modelo_dominio = modelo_dominio  # Compartilhado: não alterar
+        self.impressao_dominio = impressao_dominio
+        self.modelo_aluno = modelo_aluno  # Com `topicos_status`
+        self.proximo_seq = proximo_seq
+        self.ultima_mensagem_em = ultima_mensagem_em
+
+    def copia(self):
+        """
+        Cópia que o turno pode alterar sem mexer no estado guardado. O modelo
+        do aluno só tem valores simples e as estatísticas por tópico, então a
+        cópia é rasa em dois níveis (bem mais barata que deepcopy).
+        """
+        aluno = dict(self.modelo_aluno)
+        aluno["topicos_status"] = {
+            topico: dict(stats)
+            for topico, stats in aluno.get("topicos_status", {}).items()
+        }
+        return EstadoSessao(
+            self.versao,
+            self.modelo_dominio,
+            self.impressao_dominio,
+            aluno,
+            self.proximo_seq,
+            self.ultima_mensagem_em,
+        )
+
+
+def _modelo_compartilhado(modelo_dominio_json):
+    chave = impressao(modelo_dominio_json or "")
+    modelo = _modelos.get(chave)
+    if modelo is None:
+        modelo = _ModeloDominio(its.carregar_json(modelo_dominio_json))
+        _modelos[chave] = modelo
+    return modelo, chave
+
+
+async def _ler_do_banco(db, sessao):
+    conteudo = (
+        await db.execute(
+            select(TutoriaSession.modelo_dominio, TutoriaSession.modelo_aluno).where(
+                TutoriaSession.id == sessao.id
+            )
+        )
+    ).one()
+    modelo_dominio, impressao_dominio = _modelo_compartilhado(conteudo.modelo_dominio)
+    modelo_aluno = its.carregar_json(conteudo.modelo_aluno)
+    modelo_aluno["topicos_status"] = await progresso.carregar_topicos_status(
+        db, sessao.id
+    )
+    ultima = (
+        await db.execute(
+            select(ChatMessage.seq, ChatMessage.data_criacao)
+            .where(ChatMessage.session_id == sessao.id)
+            .order_by(ChatMessage.seq.desc())
+            .limit(1)
+        )
+    ).first()
+    return EstadoSessao(
+        sessao.versao,
+        modelo_dominio,
+        impressao_dominio,
+        modelo_aluno,
+        ultima.seq + 1 if ultima else 1,
+        ultima.data_criacao if ultima else None,
+    )
+
+
+def _lembrar(session_id, estado):
+    if MAX_SESSOES <= 0:
+        return
+    _sessoes[session_id] = estado
+    _sessoes.move_to_end(session_id)
+    while len(_sessoes) > MAX_SESSOES:
+        _sessoes.popitem(last=False)
+
+
+async def carregar(db, sessao):
+    """
+    Estado de `sessao` (lida sem os blobs) para um turno: da memória se a
+    versão confere, senão do banco. Devolve uma cópia alterável.
+    """
+    estado = _sessoes.get(sessao.id)
+    if estado is None or estado.versao != sessao.versao:
+        estado = await _ler_do_banco(db, sessao)
+        _lembrar(sessao.id, estado)
+    else:
+        _sessoes.move_to_end(sessao.id)
+    return estado.copia()
+
+
+def guardar(sessao, estado):
+    """Depois do commit do turno: `estado` passa a valer para a nova versão."""
+    estado.versao = sessao.versao
+    _lembrar(sessao.id, estado)
+
+
+def invalidar(*session_ids):
+    """Descarta o estado guardado neste worker."""
+    for session_id in session_ids:
+        _sessoes.pop(session_id, None)
+
+
+async def incrementar_versao(db, session_ids):
+    """
+    Para quem grava progresso ou mensagens de sessões fora do turno do chat:
+    muda a versão (na mesma transação), o que invalida o estado em todos os
+    workers e faz um turno em andamento nessas sessões falhar com 409.
+    """
+    if not session_ids:
+        return
+    await db.execute(
+        update(TutoriaSession)
+        .where(TutoriaSession.id.in_(session_ids))
+        .values(versao=TutoriaSession.versao + 1)
+        .execution_options(synchronize_session=False)
+    )
+    invalidar(*session_ids)
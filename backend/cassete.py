@@ -0,0 +1,178 @@
+"""
+Gravação e reprodução ("cassete") das chamadas ao LLM e ao Whisper.
+
+Testar desempenho ou regressões do fluxo do ITS exigia a API do Gemini de
+verdade: lenta, paga e com respostas diferentes a cada vez. Com
+`CASSETE_MODO`:
+
+- `gravar`: as chamadas vão ao provedor normalmente, e cada uma é anotada
+  em `CASSETE_DIR/<CASSETE_NOME>.jsonl` com a impressão da requisição, a
+  resposta e a latência original;
+- `reproduzir`: nenhuma chamada sai do processo. A resposta vem da
+  gravação com a mesma impressão; a mesma requisição feita várias vezes
+  recebe as respostas gravadas na ordem em que foram gravadas (a última se
+  repete depois disso). A latência é refeita com `CASSETE_VELOCIDADE`:
+  0 (padrão) responde na hora, 1 espera o tempo original, 10 espera um
+  décimo dele. Uma requisição sem gravação levanta
+  `CasseteSemGravacaoError`;
+- vazio (padrão): desligado.
+
+Passam pelo cassete as chamadas ao modelo (`its._gerar`), o envio de
+arquivos ao Gemini e a transcrição do Whisper (a impressão é a do áudio e
+o nome do modelo). Assim uma sessão real gravada pode ser refeita offline,
+e o que sobra no perfil de `/its/iniciar` e `/its/chat` é o custo do
+próprio backend.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from types import SimpleNamespace
+
+MODO = os.getenv("CASSETE_MODO", "")
+PASTA = os.getenv("CASSETE_DIR", "cassetes")
+NOME = os.getenv("CASSETE_NOME", "padrao")
+VELOCIDADE = float(os.getenv("CASSETE_VELOCIDADE", "0"))
+
+GRAVANDO = MODO == "gravar"
+REPRODUZINDO = MODO == "reproduzir"
+
+log = logging.getLogger(__name__)
+
+_trava = threading.Lock()
+_gravacoes = None  # (tipo, chave) -> [entradas], carregado na 1ª reprodução
+_posicoes = defaultdict(int)  # (tipo, chave) -> próxima entrada a servir
+
+
+class CasseteSemGravacaoError(Exception):
+    """Modo reprodução e a requisição não está no cassete."""
+
+
+def _arquivo():
+    return os.path.join(PASTA, f"{NOME}.jsonl")
+
+
+def _impressao(*partes):
+    return hashlib.sha256(
+        json.dumps(partes, ensure_ascii=False, sort_keys=True).encode()
+    ).hexdigest()
+
+
+def _parte_estavel(parte):
+    """Representação de uma parte do conteúdo que não muda entre execuções."""
+    if isinstance(parte, str):
+        return parte
+    # Arquivos enviados ao Gemini: o nome de exibição é o do arquivo local
+    # (o id do blob), o `name` remoto muda a cada envio
+    return getattr(parte, "display_name", None) or getattr(parte, "name", repr(parte))
+
+
+def _carregar():
+    global _gravacoes
+    _gravacoes = defaultdict(list)
+    try:
+        with open(_arquivo()) as entrada:
+            for linha in entrada:
+                item = json.loads(linha)
+                _gravacoes[(item["tipo"], item["chave"])].append(item)
+    except FileNotFoundError:
+        pass
+    log.info(
+        "Cassete carregado",
+        extra={"cassete": _arquivo(), "gravacoes": sum(map(len, _gravacoes.values()))},
+    )
+
+
+def _reproduzir(tipo, chave):
+    with _trava:
+        if _gravacoes is None:
+            _carregar()
+        itens = _gravacoes.get((tipo, chave))
+        if not itens:
+            raise CasseteSemGravacaoError(
+                f"Sem gravação de {tipo} para {chave[:12]} em {_arquivo()}"
+            )
+        posicao = _posicoes[(tipo, chave)]
+        _posicoes[(tipo, chave)] = posicao + 1
+        item = itens[min(posicao, len(itens) - 1)]
+    if VELOCIDADE > 0:
+        time.sleep(item["latencia"] / VELOCIDADE)
+    return item["resposta"]
+
+
+def _gravar(tipo, chave, resposta, latencia):
+    linha = json.dumps(
+        {"tipo": tipo, "chave": chave, "resposta": resposta, "latencia": latencia},
+        ensure_ascii=False,
+    )
+    with _trava:
+        os.makedirs(PASTA, exist_ok=True)
+        with open(_arquivo(), "a") as saida:
+            saida.write(linha + "\n")
+
+
+def _passar(tipo, chave, chamar, para_gravacao, da_gravacao):
+    if REPRODUZINDO:
+        return da_gravacao(_reproduzir(tipo, chave))
+    inicio = time.perf_counter()
+    resultado = chamar()
+    if GRAVANDO:
+        _gravar(tipo, chave, para_gravacao(resultado), time.perf_counter() - inicio)
+    return resultado
+
+
+# --- Tipos de chamada ---
+def _resposta_llm_para_gravacao(resposta):
+    uso = getattr(resposta, "usage_metadata", None)
+    return {
+        "text": resposta.text,
+        "usage_metadata": {
+            "prompt_token_count": getattr(uso, "prompt_token_count", 0) or 0,
+            "candidates_token_count": getattr(uso, "candidates_token_count", 0) or 0,
+        },
+    }
+
+
+def _resposta_llm_gravada(dados):
+    return SimpleNamespace(
+        text=dados["text"], usage_metadata=SimpleNamespace(**dados["usage_metadata"])
+    )
+
+
+def llm(conteudo, chamar):
+    """`chamar()` (a geração de verdade) ou a resposta gravada para `conteudo`."""
+    partes = conteudo if isinstance(conteudo, list) else [conteudo]
+    chave = _impressao([_parte_estavel(p) for p in partes])
+    return _passar(
+        "llm", chave, chamar, _resposta_llm_para_gravacao, _resposta_llm_gravada
+    )
+
+
+def envio_arquivo(caminho, chamar):
+    """Envio de arquivo ao Gemini (`chamar()`), pela impressão do conteúdo."""
+    h = hashlib.sha256()
+    with open(caminho, "rb") as f:
+        for bloco in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(bloco)
+    return _passar(
+        "arquivo",
+        h.hexdigest(),
+        chamar,
+        lambda a: {"name": a.name, "display_name": getattr(a, "display_name", None)},
+        lambda d: SimpleNamespace(state=SimpleNamespace(name="ACTIVE"), **d),
+    )
+
+
+def transcricao(impressao_audio, nome_modelo, chamar):
+    """Texto do Whisper (`chamar()`) para o áudio de impressão `impressao_audio`."""
+    return _passar(
+        "transcricao",
+        _impressao(impressao_audio, nome_modelo),
+        chamar,
+        lambda texto: texto,
+        lambda texto: texto,
+    )
@@ -0,0 +1,128 @@
+"""
+Controle de concorrência por sessão de tutoria.
+
+Um turno do chat lê a sessão, passa segundos esperando o LLM e só então grava.
+Duas mensagens rápidas do mesmo aluno (ou dois workers do uvicorn atendendo a
+mesma sessão) poderiam intercalar e perder um turno. Duas proteções:
+
+1. Lease no banco (`leases_sessoes`): antes do turno, o processo grava uma
+   linha com o seu token e um prazo. Quem chega com a sessão ocupada espera
+   um pouco e, se ela não for liberada, recebe `SessaoOcupadaError` (409).
+   Como a linha está no banco, vale entre processos. Enquanto o turno roda,
+   o prazo é renovado a cada terço dele, então a fila do LLM e as novas
+   tentativas podem demorar o quanto for; se o processo morrer no meio do
+   turno, o lease expira sozinho.
+2. Versão otimista (`TutoriaSession.versao`): o UPDATE da sessão só acontece
+   se a versão não mudou desde a leitura. Pega o caso raro de um lease que
+   expirou com o turno ainda em andamento (ex.: renovações falhando com o
+   banco travado).
+
+Cada sessão tem a sua linha, então sessões diferentes seguem em paralelo.
+"""
+
+import asyncio
+import logging
+import os
+import time
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, update
+
+from backend.database import AsyncSessionLocal, SessaoLease, insert_upsert
+
+# Prazo do lease, renovado durante o turno: é quanto uma sessão fica presa
+# depois que o processo que a segurava morreu
+LEASE_SEGUNDOS = float(os.getenv("SESSAO_LEASE_SEGUNDOS", "120"))
+# Quanto esperar a sessão ser liberada antes de responder 409
+ESPERA_SEGUNDOS = float(os.getenv("SESSAO_LEASE_ESPERA", "2"))
+INTERVALO_TENTATIVA = 0.1
+# Sugestão de nova tentativa enviada ao cliente (header Retry-After)
+RETRY_AFTER_SEGUNDOS = 2
+
+log = logging.getLogger(__name__)
+
+
+class SessaoOcupadaError(Exception):
+    """Outro turno da mesma sessão está em andamento."""
+
+
+async def _tentar_adquirir(session_id, dono):
+    """
+    Um único comando: insere o lease ou toma um que já expirou. Devolve True
+    se a linha ficou com `dono`.
+    """
+    agora = datetime.utcnow()
+    async with AsyncSessionLocal() as db:
+        comando = insert_upsert(db, SessaoLease).values(
+            session_id=session_id,
+            dono=dono,
+            expira_em=agora + timedelta(seconds=LEASE_SEGUNDOS),
+        )
+        comando = comando.on_conflict_do_update(
+            index_elements=["session_id"],
+            set_={"dono": comando.excluded.dono, "expira_em": comando.excluded.expira_em},
+            where=SessaoLease.__table__.c.expira_em < agora,
+        )
+        resultado = await db.execute(comando)
+        await db.commit()
+        return resultado.rowcount == 1
+
+
+async def _renovar(session_id, dono):
+    """Estende o prazo do lease de `dono` a cada terço dele, até ser cancelada."""
+    while True:
+        await asyncio.sleep(LEASE_SEGUNDOS / 3)
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(SessaoLease)
+                    .where(SessaoLease.session_id == session_id, SessaoLease.dono == dono)
+                    .values(
+                        expira_em=datetime.utcnow() + timedelta(seconds=LEASE_SEGUNDOS)
+                    )
+                )
+                await db.commit()
+        except Exception as e:
+            # Fica para a próxima; o prazo ainda tem dois terços
+            log.warning(
+                "Falha ao renovar o lease da sessão",
+                extra={"session_id": session_id, "erro": str(e)},
+            )
+
+
+async def _liberar(session_id, dono):
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            delete(SessaoLease).where(
+                SessaoLease.session_id == session_id, SessaoLease.dono == dono
+            )
+        )
+        await db.commit()
+
+
+@asynccontextmanager
+async def turno_exclusivo(session_id, espera=None):
+    """
+    Garante que só um turno por sessão roda por vez, em qualquer processo.
+    Levanta SessaoOcupadaError se a sessão continuar ocupada após `espera`.
+    """
+    espera = ESPERA_SEGUNDOS if espera is None else espera
+    dono = uuid.uuid4().hex
+    limite = time.monotonic() + espera
+
+    while not await _tentar_adquirir(session_id, dono):
+        if time.monotonic() >= limite:
+            raise SessaoOcupadaError(
+                f"A sessão {session_id} já está processando outra mensagem."
+            )
+        await asyncio.sleep(INTERVALO_TENTATIVA)
+
+    renovacao = asyncio.create_task(_renovar(session_id, dono))
+    try:
+        yield
+    finally:
+        renovacao.cancel()
+        await asyncio.gather(renovacao, return_exceptions=True)
+        await _liberar(session_id, dono)
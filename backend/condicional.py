@@ -0,0 +1,84 @@
+"""
+GETs condicionais (ETag / Last-Modified) para as leituras do frontend.
+
+O Streamlit reexecuta a página inteira a cada interação, e as listas e
+detalhes (inclusive as transcrições completas de `/its/sessao/{id}`) eram
+baixados de novo mesmo sem nada ter mudado. Agora toda resposta dessas rotas
+leva um validador e `Cache-Control: no-cache`; o cliente guarda o corpo e
+reenvia o validador (`If-None-Match` / `If-Modified-Since`), e a resposta é
+um 304 sem corpo enquanto o conteúdo for o mesmo.
+
+- Validador barato: quando a rota sabe dizer se algo mudou sem montar a
+  resposta (versão da sessão, data de edição da aula), ela confere
+  `nao_modificado` antes de ler os blobs e responde 304 direto.
+- Validador pelo conteúdo: nas listas, o ETag é a impressão do JSON
+  montado; o banco ainda é consultado, mas nada é enviado nem decodificado
+  pelo cliente.
+"""
+
+import json
+from datetime import timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from fastapi import Response
+
+from backend.pipeline import impressao
+
+CACHE_CONTROL = "no-cache"
+
+
+def etag(*partes):
+    """ETag fraco a partir de um conjunto de valores."""
+    return f'W/"{impressao(*partes)[:32]}"'
+
+
+def _data_http(data):
+    """datetime (UTC sem fuso, como no banco) no formato de data do HTTP."""
+    return format_datetime(data.replace(tzinfo=timezone.utc, microsecond=0), usegmt=True)
+
+
+def _cabecalhos(tag, ultima_modificacao=None):
+    cabecalhos = {"ETag": tag, "Cache-Control": CACHE_CONTROL}
+    if ultima_modificacao:
+        cabecalhos["Last-Modified"] = _data_http(ultima_modificacao)
+    return cabecalhos
+
+
+def nao_modificado(request, tag, ultima_modificacao=None):
+    """
+    Resposta 304 se o cliente já tem esta versão, senão None. Como manda o
+    HTTP, `If-Modified-Since` só vale quando não há `If-None-Match`.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        tags = {t.strip().removeprefix("W/") for t in if_none_match.split(",")}
+        atual = tag.removeprefix("W/")
+        if atual not in tags and "*" not in tags:
+            return None
+    elif ultima_modificacao and request.headers.get("if-modified-since"):
+        try:
+            desde = parsedate_to_datetime(request.headers["if-modified-since"])
+        except (TypeError, ValueError):
+            return None
+        if ultima_modificacao.replace(tzinfo=timezone.utc, microsecond=0) > desde:
+            return None
+    else:
+        return None
+    return Response(status_code=304, headers=_cabecalhos(tag, ultima_modificacao))
+
+
+def responder(request, dados, tag=None, ultima_modificacao=None):
+    """
+    JSON de `dados` com os validadores, ou 304 se o cliente já o tem. Sem
+    `tag`, o ETag é a impressão do próprio JSON.
+    """
+    corpo = json.dumps(dados, ensure_ascii=False)
+    tag = tag or etag(corpo)
+    resposta = nao_modificado(request, tag, ultima_modificacao)
+    if resposta is None:
+        resposta = Response(
+            corpo,
+            media_type="application/json",
+            headers=_cabecalhos(tag, ultima_modificacao),
+        )
+    return resposta
@@ -0,0 +1,294 @@
+from sqlalchemy import (
+    event,
+    Column,
+    Integer,
+    Float,
+    LargeBinary,
+    String,
+    Text,
+    DateTime,
+    ForeignKey,
+    Index,
+    UniqueConstraint,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.orm import declarative_base, deferred
+from datetime import datetime
+import os
+
+# --- CONFIGURAÇÃO DO BANCO DE DADOS ---
+# A URL define o banco; com outro driver async (ex.: postgresql+asyncpg://...)
+# o mesmo código atende um servidor de banco de dados.
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./sigma_teacher.db")
+
+# Ajustes do SQLite (ignorados em outros bancos)
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_KB = int(os.getenv("SQLITE_CACHE_KB", "65536"))
+# Com WAL várias conexões leem em paralelo; o pool limita quantas ficam abertas
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "16"))
+
+Base = declarative_base()
+
+
+def _configurar_sqlite(conexao_dbapi, _registro):
+    """
+    WAL permite leituras simultâneas a uma escrita (o professor gravando não
+    trava os alunos lendo); synchronous=NORMAL é seguro com WAL e evita um
+    fsync por commit; busy_timeout espera o lock em vez de falhar na hora.
+    """
+    cursor = conexao_dbapi.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_KB}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+def criar_engine(url):
+    """Cria o engine async; no SQLite aplica os PRAGMAs a cada conexão nova."""
+    novo_engine = create_async_engine(
+        url, pool_size=DB_POOL_SIZE, max_overflow=DB_POOL_SIZE
+    )
+    if novo_engine.dialect.name == "sqlite":
+        event.listen(novo_engine.sync_engine, "connect", _configurar_sqlite)
+    return novo_engine
+
+
+engine = criar_engine(DATABASE_URL)
+AsyncSessionLocal = async_sessionmaker(
+    engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+
+
+# Colunas grandes (transcrições e JSONs) ficam fora do SELECT padrão; quem
+# precisa delas carrega com .options(undefer_group(CONTEUDO)).
+CONTEUDO = "conteudo"
+
+
+# INSERT com ON CONFLICT (upsert) de cada banco suportado
+_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+def insert_upsert(db, modelo):
+    """INSERT do dialeto do banco de `db`, que aceita .on_conflict_do_update()."""
+    return _INSERTS[db.bind.dialect.name](modelo.__table__)
+
+
+async def criar_tabelas():
+    """Cria as tabelas que ainda não existem."""
+    async with engine.begin() as conexao:
+        await conexao.run_sync(Base.metadata.create_all)
+
+
+# Define a tabela do banco
+class AudioLog(Base):
+    __tablename__ = "audios"
+    __table_args__ = (Index("ix_audios_data_criacao_id", "data_criacao", "id"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    filename_original = Column(String)  # Nome que o usuário mandou
+    caminho_arquivo = Column(String)  # Onde salvamos no disco
+    transcricao = deferred(Column(Text), group=CONTEUDO)  # O texto gerado pelo Whisper
+    transcricao_editada = deferred(
+        Column(Text, nullable=True), group=CONTEUDO
+    )  # Transcrição editada pelo usuário
+    data_criacao = Column(DateTime, default=datetime.utcnow)
+    data_edicao = Column(DateTime, nullable=True)  # Última edição da transcrição
+
+
+# Define a tabela para sessões de tutoria
+class TutoriaSession(Base):
+    __tablename__ = "sessoes_tutoria"
+    __table_args__ = (
+        Index("ix_sessoes_tutoria_data_criacao_id", "data_criacao", "id"),
+        # Sem AUTOINCREMENT o SQLite reaproveita o maior id apagado, e uma
+        # sessão nova herdaria o id de uma arquivada
+        {"sqlite_autoincrement": True},
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    # Guardamos estruturas complexas como TEXT (JSON stringfied)
+    modelo_dominio = deferred(Column(Text), group=CONTEUDO)  # O que deve ser ensinado
+    modelo_aluno = deferred(Column(Text), group=CONTEUDO)  # O nível atual do aluno
+    historico_chat = deferred(
+        Column(Text, nullable=True), group=CONTEUDO
+    )  # Legado: hoje em ChatMessage
+    topico_atual = Column(String)  # O tópico sendo ensinado agora
+    status = Column(String)  # "ativo", "concluido"
+    audio_ids = Column(String, default="[]")
+    aluno = Column(String, nullable=True)  # Nome na lista da turma (/its/iniciar-turma)
+    data_criacao = Column(DateTime, default=datetime.utcnow)
+    # Controle otimista: todo UPDATE confere e incrementa a versão lida
+    versao = Column(Integer, nullable=False, default=0, server_default="0")
+
+    __mapper_args__ = {"version_id_col": versao}
+
+
+# Sessões movidas para o arquivo frio (ver backend/arquivo.py)
+class SessaoArquivada(Base):
+    __tablename__ = "sessoes_arquivadas"
+    __table_args__ = (
+        Index("ix_sessoes_arquivadas_data_criacao_id", "data_criacao", "id"),
+    )
+
+    id = Column(Integer, primary_key=True)  # Mesmo id da sessão original
+    topico_atual = Column(String)
+    status = Column(String)
+    aluno = Column(String, nullable=True)
+    data_criacao = Column(DateTime)  # Da sessão original
+    arquivada_em = Column(DateTime, default=datetime.utcnow)
+    # Sessão, mensagens e progresso num documento JSON comprimido com zstd
+    conteudo = deferred(Column(LargeBinary), group=CONTEUDO)
+
+
+# Turno em andamento por sessão (vale entre processos/workers até expirar)
+class SessaoLease(Base):
+    __tablename__ = "leases_sessoes"
+
+    session_id = Column(Integer, primary_key=True)
+    dono = Column(String, nullable=False)  # Token de quem está processando o turno
+    expira_em = Column(DateTime, nullable=False)
+
+
+# Requisições com chave de idempotência: em andamento ou a resposta guardada
+class RequisicaoIdempotente(Base):
+    __tablename__ = "requisicoes_idempotentes"
+    __table_args__ = (Index("ix_requisicoes_idempotentes_expira_em", "expira_em"),)
+
+    chave = Column(String, primary_key=True)  # "<rota>:<Idempotency-Key>"
+    impressao_corpo = Column(String, nullable=False)  # Mesmo pedido, mesma chave
+    dono = Column(String, nullable=False)  # Token de quem está processando
+    resposta = Column(Text, nullable=True)  # JSON; vazio enquanto em andamento
+    expira_em = Column(DateTime, nullable=False)
+    data_criacao = Column(DateTime, default=datetime.utcnow)
+
+
+# Mensagens do chat, uma linha por mensagem (só recebe INSERTs)
+class ChatMessage(Base):
+    __tablename__ = "mensagens_chat"
+    __table_args__ = (
+        Index("ix_mensagens_chat_sessao_seq", "session_id", "seq", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    session_id = Column(Integer, ForeignKey("sessoes_tutoria.id"), nullable=False)
+    seq = Column(Integer, nullable=False)  # Ordem da mensagem dentro da sessão
+    role = Column(String)  # "user" ou "model" (formato do Gemini)
+    texto = Column(Text)
+    data_criacao = Column(DateTime, default=datetime.utcnow)
+
+
+# Progresso do aluno em cada tópico (antes ficava no JSON de modelo_aluno)
+class TopicProgress(Base):
+    __tablename__ = "progresso_topicos"
+    __table_args__ = (
+        Index("ix_progresso_topicos_sessao_topico", "session_id", "topico", unique=True),
+        Index("ix_progresso_topicos_topico_status", "topico", "status"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    session_id = Column(Integer, ForeignKey("sessoes_tutoria.id"), nullable=False)
+    topico = Column(String, nullable=False)
+    status = Column(String, default="nao_iniciado")  # nao_iniciado, em_progresso, compreendido
+    tentativas = Column(Integer, default=0)
+    acertos = Column(Integer, default=0)
+    compreensao = Column(Integer, default=0)  # 0-100
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+# Contadores da turma por curso (conjunto de aulas), atualizados a cada turno
+class ClassCourseStats(Base):
+    __tablename__ = "estatisticas_cursos"
+
+    curso = Column(String, primary_key=True)  # audio_ids ordenados, em JSON
+    sessoes_iniciadas = Column(Integer, default=0)
+    sessoes_concluidas = Column(Integer, default=0)
+    atualizado_em = Column(DateTime, default=datetime.utcnow)
+
+
+# Contadores da turma por curso e tópico
+class ClassTopicStats(Base):
+    __tablename__ = "estatisticas_topicos"
+    __table_args__ = (UniqueConstraint("curso", "topico"),)
+
+    id = Column(Integer, primary_key=True)
+    curso = Column(String, nullable=False)
+    topico = Column(String, nullable=False)
+    tentativas = Column(Integer, default=0)
+    acertos = Column(Integer, default=0)
+    soma_compreensao = Column(Integer, default=0)  # Média = soma / tentativas
+    segundos_no_topico = Column(Float, default=0)
+    # Funil: alunos que chegaram ao tópico, que tentaram e que o compreenderam
+    alunos_chegaram = Column(Integer, default=0)
+    alunos_tentaram = Column(Integer, default=0)
+    alunos_compreenderam = Column(Integer, default=0)
+    atualizado_em = Column(DateTime, default=datetime.utcnow)
+
+
+# Avaliações já feitas, reaproveitadas para respostas iguais ou quase iguais
+class RespostaCache(Base):
+    __tablename__ = "cache_respostas"
+    __table_args__ = (
+        Index("ix_cache_respostas_escopo_impressao", "escopo", "impressao"),
+        Index("ix_cache_respostas_ultimo_uso", "ultimo_uso"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    escopo = Column(String, nullable=False)  # Versão do modelo de domínio + tópico
+    impressao = Column(String, nullable=False)  # Hash da resposta normalizada
+    resposta_normalizada = Column(Text)
+    assinatura = Column(Text)  # MinHash da resposta (JSON)
+    resultado = Column(Text)  # acertou, compreensao, feedback (JSON)
+    usos = Column(Integer, default=0)
+    ultimo_uso = Column(DateTime, default=datetime.utcnow)
+    data_criacao = Column(DateTime, default=datetime.utcnow)
+
+
+# Saída de cada etapa do pipeline de conteúdo (por aula)
+class EtapaPipeline(Base):
+    __tablename__ = "pipeline_etapas"
+    __table_args__ = (UniqueConstraint("audio_id", "etapa", "chave"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    audio_id = Column(Integer, index=True)
+    etapa = Column(String)  # decodificacao, transcricao, limpeza, segmentacao, ...
+    chave = Column(String, default="")  # Impressão do trecho, para etapas por trecho
+    impressao_entrada = Column(String, index=True)  # Hash do que gerou a saída
+    impressao = Column(String)  # Hash da saída
+    saida = Column(Text, nullable=True)
+    atualizado_em = Column(DateTime, default=datetime.utcnow)
+
+
+# Modelos de domínio já gerados, endereçados pela impressão das entradas
+class ModeloDominioCache(Base):
+    __tablename__ = "modelos_dominio_cache"
+
+    impressao = Column(String, primary_key=True)
+    modelo_dominio = Column(Text)
+    audio_ids = Column(String, default="[]")
+    blob_ids = Column(String, default="[]")  # Arquivos (PDFs) usados na geração
+    data_criacao = Column(DateTime, default=datetime.utcnow)
+    ultimo_uso = Column(DateTime, default=datetime.utcnow)  # Podado pela coleta de lixo
+
+
+# Arquivos enviados ao backend, endereçados pelo sha256 do conteúdo (backend/blobs.py)
+class Blob(Base):
+    __tablename__ = "blobs"
+    __table_args__ = (Index("ix_blobs_referencias_ultimo_uso", "referencias", "ultimo_uso"),)
+
+    id = Column(String, primary_key=True)  # sha256 do conteúdo, em hexadecimal
+    tamanho = Column(Integer)
+    mime = Column(String)
+    nome_original = Column(String)  # Nome do primeiro envio
+    referencias = Column(Integer, default=0)  # Quantos registros dependem do conteúdo
+    ultimo_uso = Column(DateTime, default=datetime.utcnow)
+    data_criacao = Column(DateTime, default=datetime.utcnow)
+
+
+# Dependência para pegar a sessão do banco
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,310 @@
+"""
+Governador global das chamadas ao LLM.
+
+Todas as etapas do ITS passam por aqui antes de chamar o Gemini. O governador
+limita quantas chamadas rodam ao mesmo tempo, controla a taxa de requisições
+(token bucket), refaz chamadas que falharam por limite de taxa ou instabilidade
+com backoff exponencial + jitter e abre um disjuntor quando o provedor está
+degradado, para rejeitar novas chamadas rapidamente em vez de empilhá-las.
+
+As chamadas interativas (turnos de chat) têm prioridade sobre as chamadas em
+lote (geração do modelo de domínio) na fila por vagas de concorrência. A
+taxa é cobrada antes da vaga: quem espera por token não segura uma vaga que
+uma chamada interativa poderia usar.
+
+As esperas (vaga, taxa, backoff) bloqueiam a thread de quem chama, então o
+backend roda as chamadas em threads próprias (`em_thread`), fora do
+threadpool do FastAPI/anyio; a espera por vaga e por taxa tem limite
+(`LLM_ESPERA_MAXIMA`), depois dela a chamada é rejeitada.
+"""
+
+import asyncio
+import contextvars
+import functools
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from google.api_core import exceptions as google_exceptions
+
+# --- Configuração (via variáveis de ambiente) ---
+MAX_CONCORRENCIA = int(os.getenv("LLM_MAX_CONCORRENCIA", "4"))
+TAXA_POR_SEGUNDO = float(os.getenv("LLM_TAXA_POR_SEGUNDO", "2"))
+RAJADA = int(os.getenv("LLM_RAJADA", "4"))
+MAX_TENTATIVAS = int(os.getenv("LLM_MAX_TENTATIVAS", "4"))
+BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1"))
+BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "30"))
+CIRCUITO_LIMITE_FALHAS = int(os.getenv("LLM_CIRCUITO_FALHAS", "5"))
+CIRCUITO_ESPERA = float(os.getenv("LLM_CIRCUITO_ESPERA", "30"))
+# Quanto uma chamada espera, no total, por vaga e por taxa antes de desistir
+ESPERA_MAXIMA = float(os.getenv("LLM_ESPERA_MAXIMA", "120"))
+MAX_THREADS = int(os.getenv("LLM_MAX_THREADS", "32"))
+
+# --- Faixas de prioridade (menor valor = atendido primeiro) ---
+PRIORIDADE_INTERATIVA = 0
+PRIORIDADE_LOTE = 1
+
+# Erros do provedor que valem uma nova tentativa (429, 500, 503, 504)
+ERROS_RETENTAVEIS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.TooManyRequests,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+    ConnectionError,
+    TimeoutError,
+)
+
+log = logging.getLogger(__name__)
+
+
+class LLMIndisponivelError(Exception):
+    """
+    A chamada foi rejeitada: disjuntor aberto (provedor degradado) ou fila
+    cheia por mais de `ESPERA_MAXIMA`.
+    """
+
+
+class SemaforoPrioritario:
+    """Semáforo que entrega as vagas livres primeiro às faixas de maior prioridade."""
+
+    def __init__(self, vagas):
+        self._vagas = vagas
+        self._cond = threading.Condition()
+        self._fila = []  # heap de (prioridade, ordem_chegada)
+        self._contador = itertools.count()
+
+    def adquirir(self, prioridade, limite=None):
+        """Espera uma vaga até o instante `limite` (monotonic); None espera sempre."""
+        with self._cond:
+            ticket = (prioridade, next(self._contador))
+            heapq.heappush(self._fila, ticket)
+            while self._vagas <= 0 or self._fila[0] != ticket:
+                espera = None if limite is None else limite - time.monotonic()
+                if espera is not None and espera <= 0:
+                    self._fila.remove(ticket)
+                    heapq.heapify(self._fila)
+                    self._cond.notify_all()
+                    raise LLMIndisponivelError("Fila do LLM cheia; tente novamente.")
+                self._cond.wait(espera)
+            heapq.heappop(self._fila)
+            self._vagas -= 1
+            # Pode haver mais vagas livres para o próximo da fila
+            self._cond.notify_all()
+
+    def liberar(self):
+        with self._cond:
+            self._vagas += 1
+            self._cond.notify_all()
+
+    def em_espera(self):
+        with self._cond:
+            return len(self._fila)
+
+
+class TokenBucket:
+    """Limita a taxa média de chamadas, permitindo rajadas curtas."""
+
+    def __init__(self, taxa, capacidade):
+        self.taxa = taxa
+        self.capacidade = capacidade
+        self._tokens = float(capacidade)
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reabastecer(self):
+        agora = time.monotonic()
+        self._tokens = min(
+            self.capacidade, self._tokens + (agora - self._ultimo) * self.taxa
+        )
+        self._ultimo = agora
+
+    def consumir(self, limite=None):
+        """Espera um token até o instante `limite` (monotonic); None espera sempre."""
+        if self.taxa <= 0:
+            return
+        while True:
+            with self._lock:
+                self._reabastecer()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                espera = (1 - self._tokens) / self.taxa
+            if limite is not None and time.monotonic() + espera > limite:
+                raise LLMIndisponivelError("Limite de taxa do LLM; tente novamente.")
+            time.sleep(espera)
+
+
+class Disjuntor:
+    """
+    Circuit breaker: após N falhas seguidas abre e rejeita chamadas até passar
+    o tempo de espera; então deixa uma chamada de teste (meio-aberto) passar.
+    """
+
+    FECHADO = "fechado"
+    ABERTO = "aberto"
+    MEIO_ABERTO = "meio_aberto"
+
+    def __init__(self, limite_falhas, espera):
+        self.limite_falhas = limite_falhas
+        self.espera = espera
+        self.estado = self.FECHADO
+        self._falhas = 0
+        self._aberto_em = 0.0
+        self._teste_em_andamento = False
+        self._lock = threading.Lock()
+
+    def permitir(self):
+        with self._lock:
+            if self.estado == self.FECHADO:
+                return True
+            if self.estado == self.ABERTO:
+                if time.monotonic() - self._aberto_em < self.espera:
+                    return False
+                self.estado = self.MEIO_ABERTO
+            # Meio-aberto: apenas uma chamada de teste por vez
+            if self._teste_em_andamento:
+                return False
+            self._teste_em_andamento = True
+            return True
+
+    def registrar_sucesso(self):
+        with self._lock:
+            self._falhas = 0
+            self._teste_em_andamento = False
+            self.estado = self.FECHADO
+
+    def liberar_teste(self):
+        """A chamada terminou sem dizer nada sobre o provedor."""
+        with self._lock:
+            self._teste_em_andamento = False
+
+    def registrar_falha(self):
+        with self._lock:
+            self._falhas += 1
+            self._teste_em_andamento = False
+            if (
+                self.estado == self.MEIO_ABERTO
+                or self._falhas >= self.limite_falhas
+            ):
+                if self.estado != self.ABERTO:
+                    log.warning(
+                        "Disjuntor do LLM aberto", extra={"falhas": self._falhas}
+                    )
+                self.estado = self.ABERTO
+                self._aberto_em = time.monotonic()
+
+
+class Governador:
+    """Ponto único de passagem para as chamadas ao provedor de LLM."""
+
+    def __init__(
+        self,
+        max_concorrencia=MAX_CONCORRENCIA,
+        taxa_por_segundo=TAXA_POR_SEGUNDO,
+        rajada=RAJADA,
+        max_tentativas=MAX_TENTATIVAS,
+        backoff_base=BACKOFF_BASE,
+        backoff_max=BACKOFF_MAX,
+        limite_falhas=CIRCUITO_LIMITE_FALHAS,
+        espera_circuito=CIRCUITO_ESPERA,
+        espera_maxima=ESPERA_MAXIMA,
+    ):
+        self.semaforo = SemaforoPrioritario(max_concorrencia)
+        self.bucket = TokenBucket(taxa_por_segundo, rajada)
+        self.disjuntor = Disjuntor(limite_falhas, espera_circuito)
+        self.max_tentativas = max_tentativas
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.espera_maxima = espera_maxima
+
+    def _espera_backoff(self, tentativa):
+        """Backoff exponencial com 'full jitter'."""
+        teto = min(self.backoff_max, self.backoff_base * (2**tentativa))
+        return random.uniform(0, teto)
+
+    def executar(self, funcao, *args, prioridade=PRIORIDADE_INTERATIVA, **kwargs):
+        """
+        Executa `funcao(*args, **kwargs)` respeitando concorrência, taxa e
+        disjuntor. Erros retentáveis são refeitos com backoff; os demais sobem
+        imediatamente. Para o disjuntor, a chamada conta uma vez só (uma
+        falha depois de esgotar as tentativas), não uma vez por tentativa.
+        """
+        if not self.disjuntor.permitir():
+            raise LLMIndisponivelError(
+                "Provedor do LLM indisponível no momento (disjuntor aberto)."
+            )
+
+        try:
+            resultado = self._tentar(funcao, args, kwargs, prioridade)
+        except ERROS_RETENTAVEIS:
+            self.disjuntor.registrar_falha()
+            raise
+        except Exception:
+            # Desistiu na fila, ou erro do nosso lado (prompt inválido, etc.):
+            # não diz nada sobre o provedor, só libera a chamada de teste
+            self.disjuntor.liberar_teste()
+            raise
+        self.disjuntor.registrar_sucesso()
+        return resultado
+
+    def _tentar(self, funcao, args, kwargs, prioridade):
+        limite = time.monotonic() + self.espera_maxima
+        for tentativa in range(self.max_tentativas):
+            self.bucket.consumir(limite)
+            self.semaforo.adquirir(prioridade, limite)
+            try:
+                return funcao(*args, **kwargs)
+            except ERROS_RETENTAVEIS as e:
+                ultimo_erro = e
+            finally:
+                self.semaforo.liberar()
+
+            # Sem nova tentativa se acabaram ou se outras chamadas já abriram
+            # o disjuntor
+            if (
+                tentativa == self.max_tentativas - 1
+                or self.disjuntor.estado == Disjuntor.ABERTO
+            ):
+                break
+            espera = self._espera_backoff(tentativa)
+            log.warning(
+                "LLM: erro retentável, nova tentativa",
+                extra={
+                    "erro": type(ultimo_erro).__name__,
+                    "espera_s": round(espera, 1),
+                },
+            )
+            time.sleep(espera)
+
+        raise ultimo_erro
+
+    def estado(self):
+        """Resumo do estado atual (útil para depuração e métricas)."""
+        return {
+            "disjuntor": self.disjuntor.estado,
+            "em_espera": self.semaforo.em_espera(),
+            "tokens_disponiveis": round(self.bucket._tokens, 2),
+        }
+
+
+# Instância compartilhada por todas as etapas
+governador = Governador()
+
+_executor = ThreadPoolExecutor(max_workers=MAX_THREADS, thread_name_prefix="llm")
+
+
+async def em_thread(funcao, *args, **kwargs):
+    """
+    `funcao(*args, **kwargs)` (que chama o LLM) numa das threads do LLM, com
+    as variáveis de contexto de quem chamou (id da requisição, etc.).
+    """
+    contexto = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        _executor, functools.partial(contexto.run, funcao, *args, **kwargs)
+    )
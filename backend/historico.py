@@ -0,0 +1,50 @@
+"""
+Histórico do chat guardado como linhas em `mensagens_chat`.
+
+Cada turno apenas insere as mensagens novas; nada é relido ou reescrito,
+então o custo de um turno não cresce com o tamanho da sessão.
+"""
+
+from sqlalchemy import func, select
+
+from backend.database import ChatMessage
+
+
+async def proximo_seq(db, session_id):
+    """Próximo número de sequência da sessão (busca pelo índice session_id/seq)."""
+    ultimo = await db.scalar(
+        select(func.max(ChatMessage.seq)).where(ChatMessage.session_id == session_id)
+    )
+    return (ultimo or 0) + 1
+
+
+async def adicionar_mensagens(db, session_id, mensagens, seq=None):
+    """
+    Insere as mensagens [(role, texto), ...] ao final do histórico da sessão.
+    Não faz commit; as mensagens entram na mesma transação do turno. `seq`
+    evita a consulta quando o próximo número já é conhecido.
+    """
+    if seq is None:
+        seq = await proximo_seq(db, session_id)
+    registros = []
+    for role, texto in mensagens:
+        registro = ChatMessage(session_id=session_id, seq=seq, role=role, texto=texto)
+        db.add(registro)
+        registros.append(registro)
+        seq += 1
+    return registros
+
+
+async def listar_mensagens(db, session_id, depois_de=0):
+    """Mensagens da sessão em ordem (só as com seq maior que `depois_de`)."""
+    resultado = await db.scalars(
+        select(ChatMessage)
+        .where(ChatMessage.session_id == session_id, ChatMessage.seq > depois_de)
+        .order_by(ChatMessage.seq)
+    )
+    return resultado.all()
+
+
+def para_gemini(role, texto):
+    """Mensagem no formato usado pelas etapas do ITS (formato do Gemini)."""
+    return {"role": role, "parts": [{"text": texto}]}
@@ -0,0 +1,212 @@
+"""
+Chaves de idempotência para `/its/chat` e `/its/iniciar`.
+
+O frontend espera 60 s por um turno e 120 s pela criação de uma sessão.
+Quando o prazo estoura, o backend continua trabalhando, o usuário clica de
+novo e pagamos outra rodada de chamadas ao LLM; no chat, a mensagem
+repetida ainda entrava duas vezes no histórico. Agora o cliente manda
+`Idempotency-Key` (uma por envio, reaproveitada se o mesmo envio for
+repetido) e:
+
+- repetição enquanto a original roda neste worker: espera a mesma
+  computação e recebe a mesma resposta;
+- repetição enquanto a original roda em outro worker: consulta o banco até
+  a resposta aparecer (até `IDEMPOTENCIA_ESPERA_SEGUNDOS`, depois 409);
+- repetição depois que a original terminou: recebe a resposta guardada, por
+  `IDEMPOTENCIA_RETENCAO_HORAS`;
+- a mesma chave com outro corpo: `ChaveReutilizadaError` (422).
+
+A reserva da chave é uma linha em `requisicoes_idempotentes`, gravada como
+os leases de sessão (backend/concorrencia.py): um upsert que só toma a
+linha se ela expirou. Se a original falhar, a linha é apagada e a próxima
+tentativa roda de novo. Só respostas de sucesso são guardadas.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import delete, select, update
+
+from backend.database import AsyncSessionLocal, RequisicaoIdempotente, insert_upsert
+from backend.pipeline import impressao
+
+RETENCAO_HORAS = float(os.getenv("IDEMPOTENCIA_RETENCAO_HORAS", "24"))
+# Prazo da reserva: se o processo morrer no meio, outro pode assumir a chave
+PRAZO_SEGUNDOS = float(os.getenv("IDEMPOTENCIA_PRAZO_SEGUNDOS", "300"))
+# Quanto uma repetição espera a original terminar em outro worker
+ESPERA_SEGUNDOS = float(os.getenv("IDEMPOTENCIA_ESPERA_SEGUNDOS", "120"))
+INTERVALO_HORAS = float(os.getenv("IDEMPOTENCIA_INTERVALO_HORAS", "6"))
+INTERVALO_CONSULTA = 0.5
+TAMANHO_MAXIMO_CHAVE = 200
+
+log = logging.getLogger(__name__)
+
+# Computações em andamento neste worker: chave -> (impressão do corpo, Future)
+_em_andamento = {}
+
+
+class ChaveReutilizadaError(Exception):
+    """A mesma chave de idempotência chegou com outro corpo."""
+
+
+class EmAndamentoError(Exception):
+    """A requisição original ainda não terminou (ou foi interrompida)."""
+
+
+async def _reservar(chave, impressao_corpo, dono):
+    """Insere a reserva ou toma uma que expirou. True se ficou com `dono`."""
+    agora = datetime.utcnow()
+    async with AsyncSessionLocal() as db:
+        comando = insert_upsert(db, RequisicaoIdempotente).values(
+            chave=chave,
+            impressao_corpo=impressao_corpo,
+            dono=dono,
+            resposta=None,
+            expira_em=agora + timedelta(seconds=PRAZO_SEGUNDOS),
+            data_criacao=agora,
+        )
+        comando = comando.on_conflict_do_update(
+            index_elements=["chave"],
+            set_={
+                "impressao_corpo": comando.excluded.impressao_corpo,
+                "dono": comando.excluded.dono,
+                "resposta": None,
+                "expira_em": comando.excluded.expira_em,
+                "data_criacao": comando.excluded.data_criacao,
+            },
+            where=RequisicaoIdempotente.__table__.c.expira_em < agora,
+        )
+        resultado = await db.execute(comando)
+        await db.commit()
+        return resultado.rowcount == 1
+
+
+async def _ler(chave):
+    async with AsyncSessionLocal() as db:
+        return (
+            await db.execute(
+                select(
+                    RequisicaoIdempotente.impressao_corpo, RequisicaoIdempotente.resposta
+                ).where(RequisicaoIdempotente.chave == chave)
+            )
+        ).first()
+
+
+async def _guardar(chave, dono, resposta):
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(RequisicaoIdempotente)
+            .where(
+                RequisicaoIdempotente.chave == chave,
+                RequisicaoIdempotente.dono == dono,
+            )
+            .values(
+                resposta=json.dumps(resposta, ensure_ascii=False),
+                expira_em=datetime.utcnow() + timedelta(hours=RETENCAO_HORAS),
+            )
+        )
+        await db.commit()
+
+
+async def _desistir(chave, dono):
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            delete(RequisicaoIdempotente).where(
+                RequisicaoIdempotente.chave == chave,
+                RequisicaoIdempotente.dono == dono,
+            )
+        )
+        await db.commit()
+
+
+async def _executar_uma_vez(chave, impressao_corpo, calcular):
+    dono = uuid.uuid4().hex
+    limite = time.monotonic() + ESPERA_SEGUNDOS
+
+    while not await _reservar(chave, impressao_corpo, dono):
+        registro = await _ler(chave)
+        if registro is None:
+            continue  # A original falhou e liberou a chave agora
+        if registro.impressao_corpo != impressao_corpo:
+            raise ChaveReutilizadaError(
+                "Esta chave de idempotência já foi usada com outro conteúdo."
+            )
+        if registro.resposta is not None:
+            return json.loads(registro.resposta)
+        if time.monotonic() >= limite:
+            raise EmAndamentoError("A requisição original ainda está em andamento.")
+        await asyncio.sleep(INTERVALO_CONSULTA)
+
+    try:
+        resposta = jsonable_encoder(await calcular())
+    except BaseException:
+        await asyncio.shield(_desistir(chave, dono))
+        raise
+    await _guardar(chave, dono, resposta)
+    return resposta
+
+
+async def executar(rota, chave_cliente, corpo, calcular):
+    """
+    Resposta de `await calcular()`, executado uma única vez por
+    (`rota`, `chave_cliente`). Sem chave, só executa.
+    """
+    if not chave_cliente:
+        return await calcular()
+
+    chave = f"{rota}:{chave_cliente[:TAMANHO_MAXIMO_CHAVE]}"
+    impressao_corpo = impressao(json.dumps(corpo, ensure_ascii=False, sort_keys=True))
+
+    local = _em_andamento.get(chave)
+    if local is not None:
+        impressao_local, futuro = local
+        if impressao_local != impressao_corpo:
+            raise ChaveReutilizadaError(
+                "Esta chave de idempotência já foi usada com outro conteúdo."
+            )
+        return await asyncio.shield(futuro)
+
+    futuro = asyncio.get_running_loop().create_future()
+    _em_andamento[chave] = (impressao_corpo, futuro)
+    try:
+        resposta = await _executar_uma_vez(chave, impressao_corpo, calcular)
+        futuro.set_result(resposta)
+        return resposta
+    except Exception as e:
+        futuro.set_exception(e)
+        raise
+    except BaseException:
+        futuro.set_exception(EmAndamentoError("A requisição original foi interrompida."))
+        raise
+    finally:
+        del _em_andamento[chave]
+        if futuro.done() and not futuro.cancelled():
+            futuro.exception()  # Já entregue a quem esperava; sem aviso no log
+
+
+async def coletar_expiradas(agora=None):
+    """Apaga respostas guardadas (e reservas abandonadas) vencidas. Devolve quantas."""
+    async with AsyncSessionLocal() as db:
+        resultado = await db.execute(
+            delete(RequisicaoIdempotente).where(
+                RequisicaoIdempotente.expira_em < (agora or datetime.utcnow())
+            )
+        )
+        await db.commit()
+        return resultado.rowcount
+
+
+async def rodar_periodicamente():
+    """Tarefa de fundo do backend: uma coleta a cada INTERVALO_HORAS."""
+    while True:
+        try:
+            await coletar_expiradas()
+        except Exception:
+            log.exception("Erro na coleta de chaves de idempotência")
+        await asyncio.sleep(INTERVALO_HORAS * 3600)
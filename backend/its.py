@@ -1,21 +1,62 @@
+import contextvars
 import json
+import logging
 import re
 import time
+from concurrent.futures import ThreadPoolExecutor
 import google.generativeai as genai
 from dotenv import load_dotenv
 import os
 
+from backend import cassete
+from backend.governador import (
+    governador,
+    LLMIndisponivelError,
+    PRIORIDADE_INTERATIVA,
+    PRIORIDADE_LOTE,
+)
+from backend.observabilidade import falha_parse, registrar_llm
+from backend.prompts import (
+    ORCAMENTO_LOTE,
+    ORCAMENTO_MODELO_DOMINIO,
+    ORCAMENTO_TURNO,
+    Prompt,
+    cortar,
+)
+
+log = logging.getLogger(__name__)
+
 load_dotenv()
 API_KEY = os.getenv("API_KEY")
 if API_KEY is not None:
-    print("API_KEY carregada com sucesso.")
+    log.info("API_KEY carregada com sucesso.")
 else:
-    print("API_KEY não encontrada nas variáveis de ambiente.")
+    log.warning("API_KEY não encontrada nas variáveis de ambiente.")
 
 genai.configure(api_key=API_KEY)
 llm = genai.GenerativeModel("models/gemini-2.5-flash")
 
 
+def _gerar(etapa, conteudo, prioridade):
+    """
+    `llm.generate_content` pelo governador, medido e rotulado pela etapa.
+    Com o cassete ligado, grava ou reproduz a chamada (backend/cassete.py).
+    """
+    inicio = time.perf_counter()
+    try:
+        resposta = cassete.llm(
+            conteudo,
+            lambda: governador.executar(
+                llm.generate_content, conteudo, prioridade=prioridade
+            ),
+        )
+    except Exception as e:
+        registrar_llm(etapa, time.perf_counter() - inicio, erro=e)
+        raise
+    registrar_llm(etapa, time.perf_counter() - inicio, resposta)
+    return resposta
+
+
 def carregar_json(json_str):
     if not json_str:
         return {}
@@ -45,56 +86,81 @@ def get_text_from_message(message):
             return ""
 
 
-def upload_e_processar_arquivo(caminho_arquivo):
+def upload_e_processar_arquivo(caminho_arquivo, mime_type=None):
     """Faz o upload do arquivo para a API do Gemini e aguarda o processamento."""
-    print(f"--- Uploading: {caminho_arquivo} ---")
-    arquivo = genai.upload_file(caminho_arquivo)
+    return cassete.envio_arquivo(
+        caminho_arquivo, lambda: _enviar_arquivo(caminho_arquivo, mime_type)
+    )
+
+
+def _enviar_arquivo(caminho_arquivo, mime_type):
+    log.info("Enviando arquivo ao Gemini", extra={"arquivo": caminho_arquivo})
+    arquivo = governador.executar(
+        genai.upload_file,
+        caminho_arquivo,
+        mime_type=mime_type,
+        # Nome estável (o id do blob): identifica o arquivo no cassete
+        display_name=os.path.basename(caminho_arquivo),
+        prioridade=PRIORIDADE_LOTE,
+    )
 
     # Aguardar o arquivo estar ativo (processado)
     while arquivo.state.name == "PROCESSING":
-        print(".", end="", flush=True)
         time.sleep(2)
         arquivo = genai.get_file(arquivo.name)
 
     if arquivo.state.name == "FAILED":
         raise ValueError(f"O processamento do arquivo {caminho_arquivo} falhou.")
 
-    print(f"\nArquivo pronto: {arquivo.name}")
+    log.info("Arquivo pronto", extra={"arquivo": arquivo.name})
     return arquivo
 
 
 # --- Modelo de Domínio ---
 def etapa_0_prep_modelo_dominio(
     transcricao_audio="",
-    caminhos_pdf=None,
+    arquivos=None,
     n_topicos=10,
     audiencia="1° ano do ensino médio",
 ):
     """
     Gera o Modelo de Domínio, extraindo informações da transcrição e PDFs fornecidos,
     em tópicos, cada um com explicação, pré-requisito, e exercício.
+    `arquivos` é uma lista de (caminho, mime_type).
     """
-    if caminhos_pdf is None:
-        caminhos_pdf = []
+    if arquivos is None:
+        arquivos = []
 
     # 1. Preparar os arquivos PDF (Upload para o Gemini)
     arquivos_processados = []
-    for caminho in caminhos_pdf:
+    for caminho, mime_type in arquivos:
         try:
-            arq = upload_e_processar_arquivo(caminho)
+            arq = upload_e_processar_arquivo(caminho, mime_type)
             arquivos_processados.append(arq)
         except Exception as e:
-            print(f"Erro ao processar PDF {caminho}: {e}")
+            log.warning(
+                "Erro ao processar PDF", extra={"arquivo": caminho, "erro": str(e)}
+            )
 
-    # 2. Construir o Prompt de Sistema e Instruções
-    prompt_dominio = f"""
+    # 2. Montar o prompt: cada parte uma vez só (a transcrição entra uma vez,
+    # recortada se passar do orçamento)
+    prompt_dominio = Prompt("modelo_dominio", ORCAMENTO_MODELO_DOMINIO)
+    prompt_dominio.fixa(
+        "instrucoes",
+        """
     Você é um especialista em currículo e pedagogia. Sua tarefa é analisar o conteúdo de uma aula
     e estruturá-lo em um modelo de domínio educacional.
     
-    Baseado no seguinte conteúdo de aula:
-    
-    {transcricao_audio}
-    
+    Baseado no seguinte conteúdo de aula (transcrição abaixo e arquivos anexos):
+    """,
+    )
+    if transcricao_audio:
+        prompt_dominio.fixa("inicio_transcricao", "--- INÍCIO DA TRANSCRIÇÃO DO ÁUDIO ---")
+        prompt_dominio.ajustavel("transcricao", transcricao_audio)
+        prompt_dominio.fixa("fim_transcricao", "--- FIM DA TRANSCRIÇÃO ---")
+    prompt_dominio.fixa(
+        "formato",
+        f"""
     Extraia e estruture exatamente {n_topicos} tópicos principais para ensinar a alunos de {audiencia}.
     
     IMPORTANTE: Retorne OBRIGATORIAMENTE um JSON válido com a seguinte estrutura:
@@ -118,31 +184,25 @@ def etapa_0_prep_modelo_dominio(
     3. Os tópicos são pedagogicamente sequenciados
     4. Cada tópico tem um exercício prático específico
     5. A sequência recomendada segue ordem de dificuldade
-    """
+    """,
+    )
 
     # 3. Enviar para o Gemini
     try:
-        conteudo_envio = [prompt_dominio]
-        
-        if transcricao_audio:
-            conteudo_envio.append(
-                f"\n--- INÍCIO DA TRANSCRIÇÃO DO ÁUDIO ---\n{transcricao_audio}\n--- FIM DA TRANSCRIÇÃO ---\n"
-            )
-        
-        # Adicionar os objetos de arquivo PDF
-        conteudo_envio.extend(arquivos_processados)
+        # Texto do prompt e, depois dele, os objetos de arquivo PDF
+        conteudo_envio = [prompt_dominio.montar(), *arquivos_processados]
 
-        print("--- Gerando Modelo de Domínio baseado nos arquivos/áudio... ---")
+        log.info("Gerando Modelo de Domínio baseado nos arquivos/áudio")
 
-        resposta = llm.generate_content(conteudo_envio)
+        resposta = _gerar("modelo_dominio", conteudo_envio, PRIORIDADE_LOTE)
         texto_resposta = resposta.text
-        print(f"Resposta do Gemini: {texto_resposta[:200]}...")
+        log.debug("Resposta do Gemini", extra={"inicio_resposta": texto_resposta[:200]})
         
         # 4. Extrair JSON da resposta
         match = re.search(r'\{.*\}', texto_resposta, re.DOTALL)
         
         if not match:
-            print("ERRO: Nenhum JSON encontrado na resposta")
+            falha_parse("modelo_dominio", texto_resposta)
             return None
         
         json_str = match.group(0)
@@ -150,7 +210,7 @@ def etapa_0_prep_modelo_dominio(
         
         # 5. Validar estrutura
         if "topicos" not in modelo_dict or not isinstance(modelo_dict["topicos"], list):
-            print("ERRO: Estrutura de 'topicos' inválida")
+            falha_parse("modelo_dominio", texto_resposta)
             return None
         
         # 6. Converter para formato esperado (dicionário com nome do tópico como chave)
@@ -166,14 +226,16 @@ def etapa_0_prep_modelo_dominio(
         
         modelo_formatado["_sequencia"] = modelo_dict.get("sequencia_recomendada", list(modelo_formatado.keys()))
         
-        print(f"✅ Modelo de Domínio gerado com sucesso: {len(modelo_formatado)-1} tópicos")
+        log.info(
+            "Modelo de Domínio gerado", extra={"topicos": len(modelo_formatado) - 1}
+        )
         return modelo_formatado
     
-    except json.JSONDecodeError as e:
-        print(f"ERRO ao decodificar JSON: {e}")
+    except json.JSONDecodeError:
+        falha_parse("modelo_dominio", texto_resposta)
         return None
-    except Exception as e:
-        print(f"ERRO ao gerar modelo de domínio: {e}")
+    except Exception:
+        log.exception("Erro ao gerar modelo de domínio")
         return None
 
 
@@ -220,7 +282,38 @@ def etapa_1_selecao_proximo_topico(modelo_aluno, modelo_dominio):
     # Se chegou aqui, todos foram compreendidos
     return None
 
-def etapa_3_avaliacao_interacao_inicial(historico, modelo_aluno, topico_atual, modelo_dominio):
+def atualizar_status_topico(modelo_aluno, topico_atual, resultado):
+    """Aplica o resultado de uma avaliação às estatísticas do tópico no modelo do aluno"""
+    if topico_atual not in modelo_aluno.get("topicos_status", {}):
+        return modelo_aluno
+
+    stats = modelo_aluno["topicos_status"][topico_atual]
+    stats["tentativas"] += 1
+    if resultado.get("acertou"):
+        stats["acertos"] += 1
+
+    # Média ponderada simples para nova compreensão ou substituição
+    stats["compreensao"] = resultado.get("compreensao", 0)
+
+    # Atualizar status baseado na nota
+    if stats["compreensao"] >= 70:
+        stats["status"] = "compreendido"
+    else:
+        stats["status"] = "em_progresso"
+
+    return modelo_aluno
+
+def _bloco_contexto_aula(contexto_aula):
+    """Trechos da aula recuperados para o turno, como seção do prompt"""
+    if not contexto_aula:
+        return ""
+    return f"""
+    Trechos da aula do professor sobre o assunto (use como referência):
+    {contexto_aula}
+    """
+
+
+def etapa_3_avaliacao_interacao_inicial(historico, modelo_aluno, topico_atual, modelo_dominio, contexto_aula=None):
     """Analisa a resposta do aluno e atualiza o modelo"""
     if not historico or len(historico) < 1:
         return None, modelo_aluno
@@ -231,23 +324,32 @@ def etapa_3_avaliacao_interacao_inicial(historico, modelo_aluno, topico_atual, m
     
     topico_info = modelo_dominio.get(topico_atual, {})
     
-    prompt_avaliacao = f"""
+    prompt_avaliacao = Prompt("avaliacao", ORCAMENTO_TURNO)
+    prompt_avaliacao.fixa(
+        "pergunta",
+        f"""
     Analise a resposta do aluno para esta pergunta:
     
     Tópico: {topico_atual}
     Pergunta: {topico_info.get('exercicio', '')}
     Resposta do aluno: {texto_resposta}
-    
+    """,
+    )
+    prompt_avaliacao.ajustavel("contexto_aula", _bloco_contexto_aula(contexto_aula))
+    prompt_avaliacao.fixa(
+        "formato",
+        """
     Retorne um JSON com:
-    {{
+    {
         "acertou": true|false,
         "compreensao": 0-100,
         "feedback_tecnico": "Breve análise técnica do erro ou acerto"
-    }}
-    """
+    }
+    """,
+    )
     
     try:
-        resposta = llm.generate_content(prompt_avaliacao)
+        resposta = _gerar("avaliacao", prompt_avaliacao.montar(), PRIORIDADE_INTERATIVA)
         match = re.search(r'\{.*\}', resposta.text, re.DOTALL)
         
         resultado = {}
@@ -255,69 +357,261 @@ def etapa_3_avaliacao_interacao_inicial(historico, modelo_aluno, topico_atual, m
             resultado = json.loads(match.group(0))
             
             # Atualizar modelo do aluno
-            if topico_atual in modelo_aluno["topicos_status"]:
-                stats = modelo_aluno["topicos_status"][topico_atual]
-                stats["tentativas"] += 1
-                if resultado.get("acertou"):
-                    stats["acertos"] += 1
-                
-                # Média ponderada simples para nova compreensão ou substituição
-                stats["compreensao"] = resultado.get("compreensao", 0)
-                
-                # Atualizar status baseado na nota
-                if stats["compreensao"] >= 70:
-                    stats["status"] = "compreendido"
-                else:
-                    stats["status"] = "em_progresso"
+            atualizar_status_topico(modelo_aluno, topico_atual, resultado)
+        else:
+            falha_parse("avaliacao", resposta.text)
             
         return resultado, modelo_aluno # Retorna a tupla
+    except json.JSONDecodeError:
+        falha_parse("avaliacao", resposta.text)
+        return None, modelo_aluno
     except Exception as e:
-        print(f"Erro na avaliação: {e}")
+        log.warning("Erro na avaliação", extra={"erro": str(e)})
         return None, modelo_aluno
 
-def etapa_45_decidir_e_gerar_feedback(exercicio, resposta_aluno, modelo_dominio, topico_atual, acertou):
+# --- Avaliação em lote ---
+# Quanto texto de respostas cabe em uma única chamada (aprox. 4 caracteres por
+# token) e quantas respostas no máximo, para a saída JSON não ficar longa demais.
+LOTE_MAX_CARACTERES = int(os.getenv("LOTE_MAX_CARACTERES", "60000"))
+LOTE_MAX_RESPOSTAS = int(os.getenv("LOTE_MAX_RESPOSTAS", "40"))
+
+
+def empacotar_respostas(respostas, max_caracteres=None, max_respostas=None):
+    """
+    Divide a lista de respostas em grupos que cabem numa única chamada ao LLM.
+    Retorna uma lista de listas de índices da lista original.
+    """
+    max_caracteres = max_caracteres or LOTE_MAX_CARACTERES
+    max_respostas = max_respostas or LOTE_MAX_RESPOSTAS
+
+    grupos = []
+    atual, tamanho_atual = [], 0
+    for i, resposta in enumerate(respostas):
+        tamanho = len(resposta) + 40  # margem para o cabeçalho de cada item
+        if atual and (
+            tamanho_atual + tamanho > max_caracteres or len(atual) >= max_respostas
+        ):
+            grupos.append(atual)
+            atual, tamanho_atual = [], 0
+        atual.append(i)
+        tamanho_atual += tamanho
+    if atual:
+        grupos.append(atual)
+    return grupos
+
+
+def _avaliar_grupo(indices, respostas, topico_atual, exercicio):
+    """Avalia um grupo de respostas em uma única chamada ao LLM."""
+    # Cada resposta é uma seção: se o grupo passar do orçamento, todas são
+    # encurtadas na mesma proporção e nenhuma some do prompt
+    itens = "\n".join(
+        f"--- Resposta [{n}] ---\n{respostas[i]}" for n, i in enumerate(indices)
+    )
+
+    prompt_lote = Prompt("avaliacao_lote", ORCAMENTO_LOTE)
+    prompt_lote.fixa(
+        "instrucoes",
+        f"""
+    Você é um tutor educacional corrigindo uma lista de exercícios.
+    Avalie CADA resposta abaixo de forma independente.
+    
+    Tópico: {topico_atual}
+    """,
+    )
+    # A pergunta é o critério da correção: vai sempre, com um teto próprio
+    prompt_lote.fixa(
+        "exercicio", f"Pergunta: {cortar(exercicio, ORCAMENTO_LOTE // 4)}"
+    )
+    prompt_lote.fixa(
+        "cabecalho_respostas",
+        "Respostas dos alunos (o número entre colchetes é o índice):",
+    )
+    prompt_lote.ajustavel("respostas", itens)
+    prompt_lote.fixa(
+        "formato",
+        """
+    Retorne um JSON com exatamente um item por resposta:
+    {
+        "avaliacoes": [
+            {
+                "indice": 0,
+                "acertou": true|false,
+                "compreensao": 0-100,
+                "mensagem_ao_aluno": "Feedback curto para o aluno (use markdown)."
+            },
+            ...
+        ]
+    }
+    """,
+    )
+
+    try:
+        resposta = _gerar("avaliacao_lote", prompt_lote.montar(), PRIORIDADE_LOTE)
+        match = re.search(r'\{.*\}', resposta.text, re.DOTALL)
+        if not match:
+            falha_parse("avaliacao_lote", resposta.text)
+            return {}
+        avaliacoes = json.loads(match.group(0)).get("avaliacoes", [])
+    except json.JSONDecodeError:
+        falha_parse("avaliacao_lote", resposta.text)
+        return {}
+    except Exception as e:
+        log.warning("Erro na avaliação em lote", extra={"erro": str(e)})
+        return {}
+
+    resultados = {}
+    for item in avaliacoes:
+        try:
+            n = int(item.get("indice"))
+        except (AttributeError, TypeError, ValueError):
+            continue
+        if 0 <= n < len(indices):
+            resultados[indices[n]] = item
+    return resultados
+
+
+def _avaliacao_valida(item):
+    """
+    Normaliza um item de avaliação vindo do LLM: `acertou` booleano (ou
+    "true"/"false") e `compreensao` numérica, levada para 0-100. Retorna None
+    se o item não passa, para ele voltar como não avaliado.
+    """
+    acertou = item.get("acertou")
+    if isinstance(acertou, str):
+        acertou = {"true": True, "false": False}.get(acertou.strip().lower())
+    if not isinstance(acertou, bool):
+        return None
+
+    compreensao = item.get("compreensao")
+    if isinstance(compreensao, bool):
+        return None
+    try:
+        compreensao = float(compreensao)
+    except (TypeError, ValueError):
+        return None
+    if compreensao != compreensao:  # NaN
+        return None
+
+    mensagem = item.get("mensagem_ao_aluno")
+    return {
+        "acertou": acertou,
+        "compreensao": int(round(min(100, max(0, compreensao)))),
+        "mensagem_ao_aluno": mensagem if isinstance(mensagem, str) else "",
+    }
+
+
+def etapa_3_avaliacao_em_lote(respostas, topico_atual, modelo_dominio):
+    """
+    Avalia muitas respostas ao mesmo exercício empacotando-as no menor número
+    de chamadas ao LLM. Retorna uma lista alinhada com `respostas`; itens que o
+    LLM não avaliou vêm com "avaliado": False.
+    """
+    exercicio = modelo_dominio.get(topico_atual, {}).get("exercicio", "")
+    grupos = empacotar_respostas(respostas)
+
+    # Cada thread roda numa cópia do contexto (id da requisição nos logs e
+    # status da sessão nas métricas)
+    contexto = contextvars.copy_context()
+    resultados = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(len(grupos), 4))) as executor:
+        for parcial in executor.map(
+            lambda g: contexto.copy().run(
+                _avaliar_grupo, g, respostas, topico_atual, exercicio
+            ),
+            grupos,
+        ):
+            resultados.update(parcial)
+
+    log.info(
+        "Avaliação em lote",
+        extra={"respostas": len(respostas), "chamadas": len(grupos)},
+    )
+
+    lista = []
+    for i in range(len(respostas)):
+        item = resultados.get(i)
+        if item is not None:
+            item = _avaliacao_valida(item)
+        if item is None:
+            lista.append(
+                {
+                    "avaliado": False,
+                    "acertou": False,
+                    "compreensao": 0,
+                    "mensagem_ao_aluno": "Não foi possível avaliar esta resposta.",
+                }
+            )
+        else:
+            lista.append({"avaliado": True, **item})
+    return lista
+
+def etapa_45_decidir_e_gerar_feedback(exercicio, resposta_aluno, modelo_dominio, topico_atual, acertou, contexto_aula=None):
     """Gera feedback para o aluno e decide próximo passo"""
     
     # Contexto emocional muda se ele acertou ou errou
     tom = "Parabenize e avance." if acertou else "Seja paciente, dê uma dica e peça para tentar de novo ou explique o conceito."
     
-    prompt_feedback = f"""
+    prompt_feedback = Prompt("feedback", ORCAMENTO_TURNO)
+    prompt_feedback.fixa(
+        "resposta",
+        f"""
     Você é um tutor educacional.
     Contexto: O aluno respondeu ao exercício sobre "{topico_atual}".
     Status da resposta: {"Correta" if acertou else "Incorreta"}.
     
     Exercício: {exercicio}
     Resposta do aluno: {resposta_aluno}
-    
+    """,
+    )
+    prompt_feedback.ajustavel("contexto_aula", _bloco_contexto_aula(contexto_aula))
+    prompt_feedback.fixa(
+        "instrucao",
+        f"""
     Instrução: {tom}
+    Quando fizer sentido, relacione o feedback ao que foi dito na aula.
     
     Retorne um JSON com:
     {{
         "mensagem_ao_aluno": "O texto que será enviado ao aluno (use markdown, negrito, etc).",
         "proxima_acao": "avancar" se acertou else "revisar"
     }}
-    """
+    """,
+    )
     
     try:
-        resposta = llm.generate_content(prompt_feedback)
+        resposta = _gerar("feedback", prompt_feedback.montar(), PRIORIDADE_INTERATIVA)
         match = re.search(r'\{.*\}', resposta.text, re.DOTALL)
         
         if match:
             return json.loads(match.group(0))
-        return {"mensagem_ao_aluno": "Não consegui gerar um feedback específico. Vamos continuar?", "proxima_acao": "revisar"}
+        falha_parse("feedback", resposta.text)
+        return {"mensagem_ao_aluno": "Não consegui gerar um feedback específico. Vamos continuar?", "proxima_acao": "revisar", "fallback": True}
+    except LLMIndisponivelError as e:
+        log.warning("Feedback adiado", extra={"erro": str(e)})
+        return {"mensagem_ao_aluno": "⏳ O tutor está recebendo muitas respostas agora. Envie sua resposta novamente em alguns instantes.", "proxima_acao": "revisar", "fallback": True}
+    except json.JSONDecodeError:
+        falha_parse("feedback", resposta.text)
+        return {"mensagem_ao_aluno": "Não consegui gerar um feedback específico. Vamos continuar?", "proxima_acao": "revisar", "fallback": True}
     except Exception as e:
-        print(f"Erro ao gerar feedback: {e}")
-        return {"mensagem_ao_aluno": "Erro interno no feedback.", "proxima_acao": "revisar"}
+        log.warning("Erro ao gerar feedback", extra={"erro": str(e)})
+        return {"mensagem_ao_aluno": "Erro interno no feedback.", "proxima_acao": "revisar", "fallback": True}
 
 
-def etapa_7_atualizacao_pos_feedback(historico, modelo_aluno, modelo_dominio):
-    """Atualiza modelo do aluno após feedback e calcula progresso geral"""
-    topicos_status = modelo_aluno.get("topicos_status", {})
-    
-    total_topicos = len(topicos_status)
-    topicos_compreendidos = sum(1 for t in topicos_status.values() if t.get("status") == "compreendido")
-    
-    modelo_aluno["progresso_total"] = (topicos_compreendidos / total_topicos * 100) if total_topicos > 0 else 0
+def etapa_7_atualizacao_pos_feedback(historico, modelo_aluno, modelo_dominio, progresso_total=None):
+    """
+    Atualiza modelo do aluno após feedback e calcula progresso geral.
+    `progresso_total` pode vir pronto (agregado no banco); senão é calculado
+    a partir de `topicos_status`.
+    """
+    if progresso_total is None:
+        topicos_status = modelo_aluno.get("topicos_status", {})
+
+        total_topicos = len(topicos_status)
+        topicos_compreendidos = sum(1 for t in topicos_status.values() if t.get("status") == "compreendido")
+
+        progresso_total = (topicos_compreendidos / total_topicos * 100) if total_topicos > 0 else 0
+
+    modelo_aluno["progresso_total"] = progresso_total
     
     # Atualizar nível geral
     progresso = modelo_aluno["progresso_total"]
@@ -1,65 +1,69 @@
-from fastapi import FastAPI, UploadFile, File, Depends, HTTPException
+from contextlib import AsyncExitStack, asynccontextmanager
+from fastapi import FastAPI, UploadFile, File, Depends, Header, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session
+from fastapi.responses import FileResponse
+from sqlalchemy import select, func, or_, and_, literal, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import undefer_group
+from sqlalchemy.orm.attributes import flag_modified
+from sqlalchemy.orm.exc import StaleDataError
 import whisper
+import asyncio
 import shutil
 import os
 import uuid
 import json
-from datetime import datetime
+import logging
 from pydantic import BaseModel
-from typing import List
-from backend import its
-
-# --- 1. CONFIGURAÇÃO DO BANCO DE DADOS (SQLite) ---
-SQLALCHEMY_DATABASE_URL = "sqlite:///./sigma_teacher.db"
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+from typing import List, Optional
+from datetime import datetime
+from backend import its, cassete, pipeline, progresso, analitico, arquivo, blobs, busca, recuperacao, cache_respostas, cache_sessoes, concorrencia, condicional, idempotencia, observabilidade, perfilamento, historico as historico_chat
+from backend.database import (
+    criar_tabelas,
+    get_db,
+    AudioLog,
+    TutoriaSession,
+    SessaoArquivada,
+    ChatMessage,
+    CONTEUDO,
 )
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
-
-
-# Define a tabela do banco
-class AudioLog(Base):
-    __tablename__ = "audios"
-
-    id = Column(Integer, primary_key=True, index=True)
-    filename_original = Column(String)  # Nome que o usuário mandou
-    caminho_arquivo = Column(String)  # Onde salvamos no disco
-    transcricao = Column(Text)  # O texto gerado pelo Whisper
-    transcricao_editada = Column(
-        Text, nullable=True
-    )  # Transcrição editada pelo usuário
-    data_criacao = Column(DateTime, default=datetime.utcnow)
-
-
-# Define a tabela para sessões de tutoria
-class TutoriaSession(Base):
-    __tablename__ = "sessoes_tutoria"
-
-    id = Column(Integer, primary_key=True, index=True)
-    # Guardamos estruturas complexas como TEXT (JSON stringfied)
-    modelo_dominio = Column(Text)  # O que deve ser ensinado
-    modelo_aluno = Column(Text)  # O nível atual do aluno
-    historico_chat = Column(Text)  # Lista de mensagens para o contexto do LLM
-    topico_atual = Column(String)  # O tópico sendo ensinado agora
-    status = Column(String)  # "ativo", "concluido"
-    audio_ids = Column(String, default="[]")
-    data_criacao = Column(DateTime, default=datetime.utcnow)
-
-
-# Cria o arquivo do banco de dados se não existir
-Base.metadata.create_all(bind=engine)
-
-# --- 2. CONFIGURAÇÃO DO WHISPER ---
-print("Carregando modelo...")
-modelo = whisper.load_model("small")  # Usando o Medium como você validou
-
-# --- 3. CONFIGURAÇÃO DO APP ---
-app = FastAPI()
+from backend.migracoes import executar_migracoes
+from backend.governador import em_thread
+from backend.observabilidade import medir
+
+observabilidade.configurar_logs()
+log = logging.getLogger(__name__)
+
+# --- 1. CONFIGURAÇÃO DO WHISPER ---
+log.info("Carregando modelo...")
+NOME_MODELO_WHISPER = "small"
+# Reproduzindo um cassete as transcrições vêm da gravação (backend/cassete.py)
+modelo = (
+    None if cassete.REPRODUZINDO else whisper.load_model(NOME_MODELO_WHISPER)
+)  # Usando o Medium como você validou
+
+# --- 2. CONFIGURAÇÃO DO APP ---
+@asynccontextmanager
+async def lifespan(app):
+    # Cria o arquivo do banco de dados se não existir
+    await criar_tabelas()
+    await executar_migracoes()
+    # Job de arquivamento das sessões concluídas/paradas (backend/arquivo.py),
+    # coleta de lixo dos arquivos sem referência (backend/blobs.py) e das
+    # respostas idempotentes vencidas (backend/idempotencia.py)
+    tarefas = []
+    if arquivo.INTERVALO_HORAS > 0:
+        tarefas.append(asyncio.create_task(arquivo.rodar_periodicamente()))
+    if blobs.INTERVALO_HORAS > 0:
+        tarefas.append(asyncio.create_task(blobs.rodar_periodicamente()))
+    if idempotencia.INTERVALO_HORAS > 0:
+        tarefas.append(asyncio.create_task(idempotencia.rodar_periodicamente()))
+    yield
+    for tarefa in tarefas:
+        tarefa.cancel()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Adicionar CORS para permitir requisições do frontend
 app.add_middleware(
@@ -69,46 +73,79 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Perfil da requisição, quando pedido ou sorteado (backend/perfilamento.py)
+app.add_middleware(perfilamento.MiddlewarePerfilamento)
+# Id da requisição nos logs e duração por rota (backend/observabilidade.py)
+app.add_middleware(observabilidade.MiddlewareRequisicao)
 
-# Cria a pastinha para salvar os arquivos físicos
-os.makedirs("uploads", exist_ok=True)
 
+@app.get("/metrics", include_in_schema=False)
+def metricas():
+    """Métricas no formato de texto do Prometheus."""
+    corpo, tipo = observabilidade.exportar()
+    return Response(corpo, media_type=tipo)
 
-# Dependência para pegar a sessão do banco
-def get_db():
-    db = SessionLocal()
+
+def _exigir_token_perfil(request):
+    token = request.headers.get("x-perfil-token") or request.query_params.get(
+        "perfil_token"
+    )
+    if not perfilamento.token_valido(token):
+        raise HTTPException(status_code=403, detail="Token de perfilamento inválido")
+
+
+@app.get("/admin/perfis", include_in_schema=False)
+def listar_perfis(request: Request, limite: int = 20):
+    """Perfis recentes deste worker, do mais lento para o mais rápido."""
+    _exigir_token_perfil(request)
+    return perfilamento.listar(limite)
+
+
+@app.get("/admin/perfis/{perfil_id}", include_in_schema=False)
+def baixar_perfil(perfil_id: str, request: Request):
+    """Pilhas dobradas do perfil (speedscope, flamegraph.pl, inferno)."""
+    _exigir_token_perfil(request)
     try:
-        yield db
-    finally:
-        db.close()
+        caminho = perfilamento.caminho(perfil_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Perfil não encontrado")
+    return FileResponse(
+        caminho, media_type="text/plain", filename=f"perfil_{perfil_id}.folded"
+    )
+
+
+# Cria a pastinha para salvar os arquivos físicos
+os.makedirs("uploads", exist_ok=True)
 
 
 @app.post("/transcrever-e-salvar")
-async def processar_audio(file: UploadFile = File(...), db: Session = Depends(get_db)):
+async def processar_audio(file: UploadFile = File(...), db: AsyncSession = Depends(get_db)):
     # A. Gerar um nome único (para não sobrescrever arquivos com mesmo nome)
     # Ex: "audio.mp3" vira "f47ac10b-58cc...audio.mp3"
     nome_unico = f"{uuid.uuid4()}_{file.filename}"
     caminho_final = f"uploads/{nome_unico}"
 
     # B. Salvar o arquivo na pasta 'uploads'
-    with open(caminho_final, "wb") as buffer:
+    with medir("salvar_arquivo"), open(caminho_final, "wb") as buffer:
         shutil.copyfileobj(file.file, buffer)
 
-    # C. Transcrever
-    print(f"Transcrevendo {caminho_final}...")
-    resultado = modelo.transcribe(caminho_final, language="pt", temperature=0)
-    texto_extraido = resultado["text"]
-
-    # D. Salvar no Banco de Dados
+    # C. Registrar a aula. O pipeline só a insere depois da transcrição, para
+    # não segurar a escrita do banco enquanto o Whisper roda
     novo_registro = AudioLog(
         filename_original=file.filename,
         caminho_arquivo=caminho_final,
-        transcricao=texto_extraido,
+        transcricao_editada=None,
     )
 
-    db.add(novo_registro)
-    db.commit()  # Confirma a gravação
-    db.refresh(novo_registro)  # Atualiza para pegar o ID gerado
+    # D. Pipeline: decodificar/transcrever (em thread, é pesado) e preparar trechos
+    texto_extraido = await pipeline.transcrever_audio(
+        db, novo_registro, modelo, NOME_MODELO_WHISPER
+    )
+    novo_registro.transcricao = texto_extraido
+    await pipeline.processar_texto(db, novo_registro)
+
+    # E. Salvar no Banco de Dados
+    await db.commit()  # Confirma a gravação
 
     return {
         "status": "sucesso",
@@ -117,78 +154,253 @@ async def processar_audio(file: UploadFile = File(...), db: Session = Depends(ge
     }
 
 
-# Rota extra: Listar tudo que já foi salvo
+# --- Paginação por cursor (keyset) ---
+LIMITE_PADRAO_PAGINA = 20
+LIMITE_MAXIMO_PAGINA = 100
+TAMANHO_PREVIA = 200
+
+
+def _codificar_cursor(data_criacao, id_):
+    return f"{data_criacao.isoformat() if data_criacao else ''}_{id_}"
+
+
+def _filtro_cursor(cursor, coluna_data, coluna_id):
+    """
+    Condição "vem depois do cursor" na ordem (data_criacao desc, id desc).
+    Usa o índice (data_criacao, id) em vez de OFFSET, então o custo de uma
+    página não depende de quantas páginas vieram antes.
+    """
+    try:
+        data_str, id_str = cursor.rsplit("_", 1)
+        data_cursor = datetime.fromisoformat(data_str) if data_str else None
+        id_cursor = int(id_str)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+    if data_cursor is None:
+        return and_(coluna_data.is_(None), coluna_id < id_cursor)
+    return or_(
+        coluna_data < data_cursor,
+        and_(coluna_data == data_cursor, coluna_id < id_cursor),
+        coluna_data.is_(None),
+    )
+
+
+async def _pagina(db, consulta, coluna_data, coluna_id, cursor, limite):
+    """Executa a consulta paginada e devolve (linhas, proximo_cursor)."""
+    limite = max(1, min(limite, LIMITE_MAXIMO_PAGINA))
+    if cursor:
+        consulta = consulta.where(_filtro_cursor(cursor, coluna_data, coluna_id))
+    consulta = consulta.order_by(coluna_data.desc(), coluna_id.desc()).limit(
+        limite + 1
+    )
+    linhas = (await db.execute(consulta)).all()
+
+    proximo_cursor = None
+    if len(linhas) > limite:
+        linhas = linhas[:limite]
+        ultima = linhas[-1]
+        proximo_cursor = _codificar_cursor(ultima.data_criacao, ultima.id)
+    return linhas, proximo_cursor
+
+
+# Rota extra: Listar o que já foi salvo (resumo, paginado)
 @app.get("/listar-audios")
-def listar(db: Session = Depends(get_db)):
-    audios = db.query(AudioLog).all()
-    return [
+async def listar(
+    request: Request,
+    cursor: Optional[str] = None,
+    limite: int = LIMITE_PADRAO_PAGINA,
+    db: AsyncSession = Depends(get_db),
+):
+    """Resumo das aulas (sem a transcrição completa), da mais nova para a mais antiga"""
+    texto = func.coalesce(AudioLog.transcricao_editada, AudioLog.transcricao, "")
+    consulta = select(
+        AudioLog.id,
+        AudioLog.filename_original,
+        AudioLog.data_criacao,
+        func.length(texto).label("tamanho_transcricao"),
+        func.substr(texto, 1, TAMANHO_PREVIA).label("previa"),
+    )
+    linhas, proximo_cursor = await _pagina(
+        db, consulta, AudioLog.data_criacao, AudioLog.id, cursor, limite
+    )
+
+    return condicional.responder(
+        request,
         {
-            "id": a.id,
-            "filename_original": a.filename_original,
-            "transcricao": a.transcricao_editada or a.transcricao,
-            "data_criacao": a.data_criacao.isoformat() if a.data_criacao else None,
-        }
-        for a in audios
-    ]
+            "itens": [
+                {
+                    "id": a.id,
+                    "filename_original": a.filename_original,
+                    "tamanho_transcricao": a.tamanho_transcricao,
+                    "previa": a.previa,
+                    "data_criacao": a.data_criacao.isoformat()
+                    if a.data_criacao
+                    else None,
+                }
+                for a in linhas
+            ],
+            "proximo_cursor": proximo_cursor,
+        },
+    )
+
+
+@app.get("/buscar-audios")
+async def buscar_audios(
+    request: Request,
+    q: str,
+    limite: int = LIMITE_PADRAO_PAGINA,
+    offset: int = 0,
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Busca aulas pelo conteúdo da transcrição. Retorna só os trechos
+    encontrados (snippets com os termos marcados), ordenados por relevância.
+    """
+    limite = max(1, min(limite, LIMITE_MAXIMO_PAGINA))
+    offset = max(0, offset)
+    resultados, ha_mais = await busca.buscar(db, q, limite, offset)
+    return condicional.responder(
+        request,
+        {
+            "itens": resultados,
+            "proximo_offset": offset + limite if ha_mais else None,
+        },
+    )
+
+
+@app.get("/audio/{audio_id}")
+async def obter_audio(
+    audio_id: int, request: Request, db: AsyncSession = Depends(get_db)
+):
+    """Dados completos de uma aula, incluindo a transcrição"""
+    audio = await db.get(AudioLog, audio_id)
+    if not audio:
+        raise HTTPException(status_code=404, detail="Áudio não encontrado")
+
+    # A transcrição só muda ao editar: sem edição nova, nem lê o texto
+    modificado_em = audio.data_edicao or audio.data_criacao
+    tag = condicional.etag("audio", audio.id, modificado_em)
+    nao_modificado = condicional.nao_modificado(request, tag, modificado_em)
+    if nao_modificado:
+        return nao_modificado
+
+    await db.refresh(audio, ["transcricao", "transcricao_editada"])
+    return condicional.responder(
+        request,
+        {
+            "id": audio.id,
+            "filename_original": audio.filename_original,
+            "transcricao": audio.transcricao_editada or audio.transcricao,
+            "data_criacao": audio.data_criacao.isoformat()
+            if audio.data_criacao
+            else None,
+        },
+        tag=tag,
+        ultima_modificacao=modificado_em,
+    )
 
 
 # Rota para editar transcrição
 @app.put("/editar-transcricao/{audio_id}")
 async def editar_transcricao(
-    audio_id: int, nova_transcricao: dict, db: Session = Depends(get_db)
+    audio_id: int, nova_transcricao: dict, db: AsyncSession = Depends(get_db)
 ):
     """Edita a transcrição de um áudio"""
-    audio = db.query(AudioLog).filter(AudioLog.id == audio_id).first()
+    audio = await db.get(AudioLog, audio_id, options=[undefer_group(CONTEUDO)])
     if not audio:
         raise HTTPException(status_code=404, detail="Áudio não encontrado")
 
     audio.transcricao_editada = nova_transcricao.get("transcricao", audio.transcricao)
-    db.commit()
+    audio.data_edicao = datetime.utcnow()  # Invalida os ETags da aula e das sessões
+
+    # Reprocessa só os trechos afetados pela edição
+    resultado_pipeline = await pipeline.processar_texto(db, audio)
+    await db.commit()
 
     return {
         "status": "sucesso",
         "id": audio.id,
         "transcricao": audio.transcricao_editada,
+        "trechos_reprocessados": resultado_pipeline["trechos_reprocessados"],
     }
 
 
+@app.get("/pipeline/{audio_id}")
+async def estado_pipeline(audio_id: int, db: AsyncSession = Depends(get_db)):
+    """Mostra as etapas do pipeline de conteúdo já executadas para uma aula"""
+    audio = await db.get(AudioLog, audio_id)
+    if not audio:
+        raise HTTPException(status_code=404, detail="Áudio não encontrado")
+
+    return await pipeline.estado_pipeline(db, audio_id)
+
+
+EXTENSOES_ARQUIVOS_ITS = (".pdf", ".jpeg", ".jpg", ".png", ".csv")
+
+
 @app.post("/upload-arquivo")
 async def upload_arquivos(
     files: List[UploadFile] = File(...),
-    audio_ids: List[int] = [],
+    db: AsyncSession = Depends(get_db),
 ):
     """
-    Valida os arquivos enviados para o ITS.
-    Retorna lista de arquivos salvos temporariamente.
+    Guarda os arquivos enviados para o ITS no armazenamento de blobs.
+    Retorna o id de cada um, que é o que /its/iniciar recebe.
     """
-    caminhos_salvos = []
+    arquivos_salvos = []
 
     for file in files:
-        if file.filename.endswith((".pdf", ".jpeg", ".jpg", ".png", ".csv")):
-            temp_path = f"uploads/temp_{uuid.uuid4()}_{file.filename}"
-            with open(temp_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
-            caminhos_salvos.append({"arquivo": file.filename, "caminho": temp_path})
-
-    # Validar que pelo menos uma aula foi selecionada
-    if not audio_ids:
-        return {
-            "status": "erro",
-            "detalhe": "Selecione pelo menos uma aula para iniciar o ITS",
-        }
+        if not file.filename.lower().endswith(EXTENSOES_ARQUIVOS_ITS):
+            continue
+        try:
+            blob = await blobs.guardar(db, file)
+        except blobs.ArquivoGrandeDemaisError as e:
+            raise HTTPException(status_code=413, detail=f"{file.filename}: {e}")
+        arquivos_salvos.append(
+            {
+                "arquivo": file.filename,
+                "blob_id": blob.id,
+                "tamanho": blob.tamanho,
+                "mime": blob.mime,
+            }
+        )
 
-    return {
-        "status": "sucesso",
-        "arquivos_salvos": caminhos_salvos,
-        "audio_ids": audio_ids,
-    }
+    return {"status": "sucesso", "arquivos_salvos": arquivos_salvos}
 
 
 @app.get("/its/sessoes")
-def listar_sessoes(db: Session = Depends(get_db)):
-    """Retorna uma lista simplificada das sessões para o aluno selecionar"""
-    sessoes = (
-        db.query(TutoriaSession).order_by(TutoriaSession.data_criacao.desc()).all()
+async def listar_sessoes(
+    request: Request,
+    cursor: Optional[str] = None,
+    limite: int = LIMITE_PADRAO_PAGINA,
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Retorna uma lista simplificada das sessões para o aluno selecionar,
+    incluindo as que estão no arquivo frio (cada tabela usa o seu índice
+    (data_criacao, id) e o banco intercala as duas listas já ordenadas).
+    """
+    todas = union_all(
+        select(
+            TutoriaSession.id,
+            TutoriaSession.topico_atual,
+            TutoriaSession.status,
+            TutoriaSession.aluno,
+            TutoriaSession.data_criacao,
+            literal(False).label("arquivada"),
+        ),
+        select(
+            SessaoArquivada.id,
+            SessaoArquivada.topico_atual,
+            SessaoArquivada.status,
+            SessaoArquivada.aluno,
+            SessaoArquivada.data_criacao,
+            literal(True).label("arquivada"),
+        ),
+    ).subquery()
+    sessoes, proximo_cursor = await _pagina(
+        db, select(todas), todas.c.data_criacao, todas.c.id, cursor, limite
     )
 
     lista_retorno = []
@@ -200,36 +412,126 @@ def listar_sessoes(db: Session = Depends(get_db)):
                 "id": s.id,
                 "topico": topico,
                 "status": s.status,
+                "aluno": s.aluno,
                 "data_criacao": s.data_criacao.isoformat() if s.data_criacao else None,
+                "arquivada": bool(s.arquivada),
             }
         )
-    return lista_retorno
+    return condicional.responder(
+        request, {"itens": lista_retorno, "proximo_cursor": proximo_cursor}
+    )
 
 
 @app.get("/its/sessao/{session_id}")
-def obter_sessao(session_id: int, db: Session = Depends(get_db)):
-    """Retorna o histórico e estado atual de uma sessão para o frontend restaurar"""
-    sessao = db.query(TutoriaSession).filter(TutoriaSession.id == session_id).first()
-    if not sessao:
-        raise HTTPException(status_code=404, detail="Sessão não encontrada")
+async def obter_sessao(
+    session_id: int,
+    request: Request,
+    since_seq: int = 0,
+    incluir_audios: bool = True,
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Retorna o histórico e estado atual de uma sessão para o frontend restaurar.
+    O ETag sai da versão da sessão e da última edição das aulas, então um
+    cliente atualizado recebe 304 sem que as transcrições sejam lidas.
 
-    # Carregar histórico para enviar ao frontend formatado
-    historico_bruto = its.carregar_json(sessao.historico_chat)
+    Para só acompanhar a conversa, o cliente manda o `ultimo_seq` que já tem
+    em `since_seq` e `incluir_audios=false`: vêm só as mensagens novas e
+    nenhuma transcrição.
+    """
+    sessao = await db.get(TutoriaSession, session_id)
+    documento = None
+    if sessao:
+        dados = {
+            "topico_atual": sessao.topico_atual,
+            "status": sessao.status,
+            "audio_ids": sessao.audio_ids,
+            "versao": sessao.versao,
+        }
+        ultima_mensagem = await db.scalar(
+            select(func.max(ChatMessage.data_criacao)).where(
+                ChatMessage.session_id == session_id
+            )
+        )
+    else:
+        # Sessão antiga: lida direto do arquivo frio, sem voltar à tabela quente
+        documento = await arquivo.obter(db, session_id)
+        if documento is None:
+            raise HTTPException(status_code=404, detail="Sessão não encontrada")
+        dados = documento["sessao"]
+        ultima_mensagem = max(
+            (
+                datetime.fromisoformat(m["data_criacao"])
+                for m in documento["mensagens"]
+                if m["data_criacao"]
+            ),
+            default=None,
+        )
+
+    ids = its.carregar_json(dados["audio_ids"]) if dados["audio_ids"] else []
+    audios_modificados = None
+    if ids and incluir_audios:
+        audios_modificados = await db.scalar(
+            select(
+                func.max(func.coalesce(AudioLog.data_edicao, AudioLog.data_criacao))
+            ).where(AudioLog.id.in_(ids))
+        )
+    tag = condicional.etag(
+        "sessao",
+        session_id,
+        sessao is None,
+        dados["versao"],
+        since_seq,
+        incluir_audios,
+        audios_modificados,
+    )
+    modificado_em = max(
+        (d for d in (ultima_mensagem, audios_modificados) if d), default=None
+    )
+    nao_modificado = condicional.nao_modificado(request, tag, modificado_em)
+    if nao_modificado:
+        return nao_modificado
+
+    if sessao:
+        mensagens = [
+            (m.seq, m.role, m.texto)
+            for m in await historico_chat.listar_mensagens(db, sessao.id, since_seq)
+        ]
+    else:
+        mensagens = [
+            (m["seq"], m["role"], m["texto"])
+            for m in documento["mensagens"]
+            if m["seq"] > since_seq
+        ]
 
     # Converter formato do Gemini/LLM para formato do Streamlit (role: user/assistant)
-    mensagens_frontend = []
-    for h in historico_bruto:
-        role = "user" if h.get("role") == "user" else "assistant"
-        content = h.get("parts", [{}])[0].get("text", "")
-        mensagens_frontend.append({"role": role, "content": content})
-
-    lista_audios = []
-    if sessao.audio_ids:
-        ids = its.carregar_json(sessao.audio_ids)
+    mensagens_frontend = [
+        {"seq": seq, "role": "user" if role == "user" else "assistant", "content": texto}
+        for seq, role, texto in mensagens
+    ]
+
+    resposta = {
+        "id": session_id,
+        "topico_atual": dados["topico_atual"],
+        "status": dados["status"],
+        "arquivada": sessao is None,
+        "mensagens": mensagens_frontend,
+        # Cursor para a próxima atualização (since_seq)
+        "ultimo_seq": mensagens[-1][0] if mensagens else since_seq,
+    }
+
+    if incluir_audios:
+        resposta["audios_contexto"] = []
         if ids:
-            audios_db = db.query(AudioLog).filter(AudioLog.id.in_(ids)).all()
+            audios_db = (
+                await db.scalars(
+                    select(AudioLog)
+                    .where(AudioLog.id.in_(ids))
+                    .options(undefer_group(CONTEUDO))
+                )
+            ).all()
             for a in audios_db:
-                lista_audios.append(
+                resposta["audios_contexto"].append(
                     {
                         "id": a.id,
                         "filename_original": a.filename_original,
@@ -240,13 +542,12 @@ def obter_sessao(session_id: int, db: Session = Depends(get_db)):
                     }
                 )
 
-    return {
-        "id": sessao.id,
-        "topico_atual": sessao.topico_atual,
-        "status": sessao.status,
-        "mensagens": mensagens_frontend,
-        "audios_contexto": lista_audios,
-    }
+    return condicional.responder(
+        request,
+        resposta,
+        tag=tag,
+        ultima_modificacao=modificado_em,
+    )
 
 
 class UserResponse(BaseModel):
@@ -256,49 +557,118 @@ class UserResponse(BaseModel):
 
 class IniciarTutoriaRequest(BaseModel):
     audio_ids: List[int]
-    caminhos_pdf: List[str] = []
+    blob_ids: List[str] = []  # PDFs enviados antes por /upload-arquivo
     n_topicos: int = 5
     audiencia: str = "1° ano do ensino médio"
 
 
+MAX_ALUNOS_TURMA = 200
+
+
+class IniciarTurmaRequest(IniciarTutoriaRequest):
+    alunos: List[str]  # Um nome por aluno; uma sessão para cada
+
+
+async def _idempotente(rota, chave, dados, calcular):
+    """`calcular()` uma vez por `Idempotency-Key` (backend/idempotencia.py)."""
+    try:
+        return await idempotencia.executar(rota, chave, dados.model_dump(), calcular)
+    except idempotencia.ChaveReutilizadaError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except idempotencia.EmAndamentoError as e:
+        raise HTTPException(
+            status_code=409,
+            detail=str(e),
+            headers={"Retry-After": str(concorrencia.RETRY_AFTER_SEGUNDOS)},
+        )
+
+
 @app.post("/its/iniciar")
 async def iniciar_tutoria(
     request: IniciarTutoriaRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None),
+):
+    """
+    Gera (ou reaproveita) o modelo de domínio das aulas e cria a sessão. Com
+    `Idempotency-Key`, repetir o pedido devolve a mesma sessão.
+    """
+    return await _idempotente(
+        "iniciar", idempotency_key, request, lambda: _criar_sessao(request, db)
+    )
+
+
+@app.post("/its/iniciar-turma")
+async def iniciar_turma(
+    request: IniciarTurmaRequest,
+    db: AsyncSession = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None),
 ):
+    """
+    Cria uma sessão para cada aluno da lista, todas com as mesmas aulas. O
+    modelo de domínio e o modelo inicial do aluno são gerados uma vez só, e
+    as sessões, o progresso e as mensagens de boas-vindas entram numa única
+    transação. Devolve o id da sessão de cada aluno.
+    """
+    return await _idempotente(
+        "iniciar-turma", idempotency_key, request, lambda: _criar_turma(request, db)
+    )
+
+
+async def _preparar_sessao(request, db):
+    """
+    Modelo de domínio das aulas, modelo inicial do aluno, primeiro tópico e
+    mensagem de boas-vindas; tudo o que uma sessão nova precisa antes de ser
+    gravada.
+    """
+    observabilidade.definir_status_sessao("nova")
+
     # --- 1. Validações e Recuperação de Áudio (Igual ao anterior) ---
     if not request.audio_ids:
         raise HTTPException(status_code=400, detail="Selecione pelo menos uma aula")
 
-    texto_completo_audios = ""
-    registros = db.query(AudioLog).filter(AudioLog.id.in_(request.audio_ids)).all()
+    registros = (
+        await db.scalars(
+            select(AudioLog)
+            .where(AudioLog.id.in_(request.audio_ids))
+            .options(undefer_group(CONTEUDO))
+        )
+    ).all()
     if not registros:
         raise HTTPException(status_code=404, detail="Aulas não encontradas")
 
-    for reg in registros:
-        texto = reg.transcricao_editada or reg.transcricao
-        texto_completo_audios += f"\n--- Aula: {reg.filename_original} ---\n{texto}"
-
     # --- 2. Gerar Modelo de Domínio ---
-    print("--- Gerando Modelo de Domínio... ---")
-    modelo_dominio = its.etapa_0_prep_modelo_dominio(
-        transcricao_audio=texto_completo_audios,
-        caminhos_pdf=request.caminhos_pdf,
-        n_topicos=request.n_topicos,
-        audiencia=request.audiencia,
+    # O pipeline só chama o LLM se as aulas/PDFs/parâmetros mudaram desde a
+    # última geração. As chamadas ao LLM rodam numa thread para não bloquear
+    # o event loop enquanto esperam na fila do governador.
+    log.info("Gerando Modelo de Domínio", extra={"audio_ids": request.audio_ids})
+    arquivos, faltando = await blobs.obter(db, request.blob_ids)
+    if faltando:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Arquivos não encontrados (envie de novo): {', '.join(faltando)}",
+        )
+
+    def gerar(texto_completo_audios):
+        return its.etapa_0_prep_modelo_dominio(
+            transcricao_audio=texto_completo_audios,
+            arquivos=[(blobs.caminho(b.id), b.mime) for b in arquivos],
+            n_topicos=request.n_topicos,
+            audiencia=request.audiencia,
+        )
+
+    modelo_dominio, _ = await pipeline.obter_modelo_dominio(
+        db,
+        registros,
+        arquivos,
+        request.n_topicos,
+        request.audiencia,
+        gerar,
     )
 
     if not modelo_dominio:
         raise HTTPException(status_code=500, detail="Erro ao gerar Modelo de Domínio.")
 
-    # Limpar PDFs temporários
-    for path in request.caminhos_pdf:
-        if os.path.exists(path):
-            try:
-                os.remove(path)
-            except Exception:
-                pass
-
     # --- 3. Inicializar Aluno ---
     modelo_aluno = its.etapa_0_inicializar_aluno(modelo_dominio)
 
@@ -317,23 +687,37 @@ async def iniciar_tutoria(
         f"📖 *Explicação:* {topico_info.get('explicacao', 'Sem explicação disponível.')}\n\n"
         f"✍️ **Exercício:** {topico_info.get('exercicio', '')}"
     )
+    return modelo_dominio, modelo_aluno, topico_inicial, topico_info, mensagem_bot
 
-    # Criar histórico inicial
-    historico_inicial = [{"role": "model", "parts": [{"text": mensagem_bot}]}]
+
+async def _criar_sessao(request, db):
+    (
+        modelo_dominio,
+        modelo_aluno,
+        topico_inicial,
+        topico_info,
+        mensagem_bot,
+    ) = await _preparar_sessao(request, db)
 
     # --- 5. Salvar Sessão ---
     sessao = TutoriaSession(
         modelo_dominio=its.salvar_json(modelo_dominio),
-        modelo_aluno=its.salvar_json(modelo_aluno),
-        historico_chat=its.salvar_json(historico_inicial),
+        modelo_aluno=its.salvar_json(progresso.modelo_aluno_para_salvar(modelo_aluno)),
         topico_atual=topico_inicial,
         status="aguardando_resposta_exercicio",
         audio_ids=its.salvar_json(request.audio_ids),
     )
 
     db.add(sessao)
-    db.commit()
-    db.refresh(sessao)
+    await db.flush()
+
+    # Progresso por tópico e histórico inicial
+    progresso.criar_progresso(db, sessao.id, modelo_aluno["topicos_status"])
+    await analitico.registrar_inicio_sessao(
+        db, analitico.chave_curso(request.audio_ids), topico_inicial
+    )
+    await historico_chat.adicionar_mensagens(db, sessao.id, [("model", mensagem_bot)])
+    await db.commit()
 
     return {
         "status": "sucesso",
@@ -344,51 +728,222 @@ async def iniciar_tutoria(
     }
 
 
+async def _criar_turma(request, db):
+    alunos = [nome.strip() for nome in request.alunos if nome.strip()]
+    if not alunos:
+        raise HTTPException(status_code=400, detail="Informe pelo menos um aluno")
+    if len(alunos) > MAX_ALUNOS_TURMA:
+        raise HTTPException(
+            status_code=400,
+            detail=f"No máximo {MAX_ALUNOS_TURMA} alunos por turma",
+        )
+    vistos, repetidos = set(), []
+    for nome in alunos:
+        if nome.casefold() in vistos:
+            repetidos.append(nome)
+        vistos.add(nome.casefold())
+    if repetidos:
+        raise HTTPException(
+            status_code=400, detail=f"Nomes repetidos na turma: {', '.join(repetidos)}"
+        )
+
+    (
+        modelo_dominio,
+        modelo_aluno,
+        topico_inicial,
+        topico_info,
+        mensagem_bot,
+    ) = await _preparar_sessao(request, db)
+
+    # Todos começam iguais: os JSONs são serializados uma vez só
+    dominio_json = its.salvar_json(modelo_dominio)
+    aluno_json = its.salvar_json(progresso.modelo_aluno_para_salvar(modelo_aluno))
+    audio_ids_json = its.salvar_json(request.audio_ids)
+    sessoes = [
+        TutoriaSession(
+            modelo_dominio=dominio_json,
+            modelo_aluno=aluno_json,
+            topico_atual=topico_inicial,
+            status="aguardando_resposta_exercicio",
+            audio_ids=audio_ids_json,
+            aluno=nome,
+        )
+        for nome in alunos
+    ]
+    db.add_all(sessoes)
+    await db.flush()
+
+    for sessao in sessoes:
+        progresso.criar_progresso(db, sessao.id, modelo_aluno["topicos_status"])
+        await historico_chat.adicionar_mensagens(
+            db, sessao.id, [("model", mensagem_bot)], seq=1
+        )
+    await analitico.registrar_inicio_sessao(
+        db, analitico.chave_curso(request.audio_ids), topico_inicial, len(sessoes)
+    )
+    await db.commit()
+    log.info(
+        "Turma criada",
+        extra={"audio_ids": request.audio_ids, "sessoes": len(sessoes)},
+    )
+
+    return {
+        "status": "sucesso",
+        "sessoes": [{"aluno": s.aluno, "session_id": s.id} for s in sessoes],
+        "topico_atual": topico_inicial,
+        "mensagem_bot": mensagem_bot,
+        "exercicio": topico_info.get("exercicio", ""),
+    }
+
+
 @app.post("/its/chat")
-async def responder_chat(dados: UserResponse, db: Session = Depends(get_db)):
+async def responder_chat(
+    dados: UserResponse,
+    db: AsyncSession = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None),
+):
     """
-    Ciclo de feedback e adaptação.
+    Ciclo de feedback e adaptação. Um turno por sessão de cada vez (em
+    qualquer worker); se outro turno da mesma sessão estiver em andamento,
+    responde 409 com Retry-After e o cliente pode reenviar a mensagem. Com
+    `Idempotency-Key`, a mesma mensagem reenviada não gera um segundo turno:
+    recebe a resposta do primeiro.
     """
-    sessao = (
-        db.query(TutoriaSession).filter(TutoriaSession.id == dados.session_id).first()
+    return await _idempotente(
+        "chat", idempotency_key, dados, lambda: _turno_exclusivo(dados, db)
+    )
+
+
+async def _turno_exclusivo(dados, db):
+    retry_after = {"Retry-After": str(concorrencia.RETRY_AFTER_SEGUNDOS)}
+    try:
+        async with concorrencia.turno_exclusivo(dados.session_id):
+            with medir("turno"):
+                return await _processar_turno(dados, db)
+    except concorrencia.SessaoOcupadaError as e:
+        raise HTTPException(status_code=409, detail=str(e), headers=retry_after)
+    except StaleDataError:
+        await db.rollback()
+        cache_sessoes.invalidar(dados.session_id)
+        raise HTTPException(
+            status_code=409,
+            detail="A sessão foi alterada por outro turno. Envie a mensagem novamente.",
+            headers=retry_after,
+        )
+
+
+async def _processar_turno(dados, db):
+    # Só as colunas leves; o estado decodificado vem da memória se a versão
+    # da sessão não mudou desde o último turno neste worker. Uma sessão
+    # arquivada volta para as tabelas quentes junto com este turno.
+    sessao = await db.get(TutoriaSession, dados.session_id) or await arquivo.restaurar(
+        db, dados.session_id
     )
     if not sessao:
         raise HTTPException(status_code=404, detail="Sessão não encontrada")
+    # As métricas do turno (LLM, commit) saem rotuladas pelo status de entrada
+    observabilidade.definir_status_sessao(sessao.status)
 
     # Carregar estruturas
-    mod_dominio = its.carregar_json(sessao.modelo_dominio)
-    mod_aluno = its.carregar_json(sessao.modelo_aluno)
-    historico = its.carregar_json(sessao.historico_chat)
+    estado = await cache_sessoes.carregar(db, sessao)
+    mod_dominio = estado.modelo_dominio
+    mod_aluno = estado.modelo_aluno
     topico_atual = sessao.topico_atual
 
-    # Adicionar resposta do usuário ao histórico
-    historico.append({"role": "user", "parts": [{"text": dados.mensagem}]})
+    # Painel da turma: o tempo desde o último turno conta para o tópico atual
+    curso = analitico.chave_curso(sessao.audio_ids)
+    segundos_turno = analitico.segundos_desde(estado.ultima_mensagem_em)
+
+    # As etapas só olham a mensagem do turno; o histórico completo fica no banco
+    historico = [historico_chat.para_gemini("user", dados.mensagem)]
 
     resposta_final_bot = ""
     proxima_acao = "revisar"  # padrão
+    similaridade_cache = None  # Preenchida quando a avaliação veio do cache
 
     # --- LÓGICA DO ESTADO ---
 
     if sessao.status == "aguardando_resposta_exercicio":
-        # 1. Avaliar a resposta (Etapa 3)
-        resultado_avaliacao, mod_aluno = its.etapa_3_avaliacao_interacao_inicial(
-            historico, mod_aluno, topico_atual, mod_dominio
+        exercicio_atual = mod_dominio.get(topico_atual, {}).get("exercicio", "")
+
+        # Resposta igual ou quase igual a uma já avaliada neste exercício?
+        escopo_cache = cache_respostas.escopo(estado.impressao_dominio, topico_atual)
+        em_cache, similaridade, id_cache = await cache_respostas.buscar(
+            db, escopo_cache, dados.mensagem
         )
+        stats_anterior = dict(mod_aluno["topicos_status"].get(topico_atual, {}))
+
+        if em_cache:
+            log.info(
+                "Avaliação reaproveitada do cache",
+                extra={"session_id": sessao.id, "similaridade": similaridade},
+            )
+            similaridade_cache = similaridade
+            resultado_avaliacao = em_cache["avaliacao"]
+            its.atualizar_status_topico(mod_aluno, topico_atual, resultado_avaliacao)
+        else:
+            # Trechos da aula sobre o tópico e a resposta, para avaliação e feedback
+            contexto_aula = recuperacao.formatar_contexto(
+                await recuperacao.trechos_relevantes(
+                    db,
+                    its.carregar_json(sessao.audio_ids),
+                    f"{topico_atual} {exercicio_atual} {dados.mensagem}",
+                )
+            )
+
+            # Encerra a transação de leitura antes de esperar o LLM: nada fica
+            # preso no banco durante as chamadas e as escritas do turno vão
+            # todas para o final (conferidas pela versão da sessão)
+            await db.commit()
+
+            # 1. Avaliar a resposta (Etapa 3)
+            resultado_avaliacao, mod_aluno = await em_thread(
+                its.etapa_3_avaliacao_interacao_inicial,
+                historico,
+                mod_aluno,
+                topico_atual,
+                mod_dominio,
+                contexto_aula,
+            )
 
         acertou = (
             resultado_avaliacao.get("acertou", False) if resultado_avaliacao else False
         )
 
         # 2. Gerar Feedback (Etapa 4/5)
-        exercicio_atual = mod_dominio.get(topico_atual, {}).get("exercicio", "")
+        if em_cache:
+            resultado_feedback = em_cache["feedback"]
+            await cache_respostas.registrar_uso(db, id_cache)
+        else:
+            resultado_feedback = await em_thread(
+                its.etapa_45_decidir_e_gerar_feedback,
+                exercicio=exercicio_atual,
+                resposta_aluno=dados.mensagem,
+                modelo_dominio=mod_dominio,
+                topico_atual=topico_atual,
+                acertou=acertou,
+                contexto_aula=contexto_aula,
+            )
+            if resultado_avaliacao and not resultado_feedback.get("fallback"):
+                await cache_respostas.guardar(
+                    db,
+                    escopo_cache,
+                    dados.mensagem,
+                    {"avaliacao": resultado_avaliacao, "feedback": resultado_feedback},
+                )
 
-        resultado_feedback = its.etapa_45_decidir_e_gerar_feedback(
-            exercicio=exercicio_atual,
-            resposta_aluno=dados.mensagem,
-            modelo_dominio=mod_dominio,
-            topico_atual=topico_atual,
-            acertou=acertou,
-        )
+        # Grava só a linha do tópico avaliado
+        if resultado_avaliacao and topico_atual in mod_aluno["topicos_status"]:
+            await progresso.salvar_topico(
+                db, sessao.id, topico_atual, mod_aluno["topicos_status"][topico_atual]
+            )
+            await analitico.registrar_avaliacao(
+                db,
+                curso,
+                topico_atual,
+                stats_anterior,
+                mod_aluno["topicos_status"][topico_atual],
+            )
 
         feedback_texto = resultado_feedback.get("mensagem_ao_aluno", "")
         proxima_acao = resultado_feedback.get("proxima_acao", "revisar")
@@ -406,9 +961,12 @@ async def responder_chat(dados: UserResponse, db: Session = Depends(get_db)):
         # O aluno leu o feedback positivo e respondeu "ok", "vamos", etc.
         # Agora selecionamos o próximo tópico (Etapa 7 e 1)
 
-        # Atualiza progresso geral (Etapa 7)
+        # Atualiza progresso geral (Etapa 7), agregado em progresso_topicos
         mod_aluno = its.etapa_7_atualizacao_pos_feedback(
-            historico, mod_aluno, mod_dominio
+            historico,
+            mod_aluno,
+            mod_dominio,
+            progresso_total=await progresso.percentual_compreendido(db, sessao.id),
         )
 
         # Seleciona próximo tópico (Etapa 1)
@@ -418,9 +976,11 @@ async def responder_chat(dados: UserResponse, db: Session = Depends(get_db)):
             # Não há mais tópicos pendentes
             resposta_final_bot = "🎓 **Parabéns! Você concluiu todos os tópicos planejados para esta aula.**"
             sessao.status = "concluido"
+            await analitico.registrar_conclusao(db, curso)
         else:
             # Avança para o próximo
             sessao.topico_atual = novo_topico
+            await analitico.registrar_chegada_topico(db, curso, novo_topico)
             topico_info = mod_dominio.get(novo_topico, {})
 
             resposta_final_bot = (
@@ -441,12 +1001,27 @@ async def responder_chat(dados: UserResponse, db: Session = Depends(get_db)):
         sessao.status = "aguardando_resposta_exercicio"
 
     # --- FINALIZAÇÃO ---
-    historico.append({"role": "model", "parts": [{"text": resposta_final_bot}]})
+    if topico_atual and segundos_turno:
+        await analitico.registrar_tempo(db, curso, topico_atual, segundos_turno)
+
+    mensagens = await historico_chat.adicionar_mensagens(
+        db,
+        sessao.id,
+        [("user", dados.mensagem), ("model", resposta_final_bot)],
+        seq=estado.proximo_seq,
+    )
+
+    sessao.modelo_aluno = its.salvar_json(progresso.modelo_aluno_para_salvar(mod_aluno))
+    # Todo turno gera um UPDATE da sessão, que confere e incrementa a versão
+    flag_modified(sessao, "modelo_aluno")
 
-    sessao.modelo_aluno = its.salvar_json(mod_aluno)
-    sessao.historico_chat = its.salvar_json(historico)
+    await db.commit()
 
-    db.commit()
+    # Gravado: o estado em memória passa para a nova versão
+    estado.modelo_aluno = mod_aluno
+    estado.proximo_seq += len(mensagens)
+    estado.ultima_mensagem_em = mensagens[-1].data_criacao
+    cache_sessoes.guardar(sessao, estado)
 
     return {
         "session_id": sessao.id,
@@ -454,9 +1029,245 @@ async def responder_chat(dados: UserResponse, db: Session = Depends(get_db)):
         "status_atual": sessao.status,
         "topico_atual": sessao.topico_atual,
         "progresso": mod_aluno.get("progresso_total", 0),
+        "similaridade_cache": similaridade_cache,
+        "versao": sessao.versao,
+        "ultimo_seq": mensagens[-1].seq,
+    }
+
+
+class RespostaLote(BaseModel):
+    aluno: str
+    resposta: str
+    session_id: Optional[int] = None  # Sessão do aluno, para aplicar o resultado
+
+
+class AvaliarLoteRequest(BaseModel):
+    sessao_referencia_id: int  # Sessão de onde vem o modelo de domínio
+    topico: str
+    respostas: List[RespostaLote]
+    aplicar: bool = False  # Atualiza o modelo_aluno das sessões informadas
+
+
+@app.post("/its/avaliar-lote")
+async def avaliar_lote(request: AvaliarLoteRequest, db: AsyncSession = Depends(get_db)):
+    """
+    Corrige muitas respostas ao mesmo exercício de uma vez (ex.: uma lista
+    feita em sala), usando o menor número possível de chamadas ao LLM.
+    """
+    if not request.respostas:
+        raise HTTPException(status_code=400, detail="Envie pelo menos uma resposta")
+
+    referencia = await db.get(
+        TutoriaSession, request.sessao_referencia_id
+    ) or await _restaurar_exclusivo(db, request.sessao_referencia_id)
+    if not referencia:
+        raise HTTPException(status_code=404, detail="Sessão de referência não encontrada")
+
+    estado_referencia = await cache_sessoes.carregar(db, referencia)
+    mod_dominio = estado_referencia.modelo_dominio
+    if request.topico not in mod_dominio:
+        raise HTTPException(status_code=404, detail="Tópico não encontrado no modelo de domínio")
+
+    # Respostas já avaliadas (iguais ou quase iguais) saem do cache; das
+    # restantes, respostas idênticas depois de normalizadas vão uma vez só
+    escopo_cache = cache_respostas.escopo(
+        estado_referencia.impressao_dominio, request.topico
+    )
+    avaliacoes = [None] * len(request.respostas)
+    usados = []  # Entradas do cache reaproveitadas
+    pendentes = {}  # resposta normalizada -> índices
+    for i, item in enumerate(request.respostas):
+        em_cache, similaridade, id_cache = await cache_respostas.buscar(
+            db, escopo_cache, item.resposta
+        )
+        if em_cache:
+            usados.append(id_cache)
+            avaliacoes[i] = {
+                "avaliado": True,
+                "acertou": bool(em_cache["avaliacao"].get("acertou", False)),
+                "compreensao": em_cache["avaliacao"].get("compreensao", 0),
+                "mensagem_ao_aluno": em_cache["feedback"].get("mensagem_ao_aluno", ""),
+                "similaridade_cache": similaridade,
+            }
+        else:
+            chave = cache_respostas.normalizar(item.resposta)
+            pendentes.setdefault(chave, []).append(i)
+
+    grupos, novas = list(pendentes.values()), []
+    if pendentes:
+        # Sem transação aberta enquanto o LLM corrige
+        await db.commit()
+        novas = await em_thread(
+            its.etapa_3_avaliacao_em_lote,
+            [request.respostas[g[0]].resposta for g in grupos],
+            request.topico,
+            mod_dominio,
+        )
+        for grupo, avaliacao in zip(grupos, novas):
+            for i in grupo:
+                avaliacoes[i] = {**avaliacao, "similaridade_cache": None}
+
+    aplicadas = [False] * len(request.respostas)
+    ocupadas = set()
+    async with AsyncExitStack() as leases:
+        # Os resultados só entram numa sessão de aluno com o lease dela, como
+        # um turno do chat; sessão com turno em andamento fica sem aplicar.
+        # Os leases vêm antes de qualquer escrita desta transação e ficam até
+        # o commit.
+        ids = set()
+        if request.aplicar:
+            ids = {r.session_id for r in request.respostas if r.session_id is not None}
+            for session_id in sorted(ids):
+                try:
+                    await leases.enter_async_context(
+                        concorrencia.turno_exclusivo(session_id, espera=0)
+                    )
+                except concorrencia.SessaoOcupadaError:
+                    ocupadas.add(session_id)
+            ids -= ocupadas
+
+        for grupo, avaliacao in zip(grupos, novas):
+            if avaliacao["avaliado"]:
+                await cache_respostas.guardar(
+                    db,
+                    escopo_cache,
+                    request.respostas[grupo[0]].resposta,
+                    {
+                        "avaliacao": {
+                            "acertou": avaliacao["acertou"],
+                            "compreensao": avaliacao["compreensao"],
+                        },
+                        "feedback": {
+                            "mensagem_ao_aluno": avaliacao["mensagem_ao_aluno"],
+                            "proxima_acao": "avancar" if avaliacao["acertou"] else "revisar",
+                        },
+                    },
+                )
+
+        for id_cache in usados:
+            await cache_respostas.registrar_uso(db, id_cache)
+
+        # Aplicar resultados às sessões dos alunos. Só valem sessões ativas com
+        # o mesmo modelo de domínio da referência (o exercício corrigido é o dela)
+        if ids:
+            alteradas = set()
+            stats_sessoes = await progresso.carregar_topico_sessoes(db, ids, request.topico)
+            dominio_referencia = (
+                select(TutoriaSession.modelo_dominio)
+                .where(TutoriaSession.id == referencia.id)
+                .scalar_subquery()
+            )
+            cursos = dict(
+                (
+                    await db.execute(
+                        select(TutoriaSession.id, TutoriaSession.audio_ids).where(
+                            TutoriaSession.id.in_(ids),
+                            TutoriaSession.modelo_dominio == dominio_referencia,
+                        )
+                    )
+                ).all()
+            )
+            for i, (item, avaliacao) in enumerate(zip(request.respostas, avaliacoes)):
+                if item.session_id not in cursos or not avaliacao["avaliado"]:
+                    continue
+                # 0 linhas: a sessão não tem o tópico ou foi arquivada nesse meio-tempo
+                if not await progresso.aplicar_resultado(
+                    db, item.session_id, request.topico, avaliacao
+                ):
+                    continue
+                aplicadas[i] = True
+                alteradas.add(item.session_id)
+
+                # Mesmo efeito de um turno de chat no painel da turma
+                anterior = stats_sessoes.get(item.session_id)
+                if anterior is None:
+                    continue
+                atual = its.atualizar_status_topico(
+                    {"topicos_status": {request.topico: dict(anterior)}},
+                    request.topico,
+                    avaliacao,
+                )["topicos_status"][request.topico]
+                await analitico.registrar_avaliacao(
+                    db,
+                    analitico.chave_curso(cursos[item.session_id]),
+                    request.topico,
+                    anterior,
+                    atual,
+                )
+                stats_sessoes[item.session_id] = atual
+
+            # O progresso dessas sessões mudou fora do turno do chat
+            await cache_sessoes.incrementar_versao(db, alteradas)
+
+        # Uma única transação: progresso, painel e cache de avaliações
+        await db.commit()
+
+    return {
+        "status": "sucesso",
+        "topico": request.topico,
+        "aplicadas": sum(aplicadas),
+        "sessoes_ocupadas": sorted(ocupadas),
+        "resultados": [
+            {
+                "aluno": item.aluno,
+                "session_id": item.session_id,
+                **avaliacao,
+                "aplicada": aplicada,
+            }
+            for item, avaliacao, aplicada in zip(
+                request.respostas, avaliacoes, aplicadas
+            )
+        ],
     }
 
 
+async def _restaurar_exclusivo(db, session_id):
+    """
+    Traz uma sessão arquivada de volta segurando o lease dela, como um turno
+    do chat, para não correr com o job de arquivamento nem com outro turno.
+    """
+    try:
+        async with concorrencia.turno_exclusivo(session_id):
+            sessao = await db.get(TutoriaSession, session_id) or await arquivo.restaurar(
+                db, session_id
+            )
+            await db.commit()
+            return sessao
+    except concorrencia.SessaoOcupadaError as e:
+        raise HTTPException(
+            status_code=409,
+            detail=str(e),
+            headers={"Retry-After": str(concorrencia.RETRY_AFTER_SEGUNDOS)},
+        )
+
+
+@app.get("/its/painel-turma")
+async def painel_turma(
+    request: Request, curso: Optional[str] = None, db: AsyncSession = Depends(get_db)
+):
+    """
+    Painel da turma por curso e tópico. Lê apenas os contadores mantidos a
+    cada turno, sem percorrer as sessões.
+    """
+    cursos = await analitico.painel(db, curso)
+
+    # Nomes das aulas de cada curso, para exibição
+    ids = {audio_id for c in cursos for audio_id in c["audio_ids"]}
+    nomes = dict(
+        (
+            await db.execute(
+                select(AudioLog.id, AudioLog.filename_original).where(
+                    AudioLog.id.in_(ids)
+                )
+            )
+        ).all()
+    )
+    for c in cursos:
+        c["aulas"] = [nomes.get(audio_id, f"Aula {audio_id}") for audio_id in c["audio_ids"]]
+
+    return condicional.responder(request, {"cursos": cursos})
+
+
 # --- Funções Auxiliares ---
 def salvar_json(obj):
     """Converte objeto para JSON string"""
@@ -0,0 +1,346 @@
+"""
+Migrações de dados executadas na inicialização do backend.
+
+Cada migração é idempotente: pode rodar a cada start sem efeito depois da
+primeira vez. Também podem ser executadas manualmente:
+
+    python -m backend.migracoes
+"""
+
+import asyncio
+import logging
+
+from sqlalchemy import MetaData, func, inspect, select, text
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.orm import undefer_group
+
+from backend import analitico, busca, its, pipeline, progresso
+from backend.database import (
+    AsyncSessionLocal,
+    Base,
+    CONTEUDO,
+    criar_tabelas,
+    AudioLog,
+    EtapaPipeline,
+    TutoriaSession,
+    ChatMessage,
+    TopicProgress,
+    ClassCourseStats,
+    ClassTopicStats,
+    SessaoArquivada,
+)
+
+log = logging.getLogger(__name__)
+
+
+async def migrar_historicos_json(db):
+    """Explode o JSON de `historico_chat` em linhas de `mensagens_chat`."""
+    sessoes = (
+        await db.scalars(
+            select(TutoriaSession)
+            .where(TutoriaSession.historico_chat.isnot(None))
+            .options(undefer_group(CONTEUDO))
+        )
+    ).all()
+
+    migradas = 0
+    for sessao in sessoes:
+        historico = its.carregar_json(sessao.historico_chat) or []
+        ja_migrada = await db.scalar(
+            select(ChatMessage.id).where(ChatMessage.session_id == sessao.id).limit(1)
+        )
+        if not ja_migrada:
+            for seq, mensagem in enumerate(historico, start=1):
+                db.add(
+                    ChatMessage(
+                        session_id=sessao.id,
+                        seq=seq,
+                        role=mensagem.get("role", "model"),
+                        texto=its.get_text_from_message(mensagem),
+                        data_criacao=sessao.data_criacao,
+                    )
+                )
+        sessao.historico_chat = None
+        migradas += 1
+
+    await db.commit()
+    if migradas:
+        log.info(
+            "Migração: históricos de chat convertidos em mensagens_chat",
+            extra={"sessoes": migradas},
+        )
+    return migradas
+
+
+async def migrar_topicos_status_json(db):
+    """Move `topicos_status` do JSON de modelo_aluno para `progresso_topicos`."""
+    sessoes = (
+        await db.scalars(
+            select(TutoriaSession)
+            .where(TutoriaSession.modelo_aluno.like('%"topicos_status"%'))
+            .options(undefer_group(CONTEUDO))
+        )
+    ).all()
+
+    migradas = 0
+    for sessao in sessoes:
+        modelo_aluno = its.carregar_json(sessao.modelo_aluno)
+        if "topicos_status" not in modelo_aluno:
+            continue
+        ja_migrada = await db.scalar(
+            select(TopicProgress.id)
+            .where(TopicProgress.session_id == sessao.id)
+            .limit(1)
+        )
+        if not ja_migrada:
+            progresso.criar_progresso(db, sessao.id, modelo_aluno["topicos_status"])
+        sessao.modelo_aluno = its.salvar_json(
+            progresso.modelo_aluno_para_salvar(modelo_aluno)
+        )
+        migradas += 1
+
+    await db.commit()
+    if migradas:
+        log.info(
+            "Migração: progresso das sessões movido para progresso_topicos",
+            extra={"sessoes": migradas},
+        )
+    return migradas
+
+
+async def popular_estatisticas_turma(db):
+    """
+    Preenche o painel da turma a partir das sessões que já existiam antes
+    dele. Só roda com o painel vazio. O histórico de avaliações não foi
+    guardado, então a compreensão média usa a última nota de cada aluno e o
+    tempo no tópico começa em zero.
+    """
+    if await db.scalar(select(ClassCourseStats.curso).limit(1)):
+        return 0
+
+    sessoes = (
+        await db.execute(
+            select(
+                TutoriaSession.id,
+                TutoriaSession.audio_ids,
+                TutoriaSession.status,
+                TutoriaSession.topico_atual,
+            )
+        )
+    ).all()
+    if not sessoes:
+        return 0
+
+    cursos, topicos = {}, {}
+    por_sessao = {s.id: s for s in sessoes}
+    for s in sessoes:
+        curso = cursos.setdefault(
+            analitico.chave_curso(s.audio_ids),
+            ClassCourseStats(sessoes_iniciadas=0, sessoes_concluidas=0),
+        )
+        curso.sessoes_iniciadas += 1
+        if s.status == "concluido":
+            curso.sessoes_concluidas += 1
+
+    for p in (await db.scalars(select(TopicProgress))).all():
+        sessao = por_sessao.get(p.session_id)
+        if sessao is None:
+            continue
+        chave = (analitico.chave_curso(sessao.audio_ids), p.topico)
+        t = topicos.setdefault(
+            chave,
+            ClassTopicStats(
+                tentativas=0,
+                acertos=0,
+                soma_compreensao=0,
+                segundos_no_topico=0,
+                alunos_chegaram=0,
+                alunos_tentaram=0,
+                alunos_compreenderam=0,
+            ),
+        )
+        tentativas = p.tentativas or 0
+        t.tentativas += tentativas
+        t.acertos += p.acertos or 0
+        t.soma_compreensao += (p.compreensao or 0) * tentativas
+        if tentativas or p.topico == sessao.topico_atual:
+            t.alunos_chegaram += 1
+        if tentativas:
+            t.alunos_tentaram += 1
+        if p.status == "compreendido":
+            t.alunos_compreenderam += 1
+
+    for chave, curso in cursos.items():
+        curso.curso = chave
+        db.add(curso)
+    for (chave, topico), t in topicos.items():
+        t.curso, t.topico = chave, topico
+        db.add(t)
+
+    await db.commit()
+    log.info("Migração: painel da turma preenchido", extra={"sessoes": len(sessoes)})
+    return len(sessoes)
+
+
+async def criar_indice_busca(db):
+    """Índice FTS5 das transcrições (e reconstrução para aulas já existentes)."""
+    if await busca.criar_indice(db):
+        log.info("Migração: índice de busca das transcrições reconstruído")
+
+
+async def construir_indices_recuperacao(db):
+    """Roda o pipeline de texto nas aulas que ainda não têm a etapa `indice`."""
+    com_indice = select(EtapaPipeline.audio_id).where(EtapaPipeline.etapa == "indice")
+    audios = (
+        await db.scalars(
+            select(AudioLog)
+            .where(AudioLog.id.notin_(com_indice))
+            .options(undefer_group(CONTEUDO))
+        )
+    ).all()
+
+    for audio in audios:
+        await pipeline.processar_texto(db, audio)
+    await db.commit()
+    if audios:
+        log.info(
+            "Migração: índice de recuperação criado", extra={"aulas": len(audios)}
+        )
+    return len(audios)
+
+
+async def adicionar_colunas_faltantes(db):
+    """
+    `create_all` não altera tabelas existentes; aqui adicionamos as colunas
+    declaradas depois (com o valor padrão do servidor, ex.: `versao`).
+    """
+
+    def _adicionar(conexao):
+        inspetor = inspect(conexao)
+        adicionadas = []
+        for tabela in Base.metadata.sorted_tables:
+            if not inspetor.has_table(tabela.name):
+                continue
+            existentes = {c["name"] for c in inspetor.get_columns(tabela.name)}
+            for coluna in tabela.columns:
+                if coluna.name in existentes:
+                    continue
+                tipo = coluna.type.compile(dialect=conexao.dialect)
+                padrao = ""
+                if coluna.server_default is not None:
+                    padrao = f" DEFAULT '{coluna.server_default.arg}'"
+                    if not coluna.nullable:
+                        padrao += " NOT NULL"
+                conexao.execute(
+                    text(
+                        f"ALTER TABLE {tabela.name} ADD COLUMN {coluna.name} {tipo}{padrao}"
+                    )
+                )
+                adicionadas.append(f"{tabela.name}.{coluna.name}")
+        return adicionadas
+
+    conexao = await db.connection()
+    adicionadas = await conexao.run_sync(_adicionar)
+    await db.commit()
+    if adicionadas:
+        log.info("Migração: colunas adicionadas", extra={"colunas": adicionadas})
+
+
+async def criar_indices_faltantes(db):
+    """
+    `create_all` só cria índices junto com tabelas novas; aqui criamos os
+    índices declarados depois que a tabela já existia.
+    """
+
+    def _criar(conexao):
+        for tabela in Base.metadata.sorted_tables:
+            for indice in tabela.indexes:
+                indice.create(conexao, checkfirst=True)
+
+    conexao = await db.connection()
+    await conexao.run_sync(_criar)
+    await db.commit()
+
+
+async def sessoes_com_autoincrement(db):
+    """
+    Refaz `sessoes_tutoria` com AUTOINCREMENT num banco SQLite criado antes
+    dele (o SQLite não altera a chave de uma tabela existente). A sequência
+    começa depois do maior id já usado, inclusive os do arquivo frio, para
+    que nenhuma sessão nova receba o id de uma arquivada. Os índices voltam
+    em `criar_indices_faltantes`.
+    """
+    if db.bind.dialect.name != "sqlite":
+        return False
+    definicao = await db.scalar(
+        text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :nome"),
+        {"nome": TutoriaSession.__tablename__},
+    )
+    if definicao is None or "AUTOINCREMENT" in definicao.upper():
+        return False
+
+    tabela = TutoriaSession.__table__
+    nova = tabela.to_metadata(MetaData(), name=f"{tabela.name}_nova")
+    colunas = ", ".join(c.name for c in tabela.columns)
+    maior_id = max(
+        await db.scalar(select(func.max(TutoriaSession.id))) or 0,
+        await db.scalar(select(func.max(SessaoArquivada.id))) or 0,
+    )
+    await db.commit()
+
+    # Com as chaves estrangeiras ligadas, o DROP apagaria (ou barraria) as
+    # mensagens e o progresso; o PRAGMA só vale fora de uma transação
+    conexao = await db.connection()
+    bruta = (await conexao.get_raw_connection()).driver_connection
+    try:
+        await bruta.executescript(
+            f"""
+            PRAGMA foreign_keys=OFF;
+            BEGIN;
+            {CreateTable(nova).compile(dialect=db.bind.dialect)};
+            INSERT INTO {nova.name} ({colunas}) SELECT {colunas} FROM {tabela.name};
+            DROP TABLE {tabela.name};
+            ALTER TABLE {nova.name} RENAME TO {tabela.name};
+            DELETE FROM sqlite_sequence WHERE name = '{tabela.name}';
+            INSERT INTO sqlite_sequence (name, seq) VALUES ('{tabela.name}', {maior_id});
+            COMMIT;
+            """
+        )
+    except Exception:
+        await bruta.rollback()
+        raise
+    finally:
+        await bruta.execute("PRAGMA foreign_keys=ON")
+    await db.commit()
+    log.info(
+        "Migração: sessoes_tutoria refeita com AUTOINCREMENT",
+        extra={"maior_id": maior_id},
+    )
+    return True
+
+
+MIGRACOES = [
+    adicionar_colunas_faltantes,
+    sessoes_com_autoincrement,
+    criar_indices_faltantes,
+    criar_indice_busca,
+    migrar_historicos_json,
+    migrar_topicos_status_json,
+    popular_estatisticas_turma,
+    construir_indices_recuperacao,
+]
+
+
+async def executar_migracoes():
+    async with AsyncSessionLocal() as db:
+        for migracao in MIGRACOES:
+            await migracao(db)
+
+
+async def _main():
+    await criar_tabelas()
+    await executar_migracoes()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -0,0 +1,269 @@
+"""
+Métricas (Prometheus) e logs estruturados do backend.
+
+Antes só havia `print`s soltos ("Transcrevendo ...", "Resposta do Gemini:
+..."), sem nível, sem tempo e sem como ligar uma linha à requisição que a
+gerou. Agora:
+
+- Logs: cada módulo usa `logging.getLogger(__name__)`. As linhas saem em
+  JSON (uma por linha; `LOG_FORMATO=texto` para leitura humana), com nível,
+  módulo, o id da requisição e os campos passados em `extra=`. O id vem do
+  cabeçalho `X-Request-ID` (ou é gerado) e volta na resposta; também vale
+  dentro das threads do threadpool, que copiam o contexto.
+- Métricas, em `/metrics`:
+  - `sigma_etapa_segundos{etapa, status_sessao}`: cada etapa quente
+    (gravação de arquivo, decodificação, transcrição, chamadas ao LLM por
+    etapa do ITS, commits do banco, turno do chat). `status_sessao` é o
+    status da sessão no início do turno ("-" fora de uma sessão);
+  - `sigma_transcricao_fator_tempo_real{modelo}`: tempo do Whisper / duração
+    do áudio;
+  - `sigma_llm_chamadas_total{etapa, resultado}`, `sigma_llm_tokens_total
+    {etapa, tipo}` (do `usage_metadata` do provedor) e
+    `sigma_llm_falhas_parse_total{etapa}`;
+  - `sigma_http_segundos{metodo, rota, status}`: por rota (o molde, ex.:
+    `/its/sessao/{session_id}`, não o caminho).
+
+Com vários workers, defina `PROMETHEUS_MULTIPROC_DIR` (modo multiprocesso do
+prometheus_client) para que `/metrics` some os processos.
+"""
+
+import contextvars
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client import multiprocess
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+NIVEL_LOG = os.getenv("LOG_NIVEL", "INFO").upper()
+FORMATO_LOG = os.getenv("LOG_FORMATO", "json")
+
+ID_REQUISICAO = contextvars.ContextVar("id_requisicao", default="-")
+STATUS_SESSAO = contextvars.ContextVar("status_sessao", default="-")
+
+# Faixas dos histogramas: de operações de banco (ms) a gerações longas (min)
+FAIXAS_SEGUNDOS = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300,
+)
+
+ETAPA_SEGUNDOS = Histogram(
+    "sigma_etapa_segundos",
+    "Duração de cada etapa quente do backend",
+    ["etapa", "status_sessao"],
+    buckets=FAIXAS_SEGUNDOS,
+)
+FATOR_TEMPO_REAL = Histogram(
+    "sigma_transcricao_fator_tempo_real",
+    "Tempo de transcrição dividido pela duração do áudio",
+    ["modelo"],
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 3, 5),
+)
+LLM_CHAMADAS = Counter(
+    "sigma_llm_chamadas_total",
+    "Chamadas ao LLM por etapa do ITS e resultado",
+    ["etapa", "resultado"],
+)
+LLM_TOKENS = Counter(
+    "sigma_llm_tokens_total",
+    "Tokens informados pelo provedor (prompt e resposta)",
+    ["etapa", "tipo"],
+)
+LLM_FALHAS_PARSE = Counter(
+    "sigma_llm_falhas_parse_total",
+    "Respostas do LLM sem o JSON esperado",
+    ["etapa"],
+)
+HTTP_SEGUNDOS = Histogram(
+    "sigma_http_segundos",
+    "Duração das requisições HTTP por rota",
+    ["metodo", "rota", "status"],
+    buckets=FAIXAS_SEGUNDOS,
+)
+
+log = logging.getLogger(__name__)
+
+
+# --- Logs ---
+_ATRIBUTOS_PADRAO = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class _FiltroContexto(logging.Filter):
+    def filter(self, registro):
+        registro.id_requisicao = ID_REQUISICAO.get()
+        return True
+
+
+class FormatoJSON(logging.Formatter):
+    """Uma linha JSON por registro, com os campos de `extra=`."""
+
+    def format(self, registro):
+        linha = {
+            "ts": datetime.fromtimestamp(registro.created, timezone.utc).isoformat(
+                timespec="milliseconds"
+            ),
+            "nivel": registro.levelname,
+            "modulo": registro.name,
+            "msg": registro.getMessage(),
+        }
+        for chave, valor in vars(registro).items():
+            if chave not in _ATRIBUTOS_PADRAO:
+                linha[chave] = valor
+        if registro.exc_info:
+            linha["excecao"] = self.formatException(registro.exc_info)
+        return json.dumps(linha, ensure_ascii=False, default=str)
+
+
+def configurar_logs():
+    """Handler único na raiz (stderr), no formato de `LOG_FORMATO`."""
+    raiz = logging.getLogger()
+    if any(getattr(h, "_sigma", False) for h in raiz.handlers):
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    handler._sigma = True
+    handler.addFilter(_FiltroContexto())
+    if FORMATO_LOG == "texto":
+        handler.setFormatter(
+            logging.Formatter(
+                "%(asctime)s %(levelname)s [%(id_requisicao)s] %(name)s: %(message)s"
+            )
+        )
+    else:
+        handler.setFormatter(FormatoJSON())
+    raiz.addHandler(handler)
+    raiz.setLevel(NIVEL_LOG)
+
+
+# --- Métricas ---
+@contextmanager
+def medir(etapa):
+    """Observa a duração do bloco em `sigma_etapa_segundos`."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        ETAPA_SEGUNDOS.labels(etapa, STATUS_SESSAO.get()).observe(
+            time.perf_counter() - inicio
+        )
+
+
+def definir_status_sessao(status):
+    """Status da sessão em atendimento, para rotular as etapas seguintes."""
+    STATUS_SESSAO.set(status or "-")
+
+
+def registrar_transcricao(modelo, segundos, duracao_audio):
+    ETAPA_SEGUNDOS.labels("transcricao", STATUS_SESSAO.get()).observe(segundos)
+    if duracao_audio > 0:
+        FATOR_TEMPO_REAL.labels(modelo).observe(segundos / duracao_audio)
+
+
+def registrar_llm(etapa, segundos, resposta=None, erro=None):
+    """Uma chamada ao provedor: duração, resultado e tokens do `usage_metadata`."""
+    ETAPA_SEGUNDOS.labels(f"llm_{etapa}", STATUS_SESSAO.get()).observe(segundos)
+    LLM_CHAMADAS.labels(etapa, type(erro).__name__ if erro else "ok").inc()
+    uso = getattr(resposta, "usage_metadata", None)
+    if uso is not None:
+        LLM_TOKENS.labels(etapa, "prompt").inc(
+            getattr(uso, "prompt_token_count", 0) or 0
+        )
+        LLM_TOKENS.labels(etapa, "resposta").inc(
+            getattr(uso, "candidates_token_count", 0) or 0
+        )
+
+
+def falha_parse(etapa, texto=""):
+    LLM_FALHAS_PARSE.labels(etapa).inc()
+    log.warning(
+        "Resposta do LLM sem o JSON esperado",
+        extra={"etapa": etapa, "inicio_resposta": (texto or "")[:200]},
+    )
+
+
+@event.listens_for(Session, "before_commit")
+def _antes_do_commit(sessao):
+    sessao.info["_inicio_commit"] = time.perf_counter()
+
+
+@event.listens_for(Session, "after_commit")
+def _depois_do_commit(sessao):
+    inicio = sessao.info.pop("_inicio_commit", None)
+    if inicio is not None:
+        ETAPA_SEGUNDOS.labels("db_commit", STATUS_SESSAO.get()).observe(
+            time.perf_counter() - inicio
+        )
+
+
+def exportar():
+    """(corpo, content-type) de `/metrics`."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registro = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registro)
+        return generate_latest(registro), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+# --- Middleware ---
+class MiddlewareRequisicao:
+    """
+    Middleware ASGI: id da requisição (contexto e cabeçalho `X-Request-ID`),
+    duração por rota em `sigma_http_segundos` e uma linha de log por requisição.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        cabecalhos = dict(scope.get("headers") or [])
+        id_requisicao = (
+            cabecalhos.get(b"x-request-id", b"").decode("latin-1")[:64]
+            or uuid.uuid4().hex[:16]
+        )
+        token_id = ID_REQUISICAO.set(id_requisicao)
+        token_status = STATUS_SESSAO.set("-")
+        status = 500
+        inicio = time.perf_counter()
+
+        async def enviar(mensagem):
+            nonlocal status
+            if mensagem["type"] == "http.response.start":
+                status = mensagem["status"]
+                mensagem.setdefault("headers", [])
+                mensagem["headers"] = list(mensagem["headers"]) + [
+                    (b"x-request-id", id_requisicao.encode("latin-1"))
+                ]
+            await send(mensagem)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            duracao = time.perf_counter() - inicio
+            rota = getattr(scope.get("route"), "path", "desconhecida")
+            if rota != "/metrics":
+                HTTP_SEGUNDOS.labels(scope["method"], rota, status).observe(duracao)
+                log.info(
+                    "Requisição",
+                    extra={
+                        "metodo": scope["method"],
+                        "rota": rota,
+                        "status": status,
+                        "ms": round(duracao * 1000, 1),
+                    },
+                )
+            ID_REQUISICAO.reset(token_id)
+            STATUS_SESSAO.reset(token_status)
@@ -0,0 +1,263 @@
+"""
+Perfilamento sob demanda de requisições.
+
+As métricas (backend/observabilidade.py) dizem qual etapa ficou lenta, mas
+não onde o tempo foi dentro dela: serialização de JSON, SQLAlchemy, o
+cliente do Gemini ou o event loop parado por uma transcrição. Este
+middleware grava um perfil da requisição quando:
+
+- quem chama pede, com `X-Perfilar: 1` (ou `?perfilar=1`) e o token de
+  `PERFIL_TOKEN` em `X-Perfil-Token` (ou `?perfil_token=`). Sem
+  `PERFIL_TOKEN` definido, o pedido é ignorado;
+- ou a requisição cai na amostragem (`PERFIL_AMOSTRAGEM`, fração de 0 a 1;
+  padrão 0).
+
+O perfil é por amostragem de pilhas: uma thread lê a pilha de todas as
+threads do processo a cada `PERFIL_INTERVALO_MS` enquanto a requisição
+dura. Entram a thread do event loop (mesmo parada no `select`, que é tempo
+esperando I/O) e as threads que estão trabalhando (threadpool do
+FastAPI/anyio, avaliação em lote); threads paradas esperando trabalho são
+descartadas. Como o processo é compartilhado, requisições simultâneas
+aparecem no mesmo perfil; o primeiro quadro de cada pilha é o nome da
+thread. Também é medido o tempo de CPU do processo e de cada thread vista.
+
+Os perfis são gravados em `PERFIL_DIR` no formato de pilhas dobradas
+(`thread;quadro;quadro N`), aberto direto pelo speedscope e pelo
+flamegraph.pl/inferno. A resposta perfilada leva `X-Perfil-Id`; o índice
+(os `PERFIL_MAX` mais recentes deste worker) fica em memória e é listado
+em `/admin/perfis`, do mais lento para o mais rápido.
+"""
+
+import hmac
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from datetime import datetime
+from urllib.parse import parse_qs
+
+from fastapi.concurrency import run_in_threadpool
+
+from backend.observabilidade import ID_REQUISICAO
+
+TOKEN = os.getenv("PERFIL_TOKEN", "")
+AMOSTRAGEM = float(os.getenv("PERFIL_AMOSTRAGEM", "0"))
+INTERVALO = float(os.getenv("PERFIL_INTERVALO_MS", "5")) / 1000
+PASTA = os.getenv("PERFIL_DIR", "uploads/perfis")
+MAX_PERFIS = int(os.getenv("PERFIL_MAX", "200"))
+PROFUNDIDADE_MAXIMA = 128
+
+# Quadros onde uma thread que não é a do event loop está só esperando trabalho
+_ESPERA = {
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+    ("_base.py", "wait"),
+}
+# Quadros que tanto esperam numa fila em C quanto executam código em C (a
+# thread de conexão do aiosqlite): só contam se a thread gastou CPU desde a
+# amostra anterior
+_ESPERA_SEM_CPU = {("core.py", "_connection_worker_thread")}
+
+log = logging.getLogger(__name__)
+
+_perfis = deque()  # dicionários do índice, do mais antigo para o mais novo
+_trava = threading.Lock()
+
+
+def token_valido(valor):
+    return bool(TOKEN) and hmac.compare_digest((valor or "").encode(), TOKEN.encode())
+
+
+def caminho(perfil_id):
+    """Onde o arquivo do perfil fica (ValueError para ids desconhecidos)."""
+    with _trava:
+        if not any(p["id"] == perfil_id for p in _perfis):
+            raise ValueError(f"Perfil desconhecido: {perfil_id!r}")
+    return os.path.join(PASTA, f"{perfil_id}.folded")
+
+
+def listar(limite=20):
+    """Os perfis mais lentos entre os recentes deste worker."""
+    with _trava:
+        perfis = list(_perfis)
+    return sorted(perfis, key=lambda p: p["duracao_ms"], reverse=True)[:limite]
+
+
+def _threads_vivas():
+    return {t.ident: t for t in threading.enumerate()}
+
+
+def _cpu_da_thread(ident):
+    """Tempo de CPU (s) da thread, ou None se a plataforma não informa."""
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(ident))
+    except (AttributeError, OSError, OverflowError):
+        return None
+
+
+def _quadro(codigo):
+    arquivo = os.path.basename(codigo.co_filename)
+    return f"{codigo.co_name} ({arquivo}:{codigo.co_firstlineno})".replace(";", ",")
+
+
+def _pilha(frame):
+    """Quadros da raiz até `frame`."""
+    quadros = []
+    while frame is not None and len(quadros) < PROFUNDIDADE_MAXIMA:
+        quadros.append(_quadro(frame.f_code))
+        frame = frame.f_back
+    quadros.reverse()
+    return tuple(quadros)
+
+
+def _quadro_folha(frame):
+    return os.path.basename(frame.f_code.co_filename), frame.f_code.co_name
+
+
+class _Amostrador(threading.Thread):
+    """Lê as pilhas das threads do processo a cada INTERVALO até `parar`."""
+
+    def __init__(self, thread_loop):
+        super().__init__(name="perfilamento", daemon=True)
+        self.thread_loop = thread_loop
+        self.pilhas = Counter()
+        self.amostras = 0
+        self.cpu_inicial = {}  # ident -> CPU da thread na 1ª vez que foi vista
+        self.cpu_anterior = {}  # ident -> CPU da thread na amostra anterior
+        self.nomes = {}
+        self._parar = threading.Event()
+
+    def run(self):
+        while not self._parar.wait(INTERVALO):
+            self._amostrar()
+
+    def parar(self):
+        self._parar.set()
+        self.join()
+
+    def _amostrar(self):
+        self.amostras += 1
+        for ident, frame in sys._current_frames().items():
+            if ident == self.ident:
+                continue
+            if ident not in self.nomes:
+                thread = _threads_vivas().get(ident)
+                self.nomes[ident] = thread.name if thread else str(ident)
+                self.cpu_inicial[ident] = _cpu_da_thread(ident) if thread else None
+                self.cpu_anterior[ident] = self.cpu_inicial[ident]
+            if ident != self.thread_loop and self._ociosa(ident, frame):
+                continue
+            self.pilhas[(self.nomes[ident],) + _pilha(frame)] += 1
+
+    def _ociosa(self, ident, frame):
+        folha = _quadro_folha(frame)
+        if folha in _ESPERA:
+            return True
+        if folha in _ESPERA_SEM_CPU:
+            anterior = self.cpu_anterior.get(ident)
+            atual = _cpu_da_thread(ident)
+            self.cpu_anterior[ident] = atual
+            return anterior is not None and atual is not None and atual == anterior
+        return False
+
+    def cpu_por_thread(self):
+        # Só threads ainda vivas: o relógio de CPU de uma thread encerrada não existe mais
+        vivas = _threads_vivas()
+        cpu = {}
+        for ident, inicial in self.cpu_inicial.items():
+            final = _cpu_da_thread(ident) if ident in vivas else None
+            if inicial is not None and final is not None:
+                cpu[self.nomes[ident]] = round((final - inicial) * 1000, 1)
+        return cpu
+
+
+def _gravar(perfil, pilhas):
+    os.makedirs(PASTA, exist_ok=True)
+    with open(os.path.join(PASTA, f"{perfil['id']}.folded"), "w") as saida:
+        for pilha, contagem in pilhas.most_common():
+            saida.write(f"{';'.join(pilha)} {contagem}\n")
+
+    with _trava:
+        _perfis.append(perfil)
+        antigos = []
+        while len(_perfis) > MAX_PERFIS:
+            antigos.append(_perfis.popleft())
+    for antigo in antigos:
+        try:
+            os.remove(os.path.join(PASTA, f"{antigo['id']}.folded"))
+        except OSError:
+            pass
+
+
+class MiddlewarePerfilamento:
+    """Middleware ASGI: perfila as requisições pedidas ou sorteadas."""
+
+    def __init__(self, app):
+        self.app = app
+
+    def _deve_perfilar(self, scope):
+        if AMOSTRAGEM > 0 and random.random() < AMOSTRAGEM:
+            return "amostragem"
+        if not TOKEN:
+            return None
+        cabecalhos = dict(scope.get("headers") or [])
+        consulta = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        pedido = cabecalhos.get(b"x-perfilar") == b"1" or consulta.get("perfilar") == ["1"]
+        if not pedido:
+            return None
+        token = cabecalhos.get(b"x-perfil-token", b"").decode("latin-1") or (
+            consulta.get("perfil_token") or [""]
+        )[0]
+        return "pedido" if token_valido(token) else None
+
+    async def __call__(self, scope, receive, send):
+        motivo = self._deve_perfilar(scope) if scope["type"] == "http" else None
+        if motivo is None:
+            return await self.app(scope, receive, send)
+
+        perfil_id = uuid.uuid4().hex[:16]
+        status = 500
+
+        async def enviar(mensagem):
+            nonlocal status
+            if mensagem["type"] == "http.response.start":
+                status = mensagem["status"]
+                mensagem["headers"] = list(mensagem.get("headers", [])) + [
+                    (b"x-perfil-id", perfil_id.encode())
+                ]
+            await send(mensagem)
+
+        amostrador = _Amostrador(threading.get_ident())
+        inicio = time.perf_counter()
+        cpu_processo = time.process_time()
+        cpu_loop = time.thread_time()
+        amostrador.start()
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            await run_in_threadpool(amostrador.parar)
+            perfil = {
+                "id": perfil_id,
+                "data": datetime.utcnow().isoformat(timespec="seconds"),
+                "id_requisicao": ID_REQUISICAO.get(),
+                "metodo": scope["method"],
+                "rota": getattr(scope.get("route"), "path", scope["path"]),
+                "caminho": scope["path"],
+                "status": status,
+                "motivo": motivo,
+                "duracao_ms": round((time.perf_counter() - inicio) * 1000, 1),
+                "cpu_processo_ms": round((time.process_time() - cpu_processo) * 1000, 1),
+                "cpu_event_loop_ms": round((time.thread_time() - cpu_loop) * 1000, 1),
+                "cpu_threads_ms": amostrador.cpu_por_thread(),
+                "amostras": amostrador.amostras,
+            }
+            try:
+                await run_in_threadpool(_gravar, perfil, amostrador.pilhas)
+                log.info("Perfil gravado", extra=perfil)
+            except OSError:
+                log.exception("Erro ao gravar perfil", extra={"perfil_id": perfil_id})
@@ -0,0 +1,539 @@
+"""
+Pipeline incremental de conteúdo: áudio -> tutoria.
+
+Etapas (cada uma grava a impressão digital da entrada e da saída):
+
+    decodificacao -> transcricao -> limpeza -> segmentacao -> trecho/topicos -> modelo_dominio
+                                                            \-> indice (busca BM25 dos trechos)
+
+Uma etapa só é reexecutada quando a impressão da sua entrada muda. A
+segmentação é feita por conteúdo (a fronteira de um trecho depende do texto
+das frases, não da posição), então editar um parágrafo da transcrição muda
+apenas o(s) trecho(s) daquele parágrafo; os demais mantêm a mesma impressão
+e não são reprocessados. O modelo de domínio é endereçado pela impressão de
+todas as suas entradas, então só é gerado de novo quando algo realmente mudou.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import time
+import unicodedata
+from collections import Counter
+from datetime import datetime
+
+import whisper
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import delete, select
+
+from backend import blobs, cassete
+from backend.database import EtapaPipeline, ModeloDominioCache, insert_upsert
+from backend.governador import em_thread
+from backend.observabilidade import medir, registrar_transcricao
+from backend.prompts import estimar_tokens
+
+log = logging.getLogger(__name__)
+
+# Tamanho dos trechos (em palavras)
+TRECHO_MIN_PALAVRAS = 80
+TRECHO_MAX_PALAVRAS = 300
+# Em média 1 a cada N frases encerra um trecho (fronteira definida pelo conteúdo)
+TRECHO_DIVISOR_FRONTEIRA = 6
+TOPICOS_POR_TRECHO = 8
+# whisper.load_audio devolve PCM mono a 16 kHz
+TAXA_AMOSTRAGEM = 16000
+
+STOPWORDS_PT = set(
+    """
+    a à às ao aos aquela aquelas aquele aqueles aquilo as até com como da das de
+    dela delas dele deles depois do dos e é ela elas ele eles em entre era eram
+    essa essas esse esses esta estas este estes eu foi foram há isso isto já la
+    lhe lhes mais mas me mesmo meu minha muito na nas não nem no nos nós o os ou
+    para pela pelas pelo pelos por qual quando que quem se sem ser seu seus sua
+    suas só também te tem têm tu tua um uma umas uns você vocês vai vamos então
+    aqui ali agora gente tá né ter sobre assim porque pra pro cada ainda onde
+    """.split()
+)
+# Mesmas palavras sem acento, para o índice de recuperação
+STOPWORDS_SEM_ACENTO = {
+    "".join(c for c in unicodedata.normalize("NFKD", p) if not unicodedata.combining(c))
+    for p in STOPWORDS_PT
+}
+
+
+def impressao(*partes):
+    """Impressão digital (sha256) de um conjunto de valores."""
+    h = hashlib.sha256()
+    for parte in partes:
+        if not isinstance(parte, (str, bytes)):
+            parte = json.dumps(parte, ensure_ascii=False, sort_keys=True, default=str)
+        if isinstance(parte, str):
+            parte = parte.encode("utf-8")
+        h.update(parte)
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+def impressao_arquivo(caminho):
+    """Impressão digital do conteúdo de um arquivo, lido em blocos."""
+    h = hashlib.sha256()
+    with open(caminho, "rb") as f:
+        for bloco in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(bloco)
+    return h.hexdigest()
+
+
+# --- Transformações puras de cada etapa ---
+# Muda quando a limpeza muda, para que as aulas já processadas sejam limpas de novo
+VERSAO_LIMPEZA = 3
+# Hesitações que o Whisper transcreve ("éé", "ãh", "hum", "né?"). "é" sozinho
+# é verbo e fica.
+_MULETAS = re.compile(
+    r"(?<!\w)(?:é{2,}h*|éh+|ã+h+|ahn+|hu*m{1,}|hmm+|uhum|né)(?!\w)[?!,.]*",
+    re.IGNORECASE,
+)
+# A mesma palavra repetida em seguida ("que que", "a a a"). Só letras:
+# números repetidos são conteúdo ("0, 1, 1, 2", "11 11")
+_PALAVRA_REPETIDA = re.compile(r"\b([^\W\d_]+)(?:\s+\1\b)+", re.IGNORECASE)
+_FRASES = re.compile(r"(?<=[.!?])\s+")
+
+
+def _sem_muleta(m):
+    # Uma muleta que fechava a frase ("..., né?") deixa o ponto final
+    return " . " if re.search(r"[.?!]", m.group(0)) else " "
+
+
+def _limpar_paragrafo(paragrafo):
+    texto = _MULETAS.sub(_sem_muleta, paragrafo)
+    texto = _PALAVRA_REPETIDA.sub(r"\1", texto)
+    texto = re.sub(r"\s+([,.!?;:])", r"\1", texto)
+    texto = re.sub(r"[,;:]+([.!?])", r"\1", texto)
+    texto = re.sub(r"([,;:])(?:\s*[,;:])+", r"\1", texto)
+    texto = re.sub(r"([.!?])\.+", r"\1", texto)
+    texto = re.sub(r"[ \t]+", " ", texto).strip(" ,;:")
+    texto = re.sub(r"^[.!?]\s*", "", texto)
+
+    # Frases iguais em sequência (laço de repetição do Whisper); o corte de
+    # uma muleta pode deixar a frase começando em minúscula
+    frases, anterior = [], None
+    for frase in _FRASES.split(texto):
+        chave = frase.rstrip(".!?").casefold()
+        if frase and chave != anterior:
+            frases.append(frase[0].upper() + frase[1:])
+        anterior = chave
+    return " ".join(frases)
+
+
+def limpar_transcricao(texto):
+    """
+    Normaliza espaços e quebras de linha da transcrição e tira o que só
+    ocupa espaço no prompt: hesitações, palavras repetidas em seguida e
+    frases repetidas em sequência.
+    """
+    paragrafos = [_limpar_paragrafo(p) for p in re.split(r"\n\s*\n", texto or "")]
+    return "\n\n".join(p for p in paragrafos if p)
+
+
+def segmentar(texto):
+    """
+    Divide o texto em trechos por conteúdo: uma frase encerra o trecho quando
+    o hash dela cai na fronteira (ou o trecho ficou grande demais). Como a
+    decisão depende só da frase, uma edição local não desloca os trechos
+    seguintes.
+    """
+    trechos = []
+    for paragrafo in texto.split("\n\n"):
+        frases = re.split(r"(?<=[.!?])\s+", paragrafo)
+        atual, palavras = [], 0
+        for frase in frases:
+            if not frase:
+                continue
+            atual.append(frase)
+            palavras += len(frase.split())
+            fronteira = (
+                int(hashlib.md5(frase.encode("utf-8")).hexdigest(), 16)
+                % TRECHO_DIVISOR_FRONTEIRA
+                == 0
+            )
+            if (fronteira and palavras >= TRECHO_MIN_PALAVRAS) or (
+                palavras >= TRECHO_MAX_PALAVRAS
+            ):
+                trechos.append(" ".join(atual))
+                atual, palavras = [], 0
+        if atual:
+            trechos.append(" ".join(atual))
+    return trechos
+
+
+def extrair_topicos(trecho, n=TOPICOS_POR_TRECHO):
+    """Termos mais frequentes do trecho (sem stopwords), como pistas de tópico."""
+    palavras = re.findall(r"\w+", trecho.lower())
+    contagem = Counter(
+        p for p in palavras if len(p) > 2 and p not in STOPWORDS_PT and not p.isdigit()
+    )
+    return [p for p, _ in contagem.most_common(n)]
+
+
+def tokenizar(texto):
+    """Termos para o índice de recuperação: minúsculos, sem acento e sem stopwords."""
+    texto = unicodedata.normalize("NFKD", (texto or "").lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return [
+        p
+        for p in re.findall(r"\w+", texto)
+        if len(p) > 2 and p not in STOPWORDS_SEM_ACENTO and not p.isdigit()
+    ]
+
+
+def construir_indice(chaves, trechos):
+    """
+    Índice invertido dos trechos de uma aula, para ranqueamento BM25:
+    {"chaves": [...], "tamanhos": [...], "postings": {termo: [[i, tf], ...]}}.
+    """
+    postings = {}
+    tamanhos = []
+    for i, trecho in enumerate(trechos):
+        termos = tokenizar(trecho)
+        tamanhos.append(len(termos))
+        for termo, tf in Counter(termos).items():
+            postings.setdefault(termo, []).append([i, tf])
+    return {"chaves": chaves, "tamanhos": tamanhos, "postings": postings}
+
+
+# --- Persistência das etapas ---
+async def _buscar_etapa(db, audio_id, etapa, chave=""):
+    return await db.scalar(
+        select(EtapaPipeline).where(
+            EtapaPipeline.audio_id == audio_id,
+            EtapaPipeline.etapa == etapa,
+            EtapaPipeline.chave == chave,
+        )
+    )
+
+
+async def _gravar_etapa(db, audio_id, etapa, impressao_entrada, saida, chave=""):
+    registro = await _buscar_etapa(db, audio_id, etapa, chave)
+    if not registro:
+        registro = EtapaPipeline(audio_id=audio_id, etapa=etapa, chave=chave)
+        db.add(registro)
+    registro.impressao_entrada = impressao_entrada
+    registro.saida = saida
+    registro.impressao = impressao(saida) if saida is not None else impressao_entrada
+    registro.atualizado_em = datetime.utcnow()
+    return registro
+
+
+async def _executar_etapa(db, audio_id, etapa, impressao_entrada, calcular, chave=""):
+    """
+    Retorna (saida, reexecutou). Se a entrada não mudou desde a última
+    execução, devolve a saída gravada sem recalcular.
+    """
+    registro = await _buscar_etapa(db, audio_id, etapa, chave)
+    if registro and registro.impressao_entrada == impressao_entrada:
+        return registro.saida, False
+    saida = calcular()
+    await _gravar_etapa(db, audio_id, etapa, impressao_entrada, saida, chave)
+    return saida, True
+
+
+# --- Etapas de ingestão (áudio -> texto) ---
+def _decodificar_e_transcrever(caminho, modelo_whisper, nome_modelo, impressao_audio):
+    # Com o cassete ligado, grava ou reproduz a transcrição (backend/cassete.py)
+    return cassete.transcricao(
+        impressao_audio,
+        nome_modelo,
+        lambda: _transcrever(caminho, modelo_whisper, nome_modelo),
+    )
+
+
+def _transcrever(caminho, modelo_whisper, nome_modelo):
+    with medir("decodificacao"):
+        pcm = whisper.load_audio(caminho)
+    inicio = time.perf_counter()
+    texto = modelo_whisper.transcribe(pcm, language="pt", temperature=0)["text"]
+    registrar_transcricao(
+        nome_modelo, time.perf_counter() - inicio, len(pcm) / TAXA_AMOSTRAGEM
+    )
+    return texto
+
+
+async def transcrever_audio(db, audio, modelo_whisper, nome_modelo):
+    """
+    Etapas de decodificação e transcrição. A transcrição é reaproveitada de
+    qualquer aula com o mesmo arquivo de áudio e o mesmo modelo. O trabalho
+    pesado (hash do arquivo, ffmpeg e Whisper) roda numa thread.
+
+    Nada é escrito antes da transcrição: o SQLite aceita uma escrita por vez,
+    e uma transação aberta durante o Whisper travaria os turnos de chat. Uma
+    aula nova (`audio` ainda sem id) é inserida aqui, junto com as etapas,
+    depois do texto pronto.
+    """
+    impressao_audio = await run_in_threadpool(impressao_arquivo, audio.caminho_arquivo)
+    entrada = impressao(impressao_audio, nome_modelo, "pt")
+    anterior = await db.scalar(
+        select(EtapaPipeline)
+        .where(
+            EtapaPipeline.etapa == "transcricao",
+            EtapaPipeline.impressao_entrada == entrada,
+        )
+        .limit(1)
+    )
+    if anterior:
+        log.info(
+            "Transcrição reaproveitada",
+            extra={"audio_id": audio.id, "origem_audio_id": anterior.audio_id},
+        )
+        texto = anterior.saida
+    else:
+        # Encerra a transação (só de leitura) antes de transcrever
+        await db.commit()
+        log.info("Transcrevendo", extra={"audio_id": audio.id, "modelo": nome_modelo})
+        texto = await run_in_threadpool(
+            _decodificar_e_transcrever,
+            audio.caminho_arquivo,
+            modelo_whisper,
+            nome_modelo,
+            impressao_audio,
+        )
+
+    if audio.id is None:
+        db.add(audio)
+        await db.flush()
+    await _gravar_etapa(db, audio.id, "decodificacao", impressao_audio, None)
+    await _gravar_etapa(db, audio.id, "transcricao", entrada, texto)
+    return texto
+
+
+# --- Etapas de texto (transcrição -> trechos -> tópicos) ---
+async def processar_texto(db, audio):
+    """
+    Reexecuta limpeza, segmentação e extração de tópicos da aula, apenas
+    onde a entrada mudou. Retorna os trechos e quantos foram reprocessados.
+    """
+    texto = audio.transcricao_editada or audio.transcricao or ""
+
+    limpo, _ = await _executar_etapa(
+        db,
+        audio.id,
+        "limpeza",
+        impressao(texto, VERSAO_LIMPEZA),
+        lambda: limpar_transcricao(texto),
+    )
+    trechos_json, _ = await _executar_etapa(
+        db,
+        audio.id,
+        "segmentacao",
+        impressao(limpo),
+        lambda: json.dumps(segmentar(limpo), ensure_ascii=False),
+    )
+    trechos = json.loads(trechos_json)
+
+    # Trechos e tópicos são indexados pela impressão do próprio trecho
+    chaves = [impressao(t) for t in trechos]
+    existentes = set(
+        (
+            await db.scalars(
+                select(EtapaPipeline.chave).where(
+                    EtapaPipeline.audio_id == audio.id,
+                    EtapaPipeline.etapa == "topicos",
+                )
+            )
+        ).all()
+    )
+
+    reprocessados = 0
+    for chave, trecho in zip(chaves, trechos):
+        if chave in existentes:
+            continue
+        await _gravar_etapa(db, audio.id, "trecho", chave, trecho, chave=chave)
+        await _gravar_etapa(
+            db,
+            audio.id,
+            "topicos",
+            chave,
+            json.dumps(extrair_topicos(trecho), ensure_ascii=False),
+            chave=chave,
+        )
+        existentes.add(chave)
+        reprocessados += 1
+
+    # Índice de recuperação da aula (só é refeito se algum trecho mudou)
+    await _executar_etapa(
+        db,
+        audio.id,
+        "indice",
+        impressao(chaves),
+        lambda: json.dumps(construir_indice(chaves, trechos), ensure_ascii=False),
+    )
+
+    # Remove trechos que não existem mais na versão atual do texto
+    await db.execute(
+        delete(EtapaPipeline).where(
+            EtapaPipeline.audio_id == audio.id,
+            EtapaPipeline.etapa.in_(["trecho", "topicos"]),
+            EtapaPipeline.chave.notin_(set(chaves)),
+        )
+    )
+    await db.flush()
+
+    return {
+        "texto_limpo": limpo,
+        "trechos": len(trechos),
+        "trechos_reprocessados": reprocessados,
+        "impressao_trechos": chaves,
+    }
+
+
+# --- Etapa final (aulas -> modelo de domínio) ---
+async def obter_modelo_dominio(db, audios, arquivos, n_topicos, audiencia, gerar):
+    """
+    Retorna (modelo_dominio, reaproveitado). `arquivos` são os Blobs (PDFs)
+    enviados junto. `gerar(texto)` só é chamado (numa thread) se nenhum modelo
+    foi gerado antes para exatamente as mesmas entradas; nesse caso as etapas
+    de texto são gravadas (commit) antes da geração.
+
+    Pedidos simultâneos com as mesmas entradas (uma turma inteira começando
+    junto) esperam a geração em andamento neste worker em vez de chamar o LLM
+    de novo. Entre workers, o primeiro modelo gravado vale para todos.
+    """
+    audios = sorted(audios, key=lambda a: a.id)
+
+    partes_texto, impressoes, tokens_limpos = [], [], 0
+    for audio in audios:
+        resultado = await processar_texto(db, audio)
+        tokens_limpos += estimar_tokens(resultado["texto_limpo"])
+        partes_texto.append(
+            f"\n--- Aula: {audio.filename_original} ---\n{resultado['texto_limpo']}"
+        )
+        impressoes.append(resultado["impressao_trechos"])
+
+    # O id do blob já é o sha256 do arquivo
+    impressoes_pdf = [b.id for b in arquivos]
+    chave = impressao(impressoes, impressoes_pdf, n_topicos, audiencia)
+
+    cache = await db.get(ModeloDominioCache, chave)
+    if cache:
+        log.info("Modelo de Domínio reaproveitado do cache do pipeline")
+        cache.ultimo_uso = datetime.utcnow()
+        return json.loads(cache.modelo_dominio), True
+
+    em_andamento = _gerando.get(chave)
+    if em_andamento is not None:
+        # Sem transação aberta durante a espera: quem está gerando precisa
+        # gravar o modelo
+        await db.commit()
+        log.info("Modelo de Domínio já em geração; aguardando")
+        modelo_dominio = await asyncio.shield(em_andamento)
+        return modelo_dominio, modelo_dominio is not None
+
+    futuro = asyncio.get_running_loop().create_future()
+    _gerando[chave] = futuro
+    try:
+        modelo_dominio = await _gerar_modelo_dominio(
+            db, chave, audios, impressoes_pdf, "".join(partes_texto), tokens_limpos, gerar
+        )
+        futuro.set_result(modelo_dominio)
+        return modelo_dominio, False
+    except Exception as e:
+        futuro.set_exception(e)
+        raise
+    except BaseException:
+        futuro.set_exception(RuntimeError("Geração do Modelo de Domínio interrompida"))
+        raise
+    finally:
+        del _gerando[chave]
+        if futuro.done() and not futuro.cancelled():
+            futuro.exception()  # Já entregue a quem esperava; sem aviso no log
+
+
+# Gerações do modelo de domínio em andamento neste worker: chave -> Future
+_gerando = {}
+
+
+async def _gerar_modelo_dominio(
+    db, chave, audios, impressoes_pdf, texto_aulas, tokens_limpos, gerar
+):
+    log.info(
+        "Texto das aulas para o Modelo de Domínio",
+        extra={
+            "tokens_transcricao": sum(
+                estimar_tokens(a.transcricao_editada or a.transcricao) for a in audios
+            ),
+            "tokens_limpos": tokens_limpos,
+        },
+    )
+
+    # Grava as etapas de texto e encerra a transação antes da geração (que
+    # leva dezenas de segundos), para não segurar o banco enquanto isso
+    await db.commit()
+    modelo_dominio = await em_thread(gerar, texto_aulas)
+    if not modelo_dominio:
+        return None
+
+    comando = (
+        insert_upsert(db, ModeloDominioCache)
+        .values(
+            impressao=chave,
+            modelo_dominio=json.dumps(modelo_dominio, ensure_ascii=False),
+            audio_ids=json.dumps([a.id for a in audios]),
+            blob_ids=json.dumps(impressoes_pdf),
+            data_criacao=datetime.utcnow(),
+            ultimo_uso=datetime.utcnow(),
+        )
+        .on_conflict_do_nothing(index_elements=["impressao"])
+    )
+    if (await db.execute(comando)).rowcount == 0:
+        # Outro worker gravou o mesmo modelo enquanto este gerava: vale o dele
+        log.info("Modelo de Domínio gravado por outro worker; usando o gravado")
+        existente = await db.get(ModeloDominioCache, chave)
+        return json.loads(existente.modelo_dominio)
+
+    # O modelo guarda os arquivos de onde veio
+    await blobs.adicionar_referencias(db, set(impressoes_pdf))
+    for audio in audios:
+        await _gravar_etapa(db, audio.id, "modelo_dominio", chave, None, chave=chave)
+    await db.flush()
+    return modelo_dominio
+
+
+async def estado_pipeline(db, audio_id):
+    """Resumo das etapas gravadas para uma aula (sem o conteúdo das saídas)."""
+    registros = (
+        await db.scalars(
+            select(EtapaPipeline)
+            .where(EtapaPipeline.audio_id == audio_id)
+            .order_by(EtapaPipeline.id)
+        )
+    ).all()
+
+    etapas = []
+    trechos = {}
+    modelos = []
+    for r in registros:
+        item = {
+            "etapa": r.etapa,
+            "impressao_entrada": r.impressao_entrada,
+            "impressao": r.impressao,
+            "tamanho_saida": len(r.saida) if r.saida else 0,
+            "atualizado_em": r.atualizado_em.isoformat() if r.atualizado_em else None,
+        }
+        if r.etapa == "trecho":
+            trechos.setdefault(r.chave, {"chave": r.chave}).update(item)
+        elif r.etapa == "topicos":
+            trechos.setdefault(r.chave, {"chave": r.chave})["topicos"] = json.loads(
+                r.saida or "[]"
+            )
+        elif r.etapa == "modelo_dominio":
+            modelos.append({"chave": r.chave, **item})
+        else:
+            etapas.append(item)
+
+    return {
+        "audio_id": audio_id,
+        "etapas": etapas,
+        "trechos": list(trechos.values()),
+        "modelos_dominio": modelos,
+    }
+
@@ -0,0 +1,115 @@
+"""
+Progresso do aluno por tópico, guardado em `progresso_topicos`.
+
+O restante do modelo do aluno (nível geral, progresso total) continua no
+JSON de `TutoriaSession.modelo_aluno`; `topicos_status` é montado a partir
+destas linhas quando uma etapa do ITS precisa dele. Cada atualização mexe em
+uma única linha, e perguntas como "em quais tópicos os alunos travam"
+viram consultas agregadas em vez de decodificar o JSON de cada sessão.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import case, func, select, update
+
+from backend.database import TopicProgress
+
+LIMIAR_COMPREENDIDO = 70
+
+CAMPOS = ("status", "tentativas", "acertos", "compreensao")
+
+
+def criar_progresso(db, session_id, topicos_status):
+    """Insere uma linha por tópico do modelo do aluno recém-criado."""
+    for topico, stats in topicos_status.items():
+        db.add(
+            TopicProgress(
+                session_id=session_id,
+                topico=topico,
+                **{campo: stats.get(campo) for campo in CAMPOS},
+            )
+        )
+
+
+async def carregar_topicos_status(db, session_id):
+    """Monta o dicionário `topicos_status` usado pelas etapas do ITS."""
+    linhas = (
+        await db.execute(
+            select(TopicProgress.topico, *[getattr(TopicProgress, c) for c in CAMPOS])
+            .where(TopicProgress.session_id == session_id)
+            .order_by(TopicProgress.id)
+        )
+    ).all()
+    return {
+        linha.topico: {campo: getattr(linha, campo) for campo in CAMPOS}
+        for linha in linhas
+    }
+
+
+async def salvar_topico(db, session_id, topico, stats):
+    """Grava as estatísticas de um tópico (UPDATE de uma linha)."""
+    await db.execute(
+        update(TopicProgress)
+        .where(TopicProgress.session_id == session_id, TopicProgress.topico == topico)
+        .values(
+            **{campo: stats[campo] for campo in CAMPOS}, updated_at=datetime.utcnow()
+        )
+    )
+
+
+async def aplicar_resultado(db, session_id, topico, resultado):
+    """
+    Aplica o resultado de uma avaliação direto no banco, sem ler a linha antes
+    (mesma regra de `its.atualizar_status_topico`). Devolve quantas linhas
+    mudaram: 0 se a sessão não tem o tópico (ou não está mais nas tabelas).
+    """
+    compreensao = resultado.get("compreensao", 0)
+    resultado_update = await db.execute(
+        update(TopicProgress)
+        .where(TopicProgress.session_id == session_id, TopicProgress.topico == topico)
+        .values(
+            tentativas=TopicProgress.tentativas + 1,
+            acertos=TopicProgress.acertos + (1 if resultado.get("acertou") else 0),
+            compreensao=compreensao,
+            status="compreendido"
+            if compreensao >= LIMIAR_COMPREENDIDO
+            else "em_progresso",
+            updated_at=datetime.utcnow(),
+        )
+    )
+    return resultado_update.rowcount
+
+
+async def percentual_compreendido(db, session_id):
+    """Percentual de tópicos compreendidos da sessão (agregado no banco)."""
+    total, compreendidos = (
+        await db.execute(
+            select(
+                func.count(),
+                func.sum(case((TopicProgress.status == "compreendido", 1), else_=0)),
+            ).where(TopicProgress.session_id == session_id)
+        )
+    ).one()
+    return (compreendidos or 0) / total * 100 if total else 0
+
+
+def modelo_aluno_para_salvar(modelo_aluno):
+    """O JSON de modelo_aluno sem `topicos_status`, que mora em progresso_topicos."""
+    return {k: v for k, v in modelo_aluno.items() if k != "topicos_status"}
+
+
+async def carregar_topico_sessoes(db, session_ids, topico):
+    """Estatísticas de um tópico em várias sessões: {session_id: stats}."""
+    linhas = (
+        await db.execute(
+            select(TopicProgress.session_id, *[getattr(TopicProgress, c) for c in CAMPOS])
+            .where(
+                TopicProgress.session_id.in_(session_ids),
+                TopicProgress.topico == topico,
+            )
+        )
+    ).all()
+    return {
+        linha.session_id: {campo: getattr(linha, campo) for campo in CAMPOS}
+        for linha in linhas
+    }
@@ -0,0 +1,138 @@
+"""
+Montagem dos prompts do ITS a partir de partes nomeadas, com orçamento de tokens.
+
+Os prompts eram f-strings montadas à mão, e a geração do modelo de domínio
+mandava a transcrição duas vezes (dentro do prompt e de novo como segunda
+parte do conteúdo), sem nenhum limite de tamanho. Aqui cada etapa declara
+as suas partes uma vez só, em ordem:
+
+- fixas: instruções e formato de saída, enviadas sempre inteiras;
+- ajustáveis: conteúdo que pode ser recortado (transcrições, trechos da
+  aula). Se o total passa do orçamento, o que sobra depois das fixas é
+  dividido entre as ajustáveis em proporção ao tamanho de cada uma, e cada
+  seção (`--- Aula: ... ---`) é cortada em fim de frase, para que todas as
+  aulas continuem representadas.
+
+A contagem é uma estimativa local (sem chamar o provedor): palavras curtas
+valem um token, palavras longas um token a cada 4 caracteres, e cada sinal
+de pontuação um token. É uma aproximação; a contagem real do provedor
+(`usage_metadata`) aparece em `sigma_llm_tokens_total` para comparação.
+Cada prompt montado gera uma linha de log com os tokens de cada parte e
+quantos foram cortados.
+"""
+
+import logging
+import os
+import re
+
+ORCAMENTO_MODELO_DOMINIO = int(os.getenv("PROMPT_ORCAMENTO_MODELO_DOMINIO", "100000"))
+ORCAMENTO_TURNO = int(os.getenv("PROMPT_ORCAMENTO_TURNO", "4000"))
+# Correção em lote: um grupo de até LOTE_MAX_CARACTERES de respostas
+ORCAMENTO_LOTE = int(os.getenv("PROMPT_ORCAMENTO_LOTE", "20000"))
+
+MARCA_CORTE = "[...]"
+
+_PECAS = re.compile(r"\w+|[^\w\s]")
+_CABECALHO_SECAO = re.compile(r"^--- .+ ---$", re.MULTILINE)
+_FIM_DE_FRASE = re.compile(r"(?<=[.!?…])\s+")
+
+log = logging.getLogger(__name__)
+
+
+def estimar_tokens(texto):
+    """Estimativa local do número de tokens de `texto`."""
+    return sum(
+        max(1, (len(p) + 3) // 4) if p[0].isalnum() or p[0] == "_" else 1
+        for p in _PECAS.findall(texto or "")
+    )
+
+
+def _cortar_secao(texto, limite):
+    """Frases do início de `texto` até `limite` tokens, com a marca de corte."""
+    frases, total = [], 0
+    for frase in _FIM_DE_FRASE.split(texto):
+        tokens = estimar_tokens(frase)
+        if total + tokens > limite:
+            break
+        frases.append(frase)
+        total += tokens
+    return " ".join(frases + [MARCA_CORTE])
+
+
+def cortar(texto, limite):
+    """
+    `texto` com no máximo ~`limite` tokens. Cada seção (o trecho depois de
+    uma linha `--- ... ---`) fica com uma fatia proporcional ao seu tamanho.
+    """
+    total = estimar_tokens(texto)
+    if total <= limite:
+        return texto
+
+    # [(cabeçalho, corpo)]; o primeiro cabeçalho pode ser vazio
+    secoes = []
+    inicio, cabecalho = 0, ""
+    for marca in _CABECALHO_SECAO.finditer(texto):
+        secoes.append((cabecalho, texto[inicio : marca.start()]))
+        cabecalho, inicio = marca.group(0), marca.end()
+    secoes.append((cabecalho, texto[inicio:]))
+
+    partes = []
+    for cabecalho, corpo in secoes:
+        if not cabecalho and not corpo.strip():
+            continue
+        tokens = estimar_tokens(corpo)
+        fatia = max(0, limite * tokens // total - estimar_tokens(cabecalho))
+        if tokens > fatia:
+            corpo = _cortar_secao(corpo.strip(), fatia)
+        partes.append(f"{cabecalho}\n{corpo.strip()}" if cabecalho else corpo.strip())
+    return "\n".join(partes)
+
+
+class Prompt:
+    """Prompt de uma etapa, montado a partir de partes nomeadas."""
+
+    def __init__(self, etapa, orcamento):
+        self.etapa = etapa
+        self.orcamento = orcamento
+        self._partes = []  # (nome, texto, ajustavel)
+
+    def _adicionar(self, nome, texto, ajustavel):
+        if any(p[0] == nome for p in self._partes):
+            raise ValueError(f"Parte repetida no prompt de {self.etapa}: {nome}")
+        self._partes.append((nome, texto or "", ajustavel))
+        return self
+
+    def fixa(self, nome, texto):
+        """Parte enviada sempre inteira (instruções, formato de saída)."""
+        return self._adicionar(nome, texto, False)
+
+    def ajustavel(self, nome, texto):
+        """Parte que pode ser recortada para caber no orçamento."""
+        return self._adicionar(nome, texto, True)
+
+    def montar(self):
+        """Texto final do prompt, dentro do orçamento sempre que possível."""
+        tokens = {nome: estimar_tokens(texto) for nome, texto, _ in self._partes}
+        fixos = sum(tokens[nome] for nome, _, ajustavel in self._partes if not ajustavel)
+        ajustaveis = sum(tokens[nome] for nome, _, ajustavel in self._partes if ajustavel)
+        disponivel = max(0, self.orcamento - fixos)
+
+        textos = []
+        for nome, texto, ajustavel in self._partes:
+            if ajustavel and tokens[nome] and fixos + ajustaveis > self.orcamento:
+                texto = cortar(texto, disponivel * tokens[nome] // ajustaveis)
+            textos.append(texto)
+        prompt = "\n".join(textos)
+
+        enviados = estimar_tokens(prompt)
+        (log.warning if fixos > self.orcamento else log.info)(
+            "Prompt montado",
+            extra={
+                "etapa": self.etapa,
+                "orcamento": self.orcamento,
+                "tokens_partes": tokens,
+                "tokens_enviados": enviados,
+                "tokens_cortados": max(0, fixos + ajustaveis - enviados),
+            },
+        )
+        return prompt
@@ -0,0 +1,150 @@
+"""
+Recuperação de trechos das aulas para os prompts do ITS.
+
+Cada aula tem um índice invertido dos seus trechos (etapa `indice` do
+pipeline, gravada no banco junto das demais etapas). A cada turno buscamos
+os k trechos mais relevantes para o tópico, o exercício e a resposta do
+aluno (BM25) e mandamos só um recorte deles ao LLM: o feedback passa a se
+apoiar no que o professor falou, com custo de tokens fixo e pequeno.
+
+Os índices decodificados ficam num cache em memória endereçado pela
+impressão dos trechos, então um turno normal faz só uma consulta leve ao
+banco (qual é a impressão atual de cada aula) e o ranqueamento em Python.
+"""
+
+import json
+import math
+import os
+from collections import OrderedDict
+
+from sqlalchemy import select
+
+from backend.database import EtapaPipeline
+from backend.pipeline import tokenizar
+
+TRECHOS_POR_TURNO = int(os.getenv("RECUPERACAO_TRECHOS", "3"))
+# Tamanho máximo do recorte de cada trecho enviado ao LLM (em palavras)
+PALAVRAS_POR_TRECHO = int(os.getenv("RECUPERACAO_PALAVRAS", "120"))
+MAX_INDICES_EM_MEMORIA = int(os.getenv("RECUPERACAO_CACHE", "64"))
+
+# Parâmetros usuais do BM25
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_cache = OrderedDict()  # (audio_id, impressao) -> índice com os textos
+
+
+async def _carregar_indice(db, audio_id, impressao_indice):
+    chave = (audio_id, impressao_indice)
+    if chave in _cache:
+        _cache.move_to_end(chave)
+        return _cache[chave]
+
+    saida = await db.scalar(
+        select(EtapaPipeline.saida).where(
+            EtapaPipeline.audio_id == audio_id,
+            EtapaPipeline.etapa == "indice",
+        )
+    )
+    if not saida:
+        return None
+    indice = json.loads(saida)
+
+    textos = dict(
+        (
+            await db.execute(
+                select(EtapaPipeline.chave, EtapaPipeline.saida).where(
+                    EtapaPipeline.audio_id == audio_id,
+                    EtapaPipeline.etapa == "trecho",
+                )
+            )
+        ).all()
+    )
+    indice["textos"] = [textos.get(c, "") for c in indice["chaves"]]
+
+    _cache[chave] = indice
+    if len(_cache) > MAX_INDICES_EM_MEMORIA:
+        _cache.popitem(last=False)
+    return indice
+
+
+def ranquear(indices, termos, k):
+    """
+    BM25 sobre os trechos de todas as aulas juntas. Só percorre as listas de
+    ocorrência dos termos da consulta. Retorna [(score, indice, posicao)].
+    """
+    total = sum(len(ind["tamanhos"]) for ind in indices)
+    if not total or not termos:
+        return []
+    media = sum(sum(ind["tamanhos"]) for ind in indices) / total or 1
+
+    scores = {}
+    for termo in set(termos):
+        df = sum(len(ind["postings"].get(termo, ())) for ind in indices)
+        if not df:
+            continue
+        idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+        for n, ind in enumerate(indices):
+            for i, tf in ind["postings"].get(termo, ()):
+                norma = BM25_K1 * (1 - BM25_B + BM25_B * ind["tamanhos"][i] / media)
+                scores[(n, i)] = scores.get((n, i), 0) + idf * tf * (BM25_K1 + 1) / (
+                    tf + norma
+                )
+
+    melhores = sorted(scores.items(), key=lambda item: -item[1])[:k]
+    return [(score, n, i) for (n, i), score in melhores]
+
+
+def recortar(texto, termos, max_palavras=PALAVRAS_POR_TRECHO):
+    """Janela de `max_palavras` do trecho com mais termos da consulta."""
+    palavras = texto.split()
+    if len(palavras) <= max_palavras:
+        return texto
+
+    termos = set(termos)
+    acertos = [
+        1 if (tokenizar(p) or [None])[0] in termos else 0 for p in palavras
+    ]
+    soma = melhor = sum(acertos[:max_palavras])
+    inicio = 0
+    for fim in range(max_palavras, len(palavras)):
+        soma += acertos[fim] - acertos[fim - max_palavras]
+        if soma > melhor:
+            melhor, inicio = soma, fim - max_palavras + 1
+
+    recorte = " ".join(palavras[inicio : inicio + max_palavras])
+    prefixo = "… " if inicio > 0 else ""
+    sufixo = " …" if inicio + max_palavras < len(palavras) else ""
+    return f"{prefixo}{recorte}{sufixo}"
+
+
+async def trechos_relevantes(db, audio_ids, consulta, k=TRECHOS_POR_TURNO):
+    """Os k recortes de aula mais relevantes para `consulta` (lista de textos)."""
+    termos = tokenizar(consulta)
+    if not audio_ids or not termos or k <= 0:
+        return []
+
+    atuais = (
+        await db.execute(
+            select(EtapaPipeline.audio_id, EtapaPipeline.impressao_entrada).where(
+                EtapaPipeline.audio_id.in_(audio_ids),
+                EtapaPipeline.etapa == "indice",
+            )
+        )
+    ).all()
+
+    indices = []
+    for audio_id, impressao_indice in sorted(atuais):
+        indice = await _carregar_indice(db, audio_id, impressao_indice)
+        if indice:
+            indices.append(indice)
+
+    return [
+        recortar(indices[n]["textos"][i], termos)
+        for _, n, i in ranquear(indices, termos, k)
+    ]
+
+
+def formatar_contexto(trechos):
+    """Bloco de texto com os trechos, pronto para entrar num prompt."""
+    return "\n".join(f"[{n}] {t}" for n, t in enumerate(trechos, start=1))
@@ -0,0 +1 @@
+"""Benchmarks do backend do SigmaTeacher (execute com `python -m benchmarks.<nome>`)."""
@@ -0,0 +1,502 @@
+"""
+Teste de carga do backend: quantos alunos simultâneos uma instância aguenta.
+
+Sobe o app FastAPI no mesmo processo (httpx + ASGITransport, sem rede) com
+motores falsos no lugar do Whisper e do LLM. Os motores não fazem trabalho,
+só esperam um tempo sorteado de uma distribuição configurável, numa thread,
+como os reais. Assim o que se mede é o backend (event loop, threadpool,
+banco, lease das sessões, governador do LLM) sob a espera realista dos
+serviços externos.
+
+`--usuarios` usuários virtuais repetem, durante `--segundos`, operações
+sorteadas de acordo com `--mix`:
+
+- chat: um turno em uma das sessões do próprio usuário;
+- sessoes: a primeira página de `/its/sessoes`;
+- sessao: `/its/sessao/{id}` completo de uma sessão qualquer;
+- iniciar: `/its/iniciar` com um subconjunto das aulas (o modelo de domínio
+  sai do cache quando a combinação já foi gerada, como numa turma);
+- transcrever: `/transcrever-e-salvar` com um áudio novo.
+
+Distribuições de latência (em segundos): `fixa:0.5`, `uniforme:0.2:1.5`,
+`exponencial:0.8` (média) e `lognormal:1.2:0.5` (mediana e sigma).
+
+O resultado, por endpoint, tem p50/p95/p99, vazão, erros e o tempo gasto no
+banco (soma do tempo das queries de cada requisição); além disso, o atraso
+do event loop (quanto um `sleep` de 10 ms passou do prazo). Tudo é gravado em
+JSON; `--comparar` mostra a diferença para um resultado anterior.
+
+    python -m benchmarks.bench_carga --usuarios 50 --segundos 60
+    python -m benchmarks.bench_carga --latencia-llm lognormal:2:0.6 \\
+        --mix chat=80,sessoes=10,sessao=8,iniciar=2 --comparar antes.json
+
+Sem a chave da API, `LLM_TAXA_POR_SEGUNDO` vale 0 (governador sem limite de
+taxa) a não ser que seja definida; assim o limite medido é o do backend.
+"""
+
+import argparse
+import asyncio
+import contextvars
+import json
+import math
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.bench_turno import modelo_dominio, popular
+
+INTERVALO_MONITOR = 0.01
+PALAVRAS = (
+    "energia força massa aceleração sistema variação tempo modelo exemplo "
+    "conceito fração equação gráfico célula fotossíntese"
+).split()
+
+# Tempo de banco da requisição em andamento (o app roda na task do cliente)
+_tempo_banco = contextvars.ContextVar("tempo_banco", default=None)
+
+
+# --- Distribuições de latência ---
+class Latencia:
+    """Tempo de resposta sorteado de uma distribuição, a partir de uma especificação."""
+
+    def __init__(self, especificacao):
+        nome, *parametros = especificacao.split(":")
+        try:
+            parametros = [float(p) for p in parametros]
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Latência inválida: {especificacao}")
+        sorteios = {
+            "fixa": (1, lambda s: s),
+            "uniforme": (2, random.uniform),
+            "exponencial": (1, lambda media: random.expovariate(1 / media)),
+            "lognormal": (
+                2,
+                lambda mediana, sigma: random.lognormvariate(math.log(mediana), sigma),
+            ),
+        }
+        if nome not in sorteios or len(parametros) != sorteios[nome][0]:
+            raise argparse.ArgumentTypeError(f"Latência inválida: {especificacao}")
+        self.especificacao = especificacao
+        self._sortear = sorteios[nome][1]
+        self._parametros = parametros
+
+    def sortear(self):
+        return max(0.0, self._sortear(*self._parametros))
+
+    def __str__(self):
+        return self.especificacao
+
+
+# --- Motores falsos ---
+class _Resposta:
+    def __init__(self, texto):
+        self.text = texto
+
+
+class LLMFalso:
+    """Responde cada etapa do ITS no formato esperado, depois de uma espera."""
+
+    def __init__(self, latencia):
+        self.latencia = latencia
+
+    def generate_content(self, conteudo, **_):
+        prompt = conteudo if isinstance(conteudo, str) else conteudo[0]
+        time.sleep(self.latencia.sortear())
+
+        if "sequencia_recomendada" in prompt:
+            n = re.search(r"exatamente (\d+) tópicos", prompt)
+            dominio = modelo_dominio()
+            nomes = dominio.pop("_sequencia")[: int(n.group(1)) if n else 5]
+            return _Resposta(
+                json.dumps(
+                    {
+                        "topicos": [
+                            {"nome": t, **dominio[t], "conceitos_chave": []}
+                            for t in nomes
+                        ],
+                        "sequencia_recomendada": nomes,
+                    },
+                    ensure_ascii=False,
+                )
+            )
+        if "avaliacoes" in prompt:
+            n = len(re.findall(r"^\s*\[\d+\]", prompt, re.M))
+            return _Resposta(
+                json.dumps(
+                    {
+                        "avaliacoes": [
+                            {
+                                "indice": i,
+                                "acertou": True,
+                                "compreensao": 80,
+                                "mensagem_ao_aluno": "ok",
+                            }
+                            for i in range(n)
+                        ]
+                    }
+                )
+            )
+        if '"acertou"' in prompt and '"compreensao"' in prompt:
+            acertou = random.random() < 0.6
+            return _Resposta(
+                json.dumps(
+                    {
+                        "acertou": acertou,
+                        "compreensao": 85 if acertou else 40,
+                        "feedback_tecnico": "ok",
+                    }
+                )
+            )
+        return _Resposta(
+            '{"mensagem_ao_aluno": "Muito bem!", "proxima_acao": "avancar"}'
+        )
+
+
+class ASRFalso:
+    """Modelo Whisper falso: espera e devolve um texto com cara de aula."""
+
+    def __init__(self, latencia):
+        self.latencia = latencia
+
+    def transcribe(self, audio, **_):
+        time.sleep(self.latencia.sortear())
+        frases = [
+            " ".join(random.choices(PALAVRAS, k=random.randint(8, 20))).capitalize()
+            + "."
+            for _ in range(200)
+        ]
+        return {"text": " ".join(frases)}
+
+
+def instalar_motores(args):
+    """Troca Whisper e LLM pelos falsos. Precisa vir antes de importar backend.main."""
+    import whisper
+
+    asr = ASRFalso(args.latencia_asr)
+    whisper.load_model = lambda *a, **k: asr
+    # Sem ffmpeg: o "áudio" decodificado não é usado pelo ASR falso
+    whisper.load_audio = lambda caminho: caminho
+
+    from backend import its
+
+    its.llm = LLMFalso(args.latencia_llm)
+
+
+def instalar_medicao_banco():
+    """Soma em `_tempo_banco` o tempo de cada query da requisição atual."""
+    from sqlalchemy import event
+
+    from backend.database import engine
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def _antes(conexao, cursor, sql, parametros, contexto, executemany):
+        contexto._inicio_bench = time.perf_counter()
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def _depois(conexao, cursor, sql, parametros, contexto, executemany):
+        acumulado = _tempo_banco.get()
+        if acumulado is not None:
+            acumulado[0] += time.perf_counter() - contexto._inicio_bench
+
+
+# --- Cenário ---
+async def preparar(args):
+    """Aulas para `/its/iniciar` e algumas sessões por usuário para o chat."""
+    from backend.database import AsyncSessionLocal, AudioLog
+    from backend.pipeline import processar_texto
+
+    async with AsyncSessionLocal() as db:
+        for i in range(args.aulas):
+            audio = AudioLog(
+                filename_original=f"aula_{i}.wav",
+                caminho_arquivo=f"aula_{i}.wav",
+                transcricao=ASRFalso(Latencia("fixa:0")).transcribe(None)["text"],
+                transcricao_editada=None,
+            )
+            db.add(audio)
+            await db.flush()
+            await processar_texto(db, audio)
+        await db.commit()
+        aulas = list(range(1, args.aulas + 1))
+
+    ids = await popular(args.usuarios * args.sessoes_por_usuario)
+    return aulas, [ids[u :: args.usuarios] for u in range(args.usuarios)]
+
+
+def _mensagem():
+    return " ".join(random.choices(PALAVRAS, k=random.randint(6, 25)))
+
+
+def _audio_falso():
+    # Conteúdo único: a transcrição não é reaproveitada de outra aula
+    return b"RIFF" + os.urandom(16 * 1024)
+
+
+async def operacao(cliente, nome, usuario, aulas, sessoes):
+    if nome == "chat":
+        return await cliente.post(
+            "/its/chat",
+            json={"session_id": random.choice(sessoes[usuario]), "mensagem": _mensagem()},
+        )
+    if nome == "sessoes":
+        return await cliente.get("/its/sessoes")
+    if nome == "sessao":
+        return await cliente.get(f"/its/sessao/{random.choice(random.choice(sessoes))}")
+    if nome == "iniciar":
+        resp = await cliente.post(
+            "/its/iniciar",
+            json={
+                "audio_ids": sorted(random.sample(aulas, random.randint(1, 2))),
+                "n_topicos": 5,
+            },
+        )
+        if resp.status_code == 200:
+            sessoes[usuario].append(resp.json()["session_id"])
+        return resp
+    if nome == "transcrever":
+        return await cliente.post(
+            "/transcrever-e-salvar",
+            files={"file": ("aula.wav", _audio_falso(), "audio/wav")},
+        )
+    raise ValueError(nome)
+
+
+async def usuario_virtual(cliente, usuario, args, aulas, sessoes, resultados, fim):
+    nomes, pesos = zip(*args.mix.items())
+    while time.perf_counter() < fim:
+        nome = random.choices(nomes, pesos)[0]
+        tempo_banco = [0.0]
+        token = _tempo_banco.set(tempo_banco)
+        inicio = time.perf_counter()
+        try:
+            resp = await operacao(cliente, nome, usuario, aulas, sessoes)
+            status = resp.status_code
+        except Exception as e:
+            status = type(e).__name__
+        finally:
+            _tempo_banco.reset(token)
+        duracao = time.perf_counter() - inicio
+        if inicio >= args.inicio_medicao:
+            resultados.append((nome, status, duracao, tempo_banco[0], inicio))
+        if args.pausa:
+            await asyncio.sleep(random.uniform(0, 2 * args.pausa))
+
+
+async def monitorar_event_loop(atrasos, fim):
+    """Quanto cada sleep curto passou do prazo: a espera de quem está na fila do loop."""
+    while time.perf_counter() < fim:
+        inicio = time.perf_counter()
+        await asyncio.sleep(INTERVALO_MONITOR)
+        atrasos.append(time.perf_counter() - inicio - INTERVALO_MONITOR)
+
+
+# --- Relatório ---
+def percentil(valores, q):
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * q))]
+
+
+def _ms(valor):
+    return None if valor is None else round(valor * 1000, 2)
+
+
+def resumir(resultados, atrasos, duracao):
+    endpoints = {}
+    for nome in sorted({r[0] for r in resultados}):
+        linhas = [r for r in resultados if r[0] == nome]
+        tempos = [r[2] for r in linhas]
+        banco = [r[3] for r in linhas]
+        status = {}
+        for r in linhas:
+            status[str(r[1])] = status.get(str(r[1]), 0) + 1
+        endpoints[nome] = {
+            "requisicoes": len(linhas),
+            "vazao_rps": round(len(linhas) / duracao, 2),
+            "erros": sum(1 for r in linhas if not (isinstance(r[1], int) and r[1] < 400)),
+            "status": status,
+            "p50_ms": _ms(percentil(tempos, 0.50)),
+            "p95_ms": _ms(percentil(tempos, 0.95)),
+            "p99_ms": _ms(percentil(tempos, 0.99)),
+            "max_ms": _ms(max(tempos)),
+            "banco_p50_ms": _ms(percentil(banco, 0.50)),
+            "banco_p95_ms": _ms(percentil(banco, 0.95)),
+            "banco_fracao": round(sum(banco) / sum(tempos), 3) if sum(tempos) else 0,
+        }
+    tempos = [r[2] for r in resultados]
+    return {
+        "total": {
+            "requisicoes": len(resultados),
+            "vazao_rps": round(len(resultados) / duracao, 2),
+            "erros": sum(e["erros"] for e in endpoints.values()),
+            "p50_ms": _ms(percentil(tempos, 0.50)),
+            "p95_ms": _ms(percentil(tempos, 0.95)),
+            "p99_ms": _ms(percentil(tempos, 0.99)),
+        },
+        "endpoints": endpoints,
+        "event_loop_atraso_ms": {
+            "p50": _ms(percentil(atrasos, 0.50)),
+            "p99": _ms(percentil(atrasos, 0.99)),
+            "max": _ms(max(atrasos) if atrasos else None),
+        },
+    }
+
+
+def comparar(atual, anterior):
+    """Variação de p95 e vazão por endpoint em relação a um resultado anterior."""
+
+    def variacao(novo, velho):
+        if not velho or novo is None:
+            return "   n/d"
+        return f"{(novo - velho) / velho * 100:+6.1f}%"
+
+    print(f"\nComparação com {anterior.get('commit') or anterior.get('data')}:")
+    print(f"{'endpoint':<12} {'p95':>10} {'Δp95':>8} {'vazão':>8} {'Δvazão':>8}")
+    for nome, e in {**atual["endpoints"], "total": atual["total"]}.items():
+        antes = anterior["endpoints"].get(nome) if nome != "total" else anterior["total"]
+        antes = antes or {}
+        print(
+            f"{nome:<12} {e['p95_ms'] or 0:>8.1f}ms {variacao(e['p95_ms'], antes.get('p95_ms')):>8} "
+            f"{e['vazao_rps']:>8.2f} {variacao(e['vazao_rps'], antes.get('vazao_rps')):>8}"
+        )
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def executar(args):
+    import httpx
+
+    instalar_motores(args)
+    from backend.database import criar_tabelas
+    from backend.main import app
+    from backend.migracoes import executar_migracoes
+
+    instalar_medicao_banco()
+    await criar_tabelas()
+    await executar_migracoes()
+    aulas, sessoes = await preparar(args)
+
+    resultados, atrasos = [], []
+    inicio = time.perf_counter()
+    args.inicio_medicao = inicio + args.aquecimento
+    fim = args.inicio_medicao + args.segundos
+    transporte = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transporte, base_url="http://bench", timeout=None
+    ) as cliente:
+        monitor = asyncio.create_task(monitorar_event_loop(atrasos, fim))
+        await asyncio.gather(
+            *[
+                usuario_virtual(cliente, u, args, aulas, sessoes, resultados, fim)
+                for u in range(args.usuarios)
+            ]
+        )
+        await monitor
+
+    duracao = time.perf_counter() - args.inicio_medicao
+    atrasos = atrasos[int(len(atrasos) * args.aquecimento / (args.aquecimento + args.segundos)) :]
+    return resumir(resultados, atrasos, duracao)
+
+
+def _mix(texto):
+    try:
+        mix = {k.strip(): float(v) for k, v in (p.split("=") for p in texto.split(","))}
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Mix inválido: {texto}")
+    desconhecidas = set(mix) - {"chat", "sessoes", "sessao", "iniciar", "transcrever"}
+    if desconhecidas:
+        raise argparse.ArgumentTypeError(f"Operações desconhecidas: {desconhecidas}")
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--usuarios", type=int, default=20, help="concorrência")
+    parser.add_argument("--segundos", type=float, default=30)
+    parser.add_argument("--aquecimento", type=float, default=3)
+    parser.add_argument(
+        "--pausa", type=float, default=0, help="pausa média entre operações (s)"
+    )
+    parser.add_argument(
+        "--mix",
+        type=_mix,
+        default=_mix("chat=70,sessoes=10,sessao=10,iniciar=5,transcrever=5"),
+    )
+    parser.add_argument("--latencia-llm", type=Latencia, default=Latencia("lognormal:1.2:0.5"))
+    parser.add_argument("--latencia-asr", type=Latencia, default=Latencia("lognormal:8:0.4"))
+    parser.add_argument("--aulas", type=int, default=6)
+    parser.add_argument("--sessoes-por-usuario", type=int, default=2)
+    parser.add_argument("--saida", help="arquivo JSON (padrão: resultados/carga_<data>.json)")
+    parser.add_argument("--comparar", help="resultado JSON anterior para comparar")
+    args = parser.parse_args()
+
+    saida = os.path.abspath(
+        args.saida
+        or os.path.join(
+            "resultados", f"carga_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        )
+    )
+    anterior = None
+    if args.comparar:
+        with open(args.comparar) as f:
+            anterior = json.load(f)
+    commit = _commit()
+
+    # O banco e o governador são configurados na importação do backend
+    pasta = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{pasta}/bench.db"
+    os.environ.setdefault("LLM_TAXA_POR_SEGUNDO", "0")
+    os.chdir(pasta)
+
+    resultado = {
+        "data": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": sys.version.split()[0],
+        "config": {
+            "usuarios": args.usuarios,
+            "segundos": args.segundos,
+            "pausa": args.pausa,
+            "mix": args.mix,
+            "latencia_llm": str(args.latencia_llm),
+            "latencia_asr": str(args.latencia_asr),
+            "llm_taxa_por_segundo": os.environ["LLM_TAXA_POR_SEGUNDO"],
+            "llm_max_concorrencia": os.getenv("LLM_MAX_CONCORRENCIA", "4"),
+        },
+        **asyncio.run(executar(args)),
+    }
+
+    os.makedirs(os.path.dirname(saida), exist_ok=True)
+    with open(saida, "w") as f:
+        json.dump(resultado, f, indent=2, ensure_ascii=False)
+    print(json.dumps({k: resultado[k] for k in ("total", "event_loop_atraso_ms")}, indent=2))
+    for nome, e in resultado["endpoints"].items():
+        print(
+            f"{nome:<12} n={e['requisicoes']:<6} p50={e['p50_ms']}ms p95={e['p95_ms']}ms "
+            f"p99={e['p99_ms']}ms banco_p95={e['banco_p95_ms']}ms erros={e['erros']}"
+        )
+    print(f"\nResultado gravado em {saida}")
+    if anterior:
+        comparar(resultado, anterior)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+Benchmark de leitura/escrita mista no banco: camada antiga x camada nova.
+
+- antes: engine síncrono em `sqlite:///` com o journal padrão, chamado de
+  dentro de handlers async (como o backend fazia), bloqueando o event loop.
+- depois: engine async (aiosqlite) com WAL e os PRAGMAs de backend/database.py.
+
+Cada cliente simula um usuário: 80% leituras (lista de sessões + mensagens de
+uma sessão) e 20% escritas (um turno de chat: 2 INSERTs + UPDATE + commit).
+
+    python -m benchmarks.bench_db --clientes 32 --segundos 10
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from backend.database import Base, criar_engine, ChatMessage, TutoriaSession
+
+N_SESSOES = 200
+MENSAGENS_POR_SESSAO = 20
+PROPORCAO_ESCRITA = 0.2
+
+
+def popular(engine_sync):
+    Base.metadata.create_all(engine_sync)
+    with sessionmaker(bind=engine_sync)() as db:
+        for i in range(1, N_SESSOES + 1):
+            db.add(
+                TutoriaSession(
+                    id=i,
+                    modelo_dominio="{}",
+                    modelo_aluno="{}",
+                    topico_atual=f"Tópico {i % 7}",
+                    status="aguardando_resposta_exercicio",
+                )
+            )
+            for seq in range(1, MENSAGENS_POR_SESSAO + 1):
+                db.add(
+                    ChatMessage(
+                        session_id=i,
+                        seq=seq,
+                        role="user" if seq % 2 else "model",
+                        texto="Mensagem de exemplo " * 20,
+                    )
+                )
+        db.commit()
+
+
+def _consulta_lista():
+    return (
+        select(TutoriaSession.id, TutoriaSession.topico_atual, TutoriaSession.status)
+        .order_by(TutoriaSession.id.desc())
+        .limit(50)
+    )
+
+
+def _consulta_mensagens(session_id):
+    return (
+        select(ChatMessage)
+        .where(ChatMessage.session_id == session_id)
+        .order_by(ChatMessage.seq)
+    )
+
+
+# --- Camada antiga: Session síncrona dentro de corrotinas ---
+def ler_sync(db, session_id):
+    db.execute(_consulta_lista()).all()
+    db.scalars(_consulta_mensagens(session_id)).all()
+
+
+def escrever_sync(db, session_id):
+    seq = db.scalar(
+        select(func.max(ChatMessage.seq)).where(ChatMessage.session_id == session_id)
+    )
+    db.add(ChatMessage(session_id=session_id, seq=seq + 1, role="user", texto="r"))
+    db.add(ChatMessage(session_id=session_id, seq=seq + 2, role="model", texto="f"))
+    db.get(TutoriaSession, session_id).status = "aguardando_transicao"
+    db.commit()
+
+
+# --- Camada nova: AsyncSession ---
+async def ler_async(db, session_id):
+    (await db.execute(_consulta_lista())).all()
+    (await db.scalars(_consulta_mensagens(session_id))).all()
+
+
+async def escrever_async(db, session_id):
+    seq = await db.scalar(
+        select(func.max(ChatMessage.seq)).where(ChatMessage.session_id == session_id)
+    )
+    db.add(ChatMessage(session_id=session_id, seq=seq + 1, role="user", texto="r"))
+    db.add(ChatMessage(session_id=session_id, seq=seq + 2, role="model", texto="f"))
+    (await db.get(TutoriaSession, session_id)).status = "aguardando_transicao"
+    await db.commit()
+
+
+async def _cliente(executar, fim, latencias, sessoes_escritas):
+    while time.perf_counter() < fim:
+        escrita = random.random() < PROPORCAO_ESCRITA
+        # Escritas em sessões distintas por cliente (cada aluno na sua sessão)
+        session_id = sessoes_escritas if escrita else random.randint(1, N_SESSOES)
+        inicio = time.perf_counter()
+        await executar(escrita, session_id)
+        latencias["escrita" if escrita else "leitura"].append(
+            time.perf_counter() - inicio
+        )
+        # Tempo fora do banco (rede, LLM...) em que o loop deveria atender outros
+        await asyncio.sleep(0.001)
+
+
+async def _monitor_loop(fim, latencias, intervalo=0.005):
+    """Atraso do event loop: quanto um sleep curto demora além do pedido."""
+    while time.perf_counter() < fim:
+        inicio = time.perf_counter()
+        await asyncio.sleep(intervalo)
+        latencias["atraso_loop"].append(time.perf_counter() - inicio - intervalo)
+
+
+async def _rodar(executar, clientes, segundos):
+    latencias = {"leitura": [], "escrita": [], "atraso_loop": []}
+    fim = time.perf_counter() + segundos
+    await asyncio.gather(
+        _monitor_loop(fim, latencias),
+        *[
+            _cliente(executar, fim, latencias, (i % N_SESSOES) + 1)
+            for i in range(clientes)
+        ],
+    )
+    return latencias
+
+
+def _resumo(nome, latencias, segundos):
+    total = len(latencias["leitura"]) + len(latencias["escrita"])
+    linha = f"{nome:<8} {total / segundos:>9.0f} ops/s"
+    for tipo in ("leitura", "escrita"):
+        valores = sorted(latencias[tipo])
+        if valores:
+            p95 = valores[int(len(valores) * 0.95) - 1] * 1000
+            linha += (
+                f" | {tipo}: {len(valores):>6} ops,"
+                f" p50 {statistics.median(valores) * 1000:6.2f} ms, p95 {p95:6.2f} ms"
+            )
+    atrasos = sorted(latencias["atraso_loop"])
+    if atrasos:
+        p99 = atrasos[int(len(atrasos) * 0.99) - 1] * 1000
+        linha += f" | atraso do loop p99 {p99:6.2f} ms, máx {atrasos[-1] * 1000:6.2f} ms"
+    print(linha)
+
+
+async def bench_antes(caminho, clientes, segundos):
+    engine_sync = create_engine(f"sqlite:///{caminho}")
+    popular(engine_sync)
+    fabrica = sessionmaker(bind=engine_sync, autoflush=False)
+
+    async def executar(escrita, session_id):
+        with fabrica() as db:
+            (escrever_sync if escrita else ler_sync)(db, session_id)
+
+    latencias = await _rodar(executar, clientes, segundos)
+    engine_sync.dispose()
+    return latencias
+
+
+async def bench_depois(caminho, clientes, segundos):
+    popular(create_engine(f"sqlite:///{caminho}"))
+    engine_async = criar_engine(f"sqlite+aiosqlite:///{caminho}")
+    fabrica = async_sessionmaker(
+        engine_async, class_=AsyncSession, autoflush=False, expire_on_commit=False
+    )
+
+    async def executar(escrita, session_id):
+        async with fabrica() as db:
+            await (escrever_async if escrita else ler_async)(db, session_id)
+
+    latencias = await _rodar(executar, clientes, segundos)
+    await engine_async.dispose()
+    return latencias
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--clientes", type=int, default=32)
+    parser.add_argument("--segundos", type=float, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as pasta:
+        antes = await bench_antes(
+            os.path.join(pasta, "antes.db"), args.clientes, args.segundos
+        )
+        depois = await bench_depois(
+            os.path.join(pasta, "depois.db"), args.clientes, args.segundos
+        )
+
+    print(f"{args.clientes} clientes, {args.segundos:.0f}s, {PROPORCAO_ESCRITA:.0%} escritas")
+    _resumo("antes", antes, args.segundos)
+    _resumo("depois", depois, args.segundos)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,141 @@
+"""
+Benchmark do custo de um turno do `/its/chat` fora do LLM.
+
+O LLM é trocado por um stub que responde na hora, então o tempo medido é só
+o do backend: lease da sessão, leitura e decodificação do estado, consultas
+de progresso/cache/recuperação, gravação do turno e serialização. Cada turno
+usa uma resposta diferente, para não cair no cache de avaliações.
+
+As sessões alternam entre responder o exercício e avançar de tópico (os dois
+estados da máquina), com um modelo de domínio de tamanho realista.
+
+    python -m benchmarks.bench_turno --sessoes 50 --turnos 20
+    python -m benchmarks.bench_turno --sem-cache   # sem o estado em memória
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+N_TOPICOS = 12
+PALAVRAS_POR_EXPLICACAO = 400
+
+
+class _Resposta:
+    def __init__(self, texto):
+        self.text = texto
+
+
+class LLMInstantaneo:
+    """Responde as etapas do turno sem esperar (avaliação e feedback)."""
+
+    def generate_content(self, prompt, **_):
+        if '"acertou"' in prompt and '"compreensao"' in prompt:
+            return _Resposta('{"acertou": true, "compreensao": 90, "feedback_tecnico": "ok"}')
+        return _Resposta('{"mensagem_ao_aluno": "Muito bem!", "proxima_acao": "avancar"}')
+
+
+def modelo_dominio():
+    palavras = "conceito exemplo energia sistema força tempo variação modelo".split()
+    topicos = [f"Tópico {i}" for i in range(1, N_TOPICOS + 1)]
+    modelo = {
+        t: {
+            "explicacao": " ".join(random.choices(palavras, k=PALAVRAS_POR_EXPLICACAO)),
+            "exercicio": f"Explique {t.lower()} com suas palavras.",
+        }
+        for t in topicos
+    }
+    modelo["_sequencia"] = topicos
+    return modelo
+
+
+async def popular(n_sessoes):
+    from backend import its, progresso, historico
+    from backend.database import AsyncSessionLocal, TutoriaSession
+
+    dominio = modelo_dominio()
+    ids = []
+    async with AsyncSessionLocal() as db:
+        for _ in range(n_sessoes):
+            aluno = its.etapa_0_inicializar_aluno(dominio)
+            sessao = TutoriaSession(
+                modelo_dominio=its.salvar_json(dominio),
+                modelo_aluno=its.salvar_json(progresso.modelo_aluno_para_salvar(aluno)),
+                topico_atual=dominio["_sequencia"][0],
+                status="aguardando_resposta_exercicio",
+                audio_ids="[]",
+            )
+            db.add(sessao)
+            await db.flush()
+            progresso.criar_progresso(db, sessao.id, aluno["topicos_status"])
+            await historico.adicionar_mensagens(db, sessao.id, [("model", "Bem-vindo!")])
+            ids.append(sessao.id)
+        await db.commit()
+    return ids
+
+
+async def executar(args):
+    import httpx
+
+    from backend import its
+    from backend.database import criar_tabelas
+    from backend.main import app
+    from backend.migracoes import executar_migracoes
+
+    its.llm = LLMInstantaneo()
+    if args.sem_cache:
+        from backend import cache_sessoes
+
+        cache_sessoes.MAX_SESSOES = 0
+
+    await criar_tabelas()
+    await executar_migracoes()
+    ids = await popular(args.sessoes)
+
+    tempos = []
+    transporte = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transporte, base_url="http://bench") as cliente:
+        for turno in range(args.turnos):
+            for session_id in ids:
+                mensagem = f"resposta {turno} {random.random()} sobre o conceito"
+                inicio = time.perf_counter()
+                r = await cliente.post(
+                    "/its/chat", json={"session_id": session_id, "mensagem": mensagem}
+                )
+                tempos.append(time.perf_counter() - inicio)
+                r.raise_for_status()
+
+    tempos.sort()
+    ms = [t * 1000 for t in tempos]
+    return {
+        "turnos": len(ms),
+        "media_ms": round(statistics.mean(ms), 2),
+        "p50_ms": round(ms[len(ms) // 2], 2),
+        "p95_ms": round(ms[int(len(ms) * 0.95)], 2),
+        "p99_ms": round(ms[int(len(ms) * 0.99)], 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessoes", type=int, default=50)
+    parser.add_argument("--turnos", type=int, default=20)
+    parser.add_argument("--sem-cache", action="store_true")
+    args = parser.parse_args()
+
+    # O banco e o governador são configurados na importação do backend
+    pasta = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{pasta}/bench.db"
+    os.environ.setdefault("LLM_TAXA_POR_SEGUNDO", "0")
+    os.chdir(pasta)
+
+    print(json.dumps(asyncio.run(executar(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
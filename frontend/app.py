@@ -3,9 +3,21 @@ from PIL import Image
 from areas.professor import render_professor_area
 from areas.aluno import render_aluno_area
 
+
+@st.cache_resource(show_spinner=False)
+def carregar_logo():
+    """Logo lida do disco uma vez por processo (e não a cada reexecução)"""
+    try:
+        logo = Image.open("assets/logo_sigma.png")
+        logo.load()
+        return logo
+    except FileNotFoundError:
+        return None
+
+
 st.set_page_config(
     page_title="SigmaTeacher",
-    page_icon=Image.open("assets/logo_sigma.png"),
+    page_icon=carregar_logo() or "🎙️",
     layout="wide",
 )
 
@@ -32,12 +44,12 @@ else:
 st.button(btn_label, on_click=alternar_area)
 
 # --- LOGO PRINCIPAL ---
-try:
-    logo_principal = Image.open("assets/logo_sigma.png")
+logo_principal = carregar_logo()
+if logo_principal:
     col1, col2, col3 = st.columns([1, 2, 1])
     with col2:
         st.image(logo_principal, width="stretch")
-except FileNotFoundError:
+else:
     st.title("🎙️ Sigma Teacher")
 
 st.divider()
@@ -1,36 +1,317 @@
 import streamlit as st
 import requests
 from streamlit_mic_recorder import mic_recorder
-import os
 
-from components.listar_sessoes import render_listar_sessoes
+from components.listar_sessoes import render_listar_sessoes, recarregar_sessoes
 from components.its_chat import render_its_chat
+from utils import api
+from utils.carregar_sessao import atualizar_mensagens
 
-API_URL = os.getenv("API_URL", "http://127.0.0.1:8000")
+
+def listar_audios(cursor=None):
+    """Busca uma página do resumo dos áudios gravados. Retorna (itens, proximo_cursor)"""
+    try:
+        dados = api.get("/listar-audios", params={"cursor": cursor} if cursor else {})
+        return dados["itens"], dados["proximo_cursor"]
+    except requests.HTTPError:
+        st.error("Erro ao buscar áudios.")
+        return [], None
+    except Exception as e:
+        st.warning(f"Conecte o servidor backend primeiro. Erro: {e}")
+        return [], None
 
 
-def listar_audios():
-    """Lista todos os áudios gravados"""
+def obter_audio(audio_id):
+    """Busca um áudio com a transcrição completa"""
     try:
-        resp = requests.get(f"{API_URL}/listar-audios")
-        if resp.status_code == 200:
-            return resp.json()
-        else:
-            st.error("Erro ao buscar áudios.")
-            return []
+        return api.get(f"/audio/{audio_id}")
+    except requests.HTTPError:
+        st.error("Erro ao buscar a transcrição.")
+    except Exception as e:
+        st.error(f"❌ Erro: {e}")
+    return None
+
+
+def carregar_audios(mais=False):
+    """
+    Mantém no estado a lista de áudios já carregados. Só busca a primeira
+    página uma vez; as seguintes apenas quando o usuário pede "carregar mais".
+    """
+    if "audios_lista" not in st.session_state:
+        st.session_state.audios_lista = None
+        st.session_state.audios_cursor = None
+
+    if st.session_state.audios_lista is None:
+        itens, cursor = listar_audios()
+        st.session_state.audios_lista = itens
+        st.session_state.audios_cursor = cursor
+    elif mais and st.session_state.audios_cursor:
+        itens, cursor = listar_audios(st.session_state.audios_cursor)
+        st.session_state.audios_lista.extend(itens)
+        st.session_state.audios_cursor = cursor
+
+    return st.session_state.audios_lista
+
+
+def recarregar_audios():
+    """
+    Descarta a lista carregada; a próxima renderização busca do início,
+    revalidando no backend (304 se nada mudou)
+    """
+    api.invalidar("/listar-audios", "/buscar-audios", "/audio/")
+    st.session_state.audios_lista = None
+    st.session_state.audio_em_edicao = None
+    st.session_state.busca_termos = None
+
+
+def carregar_mais_audios():
+    carregar_audios(mais=True)
+
+
+def buscar_audios(termos, offset=0):
+    """Busca aulas pelo conteúdo. Retorna (itens com snippet, proximo_offset)"""
+    try:
+        dados = api.get("/buscar-audios", params={"q": termos, "offset": offset})
+        return dados["itens"], dados["proximo_offset"]
+    except requests.HTTPError:
+        st.error("Erro ao buscar nas transcrições.")
     except Exception as e:
         st.warning(f"Conecte o servidor backend primeiro. Erro: {e}")
+    return [], None
+
+
+def carregar_busca(termos, mais=False):
+    """Resultados da busca no estado; só consulta de novo se os termos mudarem"""
+    if st.session_state.get("busca_termos") != termos:
+        itens, offset = buscar_audios(termos)
+        st.session_state.busca_termos = termos
+        st.session_state.busca_itens = itens
+        st.session_state.busca_offset = offset
+    elif mais and st.session_state.busca_offset:
+        itens, offset = buscar_audios(termos, st.session_state.busca_offset)
+        st.session_state.busca_itens.extend(itens)
+        st.session_state.busca_offset = offset
+
+    return st.session_state.busca_itens
+
+
+def carregar_mais_busca():
+    carregar_busca(st.session_state.busca_termos, mais=True)
+
+
+def editar_audio(audio_id):
+    st.session_state.audio_em_edicao = audio_id
+    st.session_state.audio_em_edicao_dados = obter_audio(audio_id)
+
+
+def enviar_arquivos(arquivos):
+    """Envia os PDFs ao backend e devolve os ids (blob_ids) usados no /its/iniciar"""
+    if not arquivos:
         return []
+    resp = api.post(
+        "/upload-arquivo",
+        files=[("files", (a.name, a.getvalue(), a.type)) for a in arquivos],
+        timeout=(5, 120),
+    )
+    resp.raise_for_status()
+    return [a["blob_id"] for a in resp.json()["arquivos_salvos"]]
+
+
+def buscar_painel_turma():
+    """Busca os contadores da turma por curso e tópico"""
+    try:
+        return api.get("/its/painel-turma")["cursos"]
+    except requests.HTTPError:
+        st.error("Erro ao buscar o painel da turma.")
+    except Exception as e:
+        st.warning(f"Conecte o servidor backend primeiro. Erro: {e}")
+    return []
+
+
+def render_painel_turma():
+    st.header("📊 Painel da turma")
+    st.write("Desempenho dos alunos em cada tópico, somado a cada resposta no chat.")
+
+    _, col2 = st.columns([4, 1])
+    with col2:
+        st.button(
+            "🔄 Atualizar painel",
+            use_container_width=True,
+            on_click=api.invalidar,
+            args=("/its/painel-turma",),
+        )
+
+    st.divider()
+
+    cursos = buscar_painel_turma()
+    if not cursos:
+        st.info("📭 Nenhuma sessão de tutoria iniciada ainda.")
+        return
+
+    opcoes = {" + ".join(c["aulas"]) or c["curso"]: c for c in cursos}
+    curso = opcoes[st.selectbox("Curso (aulas da sessão):", options=list(opcoes))]
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Sessões iniciadas", curso["sessoes_iniciadas"])
+    col2.metric("Sessões concluídas", curso["sessoes_concluidas"])
+    col3.metric("Taxa de conclusão", f"{curso['taxa_conclusao']}%")
+
+    if not curso["topicos"]:
+        return
+
+    st.subheader("Tópicos")
+    st.dataframe(
+        [
+            {
+                "Tópico": t["topico"],
+                "Tentativas": t["tentativas"],
+                "Acertos (%)": t["taxa_acerto"],
+                "Compreensão média": t["compreensao_media"],
+                "Minutos por aluno": t["minutos_por_aluno"],
+            }
+            for t in curso["topicos"]
+        ],
+        width="stretch",
+        hide_index=True,
+    )
+
+    st.subheader("Funil por tópico")
+    st.bar_chart(
+        {
+            "Tópico": [t["topico"] for t in curso["topicos"]],
+            "Chegaram": [t["funil"]["chegaram"] for t in curso["topicos"]],
+            "Tentaram": [t["funil"]["tentaram"] for t in curso["topicos"]],
+            "Compreenderam": [t["funil"]["compreenderam"] for t in curso["topicos"]],
+        },
+        x="Tópico",
+        stack=False,
+    )
+
+
+@st.fragment
+def render_historico_audios():
+    """
+    Aba de histórico. É um fragmento: buscar, editar e carregar mais só
+    reexecutam esta aba, não a página inteira
+    """
+    st.header("📚 Histórico de áudios")
+    st.write(
+        "Veja todas as aulas transcritas. Você pode editar as transcrições se necessário."
+    )
+
+    st.divider()
+
+    col1, col2 = st.columns([4, 1])
+
+    with col1:
+        termos_busca = st.text_input(
+            "🔎 Buscar nas transcrições:",
+            placeholder="Ex.: fotossíntese",
+            key="busca_transcricoes",
+        ).strip()
+
+    with col2:
+        st.button(
+            "🔄 Atualizar Lista", use_container_width=True, on_click=recarregar_audios
+        )
+
+    # Listar áudios (resumo; a transcrição completa só é buscada ao editar).
+    # Com termos de busca, lista só as aulas encontradas, com o trecho onde aparecem.
+    if termos_busca:
+        audios = carregar_busca(termos_busca)
+        ha_mais, carregar_mais = st.session_state.busca_offset, carregar_mais_busca
+    else:
+        audios = carregar_audios()
+        ha_mais, carregar_mais = st.session_state.audios_cursor, carregar_mais_audios
+
+    if audios:
+        # Exibir cada áudio em um container expansível
+        for _, audio in enumerate(audios):
+            editando = st.session_state.get("audio_em_edicao") == audio["id"]
+            with st.expander(
+                f"📝 {audio['filename_original']} - ID: {audio['id']}",
+                expanded=editando,
+            ):
+                col1, col2 = st.columns([1, 1])
+
+                with col1:
+                    st.write(f"**Data:** {audio.get('data_criacao', 'N/A')}")
+
+                with col2:
+                    if "tamanho_transcricao" in audio:
+                        st.write(
+                            f"**ID:** {audio['id']} · "
+                            f"{audio.get('tamanho_transcricao') or 0} caracteres"
+                        )
+                    else:
+                        st.write(f"**ID:** {audio['id']}")
+
+                dados_audio = st.session_state.get("audio_em_edicao_dados")
+                if not editando or not dados_audio:
+                    if audio.get("snippet"):
+                        st.markdown(audio["snippet"])
+                    else:
+                        st.caption(f"{audio.get('previa') or ''}...")
+                    st.button(
+                        "✏️ Editar transcrição",
+                        key=f"abrir_edit_{audio['id']}",
+                        on_click=editar_audio,
+                        args=(audio["id"],),
+                    )
+                    continue
+
+                # Área de edição da transcrição
+                transcricao_editada = st.text_area(
+                    "Editar transcrição:",
+                    value=dados_audio["transcricao"],
+                    height=200,
+                    key=f"transcricao_edit_{audio['id']}",
+                )
+
+                # Botão para salvar edição
+                if st.button(
+                    "💾 Salvar Edição",
+                    key=f"salvar_edit_{audio['id']}",
+                    width="stretch",
+                ):
+                    try:
+                        response = api.put(
+                            f"/editar-transcricao/{audio['id']}",
+                            json={"transcricao": transcricao_editada},
+                            timeout=(5, 120),
+                        )
+                        if response.status_code == 200:
+                            st.success("✅ Transcrição atualizada com sucesso!")
+                            recarregar_audios()
+                            st.rerun(scope="fragment")
+                        else:
+                            st.error("❌ Erro ao atualizar transcrição.")
+                    except Exception as e:
+                        st.error(f"❌ Erro: {e}")
+
+                st.divider()
+
+        if ha_mais:
+            st.button(
+                "⬇️ Carregar mais aulas",
+                key="carregar_mais_historico",
+                on_click=carregar_mais,
+            )
+    elif termos_busca:
+        st.info("🔎 Nenhuma aula encontrada para essa busca.")
+    else:
+        st.info("📭 Nenhuma aula gravada ainda. Comece pela aba VoiceTeacher!")
 
 
 def render_professor_area():
     # --- ABAS PRINCIPAIS ---
-    aba_gravacao, aba_historico, aba_config_its, aba_chat = st.tabs(
+    aba_gravacao, aba_historico, aba_config_its, aba_chat, aba_painel = st.tabs(
         [
             "🎙️ VoiceTeacher",
             "📚 Histórico de áudios",
             "⚙️ Configuração do ITS",
             "📖 Lista de sessões disponíveis",
+            "📊 Painel da turma",
         ]
     )
 
@@ -73,8 +354,9 @@ def render_professor_area():
                     files = {"file": (nome_aula, audio_do_botao["bytes"], "audio/wav")}
 
                     try:
-                        response = requests.post(
-                            f"{API_URL}/transcrever-e-salvar", files=files
+                        # A transcrição de uma aula longa pode levar minutos
+                        response = api.post(
+                            "/transcrever-e-salvar", files=files, timeout=(5, 900)
                         )
                         if response.status_code == 200:
                             dados = response.json()
@@ -82,6 +364,7 @@ def render_professor_area():
                             st.success("✅ Transcrição Concluída!")
                             st.session_state.ultima_transcricao = dados["transcricao"]
                             st.session_state.ultimo_id = dados["id_banco"]
+                            recarregar_audios()
 
                             with st.expander(
                                 "📄 Ver Transcrição Completa", expanded=True
@@ -98,67 +381,7 @@ def render_professor_area():
                         st.error(f"❌ Erro: {e}")
 
     with aba_historico:
-        st.header("📚 Histórico de áudios")
-        st.write(
-            "Veja todas as aulas transcritas. Você pode editar as transcrições se necessário."
-        )
-
-        st.divider()
-
-        _, col2 = st.columns([4, 1])
-
-        with col2:
-            if st.button("🔄 Atualizar Lista", use_container_width=True):
-                st.rerun()
-
-        # Listar áudios
-        audios = listar_audios()
-
-        if audios:
-            # Exibir cada áudio em um container expansível
-            for _, audio in enumerate(audios):
-                with st.expander(
-                    f"📝 {audio['filename_original']} - ID: {audio['id']}",
-                    expanded=False,
-                ):
-                    col1, col2 = st.columns([1, 1])
-
-                    with col1:
-                        st.write(f"**Data:** {audio.get('data_criacao', 'N/A')}")
-
-                    with col2:
-                        st.write(f"**ID:** {audio['id']}")
-
-                    # Área de edição da transcrição
-                    transcricao_editada = st.text_area(
-                        "Editar transcrição:",
-                        value=audio["transcricao"],
-                        height=200,
-                        key=f"transcricao_edit_{audio['id']}",
-                    )
-
-                    # Botão para salvar edição
-                    if st.button(
-                        "💾 Salvar Edição",
-                        key=f"salvar_edit_{audio['id']}",
-                        width="stretch",
-                    ):
-                        try:
-                            response = requests.put(
-                                f"{API_URL}/editar-transcricao/{audio['id']}",
-                                json={"transcricao": transcricao_editada},
-                            )
-                            if response.status_code == 200:
-                                st.success("✅ Transcrição atualizada com sucesso!")
-                                st.rerun()
-                            else:
-                                st.error("❌ Erro ao atualizar transcrição.")
-                        except Exception as e:
-                            st.error(f"❌ Erro: {e}")
-
-                    st.divider()
-        else:
-            st.info("📭 Nenhuma aula gravada ainda. Comece pela aba VoiceTeacher!")
+        render_historico_audios()
 
     with aba_config_its:
         st.header("⚙️ Configuração do ITS")
@@ -171,7 +394,7 @@ def render_professor_area():
         # Seção 1: Seleção de Aulas
         st.subheader("1️⃣ Selecione as Aulas")
 
-        audios = listar_audios()
+        audios = carregar_audios()
 
         if audios:
             # Criar opções de seleção
@@ -187,6 +410,13 @@ def render_professor_area():
 
             audio_ids_selecionados = [opcoes_audios[opt] for opt in audios_selecionados]
 
+            if st.session_state.audios_cursor:
+                st.button(
+                    "⬇️ Carregar mais aulas",
+                    key="carregar_mais_config_its",
+                    on_click=carregar_mais_audios,
+                )
+
             # Exibir resumo das aulas selecionadas
             if audio_ids_selecionados:
                 st.info(f"✅ {len(audio_ids_selecionados)} aula(s) selecionada(s)")
@@ -258,6 +488,14 @@ def render_professor_area():
                 key="audiencia_its",
             )
 
+        roster = st.text_area(
+            "Turma (opcional): um aluno por linha",
+            placeholder="Ana Souza\nBruno Lima\n...",
+            help="Com a lista preenchida, cada aluno recebe a sua própria sessão.",
+            key="roster_its",
+        )
+        alunos = [nome.strip() for nome in roster.splitlines() if nome.strip()]
+
         st.divider()
 
         # Seção 4: Botão de Iniciar
@@ -280,34 +518,57 @@ def render_professor_area():
                         "⏳ Processando conteúdo e gerando modelo de domínio..."
                     ):
                         try:
-                            # Salvar PDFs temporários
-                            caminhos_pdf_temp = []
-                            for file in uploaded_files:
-                                caminho_temp = f"uploads/temp_{file.name}"
-                                with open(caminho_temp, "wb") as f:
-                                    f.write(file.getbuffer())
-                                caminhos_pdf_temp.append(caminho_temp)
+                            # Enviar os PDFs ao backend (que devolve os ids)
+                            blob_ids = enviar_arquivos(uploaded_files)
 
                             # Fazer requisição para iniciar tutoria
                             payload = {
                                 "audio_ids": audio_ids_selecionados,
-                                "caminhos_pdf": caminhos_pdf_temp,
+                                "blob_ids": blob_ids,
                                 "n_topicos": n_topicos,
                                 "audiencia": audiencia,
                             }
-
-                            response = requests.post(
-                                f"{API_URL}/its/iniciar",
+                            # Com a lista da turma, todas as sessões saem de
+                            # uma geração só do modelo de domínio
+                            caminho = "/its/iniciar"
+                            if alunos:
+                                caminho = "/its/iniciar-turma"
+                                payload["alunos"] = alunos
+
+                            # Clicar de novo com a mesma seleção (ex.: depois
+                            # de um timeout) devolve a sessão já criada
+                            response = api.post(
+                                caminho,
                                 json=payload,
-                                timeout=120,
+                                timeout=(5, 120),
+                                chave_idempotencia=api.chave_de_envio(
+                                    st.session_state, "iniciar", payload
+                                ),
                             )
 
                             if response.status_code == 200:
                                 dados = response.json()
+                                api.concluir_envio(st.session_state, "iniciar")
                                 st.balloons()
-                                st.success("✅ Sessão de tutoria criada com sucesso!")
-
-                                st.info(f"📌 Sessão ID: {dados['session_id']}")
+                                recarregar_sessoes()
+                                api.invalidar("/its/painel-turma")
+
+                                if alunos:
+                                    st.success(
+                                        f"✅ {len(dados['sessoes'])} sessões de tutoria criadas!"
+                                    )
+                                    st.dataframe(
+                                        {
+                                            "Aluno": [s["aluno"] for s in dados["sessoes"]],
+                                            "Sessão ID": [
+                                                s["session_id"] for s in dados["sessoes"]
+                                            ],
+                                        },
+                                        hide_index=True,
+                                    )
+                                else:
+                                    st.success("✅ Sessão de tutoria criada com sucesso!")
+                                    st.info(f"📌 Sessão ID: {dados['session_id']}")
                                 st.write(
                                     f"**Primeira mensagem do tutor:**\n\n{dados['mensagem_bot']}"
                                 )
@@ -318,7 +579,8 @@ def render_professor_area():
                                 st.error(f"❌ Erro ao iniciar sessão: {error_msg}")
                         except requests.exceptions.Timeout:
                             st.error(
-                                "⏱️ Timeout: O processamento demorou muito. Tente novamente com menos tópicos."
+                                "⏱️ Timeout: O processamento demorou muito. Clique de novo "
+                                "para acompanhar a mesma sessão, ou tente com menos tópicos."
                             )
                         except Exception as e:
                             st.error(f"❌ Erro: {str(e)}")
@@ -336,15 +598,27 @@ def render_professor_area():
         else:
             st.header("💬 Visualização do Chat da Sessão de Tutoria")
 
-            st.button(
-                "Voltar para listagem de sessões", on_click=alternar_visualizar_chat
-            )
+            col1, col2 = st.columns([4, 1])
+            with col1:
+                st.button(
+                    "Voltar para listagem de sessões", on_click=alternar_visualizar_chat
+                )
+            with col2:
+                # Só as mensagens novas desde a última atualização
+                st.button(
+                    "🔄 Atualizar conversa",
+                    use_container_width=True,
+                    on_click=atualizar_mensagens,
+                )
 
             render_its_chat(
                 mostrar_audios=False,
                 mostrar_entrada_resposta=False,
             )
 
+    with aba_painel:
+        render_painel_turma()
+
 
 def alternar_visualizar_chat():
     st.session_state.visualizando_chat_atualmente_professor = (
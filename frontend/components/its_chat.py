@@ -1,15 +1,15 @@
 from datetime import datetime
 import streamlit as st
 import requests
-import os
-
-API_URL = os.getenv("API_URL", "http://127.0.0.1:8000")
+from utils import api
 
 
+@st.fragment
 def render_its_chat(
     mostrar_audios: bool = True,
     mostrar_entrada_resposta: bool = True,
 ):
+    # Fragmento: enviar uma mensagem reexecuta só o chat, não a página inteira
     # Inicializar estado da sessão
     if "chat_messages" not in st.session_state:
         st.session_state.chat_messages = []
@@ -130,25 +130,42 @@ def render_its_chat(
                     {"role": "user", "content": user_input}
                 )
 
-                # Enviar para backend
+                # Enviar para backend; reenviar a mesma mensagem (ex.: depois
+                # de um timeout) usa a mesma chave e não gera outro turno
+                corpo = {
+                    "session_id": st.session_state.session_id,
+                    "mensagem": user_input,
+                }
                 with st.spinner("⏳ Processando resposta..."):
                     try:
-                        response = requests.post(
-                            f"{API_URL}/its/chat",
-                            json={
-                                "session_id": st.session_state.session_id,
-                                "mensagem": user_input,
-                            },
-                            timeout=60,
+                        response = api.post(
+                            "/its/chat",
+                            json=corpo,
+                            timeout=(5, 60),
+                            chave_idempotencia=api.chave_de_envio(
+                                st.session_state, "chat", corpo
+                            ),
                         )
 
                         if response.status_code == 200:
                             dados = response.json()
+                            api.concluir_envio(st.session_state, "chat")
 
-                            # Adicionar resposta do bot
+                            # Adicionar resposta do bot; o cursor local passa para
+                            # depois das duas mensagens deste turno
                             st.session_state.chat_messages.append(
                                 {"role": "assistant", "content": dados["mensagem_bot"]}
                             )
+                            st.session_state.chat_ultimo_seq = dados["ultimo_seq"]
+
+                            # A lista de sessões mostra o status e o painel os
+                            # contadores; recarregar na próxima vez
+                            st.session_state.sessoes_lista = None
+                            api.invalidar(
+                                "/its/sessoes",
+                                "/its/painel-turma",
+                                f"/its/sessao/{st.session_state.session_id}",
+                            )
 
                             # Atualizar status
                             st.session_state.topico_atual = dados.get(
@@ -162,13 +179,27 @@ def render_its_chat(
                                 )
                                 st.balloons()
 
-                            st.rerun()
+                            st.rerun(scope="fragment")
+                        elif response.status_code == 409:
+                            # Outro turno desta sessão ainda está em andamento;
+                            # a mensagem não foi processada e pode ser reenviada
+                            st.session_state.chat_messages.pop()
+                            st.warning(
+                                "⏳ Sua mensagem anterior ainda está sendo processada. "
+                                "Aguarde alguns segundos e envie novamente."
+                            )
                         else:
                             erro_msg = response.json().get(
                                 "detail", "Erro desconhecido"
                             )
                             st.error(f"❌ Erro: {erro_msg}")
                     except requests.exceptions.Timeout:
-                        st.error("⏱️ Timeout: A resposta demorou muito.")
+                        # O turno pode continuar no backend; a mensagem sai da
+                        # tela e, reenviada, recebe a resposta desse turno
+                        st.session_state.chat_messages.pop()
+                        st.error(
+                            "⏱️ Timeout: A resposta demorou muito. "
+                            "Envie a mesma mensagem novamente para recebê-la."
+                        )
                     except Exception as e:
                         st.error(f"❌ Erro ao enviar resposta: {str(e)}")
@@ -1,34 +1,53 @@
 from datetime import datetime
 import streamlit as st
 import requests
-import os
+from utils import api
 from utils.carregar_sessao import carregar_sessao
 
-API_URL = os.getenv("API_URL", "http://127.0.0.1:8000")
+
+def buscar_pagina_sessoes(cursor=None):
+    """Busca uma página de sessões no backend. Retorna (itens, proximo_cursor)"""
+    try:
+        dados = api.get("/its/sessoes", params={"cursor": cursor} if cursor else {})
+        return dados["itens"], dados["proximo_cursor"]
+    except requests.HTTPError:
+        st.error("Não foi possível buscar as sessões.")
+    except Exception:
+        st.warning("Conecte o backend para ver as sessões.")
+    return [], None
+
+
+def recarregar_sessoes():
+    st.session_state.sessoes_lista = None
+    api.invalidar("/its/sessoes")
 
 
+def carregar_mais_sessoes():
+    itens, cursor = buscar_pagina_sessoes(st.session_state.sessoes_cursor)
+    st.session_state.sessoes_lista.extend(itens)
+    st.session_state.sessoes_cursor = cursor
+
+
+@st.fragment
 def render_listar_sessoes(
     mostrar_botao_entrar: bool = True, mostrar_botao_visualizar_chat: bool = False
 ):
+    # Fragmento: atualizar e carregar mais reexecutam só a lista. Entrar numa
+    # sessão troca a tela, então esses botões reexecutam a página inteira
     _, col_top_2 = st.columns([9, 1])
     with col_top_2:
-        if st.button(
+        st.button(
             "🔄 Atualizar Lista",
             key="btn_atualizar_sessoes",
-        ):
-            st.rerun()
+            on_click=recarregar_sessoes,
+        )
 
-    # Busca sessões no backend
-    try:
-        resp = requests.get(f"{API_URL}/its/sessoes")
-        if resp.status_code == 200:
-            sessoes = resp.json()
-        else:
-            sessoes = []
-            st.error("Não foi possível buscar as sessões.")
-    except Exception:
-        sessoes = []
-        st.warning("Conecte o backend para ver as sessões.")
+    # Busca a primeira página só uma vez; as demais ao clicar em "carregar mais"
+    if st.session_state.get("sessoes_lista") is None:
+        itens, cursor = buscar_pagina_sessoes()
+        st.session_state.sessoes_lista = itens
+        st.session_state.sessoes_cursor = cursor
+    sessoes = st.session_state.sessoes_lista
 
     if not sessoes:
         st.info("Nenhuma sessão encontrada. Peça ao professor para criar uma nova!")
@@ -49,6 +68,8 @@ def render_listar_sessoes(
 
             with c2:
                 st.markdown(f"**{sessao['topico']}**")
+                if sessao.get("aluno"):
+                    st.caption(f"👤 {sessao['aluno']}")
 
                 data_raw = sessao.get("data_criacao")
                 if data_raw:
@@ -60,7 +81,8 @@ def render_listar_sessoes(
                 else:
                     data_fmt = "Data desconhecida"
 
-                st.caption(f"📅 {data_fmt}")
+                arquivada = " · 🗄️ Arquivada" if sessao.get("arquivada") else ""
+                st.caption(f"📅 {data_fmt}{arquivada}")
 
             with c3:
                 if sessao["status"] == "concluido":
@@ -84,3 +106,10 @@ def render_listar_sessoes(
                                 True
                             )
                             st.rerun()
+
+        if st.session_state.sessoes_cursor:
+            st.button(
+                "⬇️ Carregar mais sessões",
+                key="btn_carregar_mais_sessoes",
+                on_click=carregar_mais_sessoes,
+            )
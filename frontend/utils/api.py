@@ -0,0 +1,189 @@
+"""
+Leituras do backend com cache local e GET condicional.
+
+O Streamlit reexecuta o script inteiro a cada clique ou tecla, e cada aba
+buscava de novo as mesmas listas e transcrições. Aqui cada GET fica guardado
+(corpo + ETag/Last-Modified) por `ttl` segundos; dentro desse prazo a
+resposta sai da memória, sem ir ao servidor. Depois dele a requisição vai
+com `If-None-Match` / `If-Modified-Since`, e um 304 reaproveita o corpo
+guardado sem baixá-lo de novo.
+
+O cache é do processo do Streamlit (vale para todas as abas e usuários). Quem
+altera dados no backend chama `invalidar` com os caminhos afetados: as
+entradas vencem na hora, mas mantêm o validador, então a próxima leitura
+ainda pode ser um 304 se a alteração não mudou aquela resposta.
+
+Todas as chamadas ao backend (leituras e `post`/`put`) passam por uma única
+`requests.Session`: as conexões ficam abertas entre as reexecuções (sem um
+novo handshake TCP por requisição), toda chamada tem timeout e falhas de
+conexão ou 502/503/504 são repetidas com espera crescente. POST só é
+repetido quando a conexão falha antes do envio. Com `API_LOG=1`, cada
+requisição é impressa (método, caminho, status, tempo), o que permite contar
+as idas ao servidor por interação.
+
+`/its/chat` e `/its/iniciar` aceitam `Idempotency-Key`: `chave_de_envio`
+gera uma chave por envio e devolve a mesma enquanto o mesmo conteúdo não
+for concluído, então clicar de novo depois de um timeout recebe a resposta
+da primeira tentativa em vez de refazer o trabalho no backend.
+"""
+
+import copy
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+API_URL = os.getenv("API_URL", "http://127.0.0.1:8000")
+TTL_PADRAO = float(os.getenv("API_CACHE_TTL", "30"))
+MAX_ENTRADAS = int(os.getenv("API_CACHE_ENTRADAS", "256"))
+LOG = os.getenv("API_LOG", "0") == "1"
+# (conexão, leitura) em segundos; chamadas lentas (transcrição, LLM) passam o seu
+TIMEOUT = (5, 30)
+TENTATIVAS = 3
+
+_cache = OrderedDict()  # (caminho, params) -> _Entrada
+_trava = threading.Lock()
+
+
+def _registrar(resp, *args, **kwargs):
+    if LOG:
+        print(
+            f"[api] {resp.request.method} {resp.request.path_url} "
+            f"{resp.status_code} {resp.elapsed.total_seconds() * 1000:.0f}ms"
+        )
+
+
+def _criar_sessao():
+    sessao = requests.Session()
+    retry = Retry(
+        total=TENTATIVAS,
+        connect=TENTATIVAS,
+        read=TENTATIVAS,
+        status=TENTATIVAS,
+        backoff_factor=0.3,
+        status_forcelist=(502, 503, 504),
+        # Sem POST: um POST que chegou ao servidor não é reenviado
+        allowed_methods=frozenset({"GET", "HEAD", "PUT"}),
+        raise_on_status=False,
+    )
+    adaptador = HTTPAdapter(max_retries=retry, pool_connections=4, pool_maxsize=16)
+    sessao.mount("http://", adaptador)
+    sessao.mount("https://", adaptador)
+    sessao.hooks["response"].append(_registrar)
+    return sessao
+
+
+_sessao = _criar_sessao()
+
+
+def post(caminho, timeout=TIMEOUT, chave_idempotencia=None, **kwargs):
+    """`POST API_URL + caminho` pela sessão compartilhada (devolve a resposta)."""
+    if chave_idempotencia:
+        kwargs["headers"] = {
+            **(kwargs.get("headers") or {}),
+            "Idempotency-Key": chave_idempotencia,
+        }
+    return _sessao.post(f"{API_URL}{caminho}", timeout=timeout, **kwargs)
+
+
+def chave_de_envio(estado, nome, conteudo):
+    """
+    Chave de idempotência do envio `nome`, guardada em `estado` (o
+    `st.session_state`). Enquanto o envio pendente tiver o mesmo `conteudo`,
+    a chave é a mesma; conteúdo novo ganha uma chave nova.
+    """
+    impressao = json.dumps(conteudo, sort_keys=True, ensure_ascii=False)
+    pendente = estado.get(f"envio_{nome}")
+    if not pendente or pendente[0] != impressao:
+        pendente = (impressao, uuid.uuid4().hex)
+        estado[f"envio_{nome}"] = pendente
+    return pendente[1]
+
+
+def concluir_envio(estado, nome):
+    """O envio `nome` terminou: o próximo, mesmo igual, é um envio novo."""
+    estado.pop(f"envio_{nome}", None)
+
+
+def put(caminho, timeout=TIMEOUT, **kwargs):
+    """`PUT API_URL + caminho` pela sessão compartilhada (devolve a resposta)."""
+    return _sessao.put(f"{API_URL}{caminho}", timeout=timeout, **kwargs)
+
+
+class _Entrada:
+    __slots__ = ("caminho", "vence_em", "etag", "modificado_em", "dados")
+
+    def __init__(self, caminho, vence_em, etag, modificado_em, dados):
+        self.caminho = caminho
+        self.vence_em = vence_em
+        self.etag = etag
+        self.modificado_em = modificado_em
+        self.dados = dados
+
+
+def _chave(caminho, params):
+    return caminho, tuple(sorted((params or {}).items()))
+
+
+def get(caminho, params=None, ttl=None):
+    """
+    JSON de `GET API_URL + caminho`. Levanta `requests.HTTPError` para
+    respostas de erro (4xx/5xx), como `raise_for_status`. Devolve uma cópia:
+    quem chama pode alterar o resultado (ex.: somar páginas a uma lista).
+    """
+    ttl = TTL_PADRAO if ttl is None else ttl
+    chave = _chave(caminho, params)
+    agora = time.monotonic()
+
+    with _trava:
+        entrada = _cache.get(chave)
+        if entrada and entrada.vence_em > agora:
+            _cache.move_to_end(chave)
+            return copy.deepcopy(entrada.dados)
+
+    cabecalhos = {}
+    if entrada:
+        if entrada.etag:
+            cabecalhos["If-None-Match"] = entrada.etag
+        if entrada.modificado_em:
+            cabecalhos["If-Modified-Since"] = entrada.modificado_em
+
+    resp = _sessao.get(
+        f"{API_URL}{caminho}", params=params, headers=cabecalhos, timeout=TIMEOUT
+    )
+    if resp.status_code == 304 and entrada:
+        dados = entrada.dados
+    else:
+        resp.raise_for_status()
+        dados = resp.json()
+
+    with _trava:
+        _cache[chave] = _Entrada(
+            caminho,
+            time.monotonic() + ttl,
+            resp.headers.get("ETag") or (entrada.etag if entrada else None),
+            resp.headers.get("Last-Modified")
+            or (entrada.modificado_em if entrada else None),
+            dados,
+        )
+        _cache.move_to_end(chave)
+        while len(_cache) > MAX_ENTRADAS:
+            _cache.popitem(last=False)
+    return copy.deepcopy(dados)
+
+
+def invalidar(*prefixos):
+    """
+    Vence agora as leituras cujo caminho começa com algum dos prefixos
+    (ex.: "/listar-audios", "/audio/"). Sem prefixos, vence todas.
+    """
+    with _trava:
+        for entrada in _cache.values():
+            if not prefixos or entrada.caminho.startswith(prefixos):
+                entrada.vence_em = 0
@@ -1,32 +1,74 @@
 import streamlit as st
 import requests
-import os
-
-API_URL = os.getenv("API_URL", "http://127.0.0.1:8000")
+from utils import api
 
 
 def carregar_sessao(session_id):
-    """Busca os dados de uma sessão específica e carrega no estado"""
+    """
+    Busca os dados de uma sessão específica e carrega no estado. Se ela já
+    está carregada, só busca as mensagens novas (ver atualizar_mensagens)
+    """
+    if (
+        st.session_state.get("session_id") == session_id
+        and st.session_state.get("chat_ultimo_seq") is not None
+    ):
+        return atualizar_mensagens()
+
+    try:
+        # Sempre revalida (ttl=0); sem mudanças o backend responde 304 e as
+        # transcrições não são baixadas de novo
+        dados = api.get(f"/its/sessao/{session_id}", ttl=0)
+    except requests.HTTPError:
+        st.error("Erro ao carregar sessão.")
+        return False
+    except Exception as e:
+        st.error(f"Erro de conexão: {e}")
+        return False
+
+    # Atualiza o estado global do Streamlit
+    st.session_state.session_id = dados["id"]
+    st.session_state.topico_atual = dados["topico_atual"]
+    st.session_state.chat_messages = dados["mensagens"]
+    st.session_state.chat_ultimo_seq = dados["ultimo_seq"]
+    st.session_state.audios_sessao_atual = dados.get("audios_contexto", [])
+    st.session_state.chat_iniciado = True
+
+    # Força o 'mensagem_bot' para evitar que o chat tente reenviar msg de boas vindas
+    if dados["mensagens"] and dados["mensagens"][-1]["role"] == "assistant":
+        st.session_state.mensagem_bot = dados["mensagens"][-1]["content"]
+
+    return True
+
+
+def atualizar_mensagens():
+    """
+    Traz só as mensagens posteriores ao cursor local (chat_ultimo_seq) da
+    sessão carregada e as acrescenta ao histórico, sem as transcrições. O
+    custo depende das mensagens novas, não do tamanho da conversa
+    """
+    session_id = st.session_state.session_id
     try:
-        resp = requests.get(f"{API_URL}/its/sessao/{session_id}")
-        if resp.status_code == 200:
-            dados = resp.json()
-
-            # Atualiza o estado global do Streamlit
-            st.session_state.session_id = dados["id"]
-            st.session_state.topico_atual = dados["topico_atual"]
-            st.session_state.chat_messages = dados["mensagens"]
-            st.session_state.audios_sessao_atual = dados.get("audios_contexto", [])
-            st.session_state.chat_iniciado = True
-
-            # Força o 'mensagem_bot' para evitar que o chat tente reenviar msg de boas vindas
-            if dados["mensagens"] and dados["mensagens"][-1]["role"] == "assistant":
-                st.session_state.mensagem_bot = dados["mensagens"][-1]["content"]
-
-            return True
-        else:
-            st.error("Erro ao carregar sessão.")
-            return False
+        dados = api.get(
+            f"/its/sessao/{session_id}",
+            params={
+                "since_seq": st.session_state.chat_ultimo_seq,
+                "incluir_audios": "false",
+            },
+            ttl=0,
+        )
+    except requests.HTTPError:
+        st.error("Erro ao atualizar a conversa.")
+        return False
     except Exception as e:
         st.error(f"Erro de conexão: {e}")
         return False
+
+    st.session_state.topico_atual = dados["topico_atual"]
+    st.session_state.chat_messages.extend(dados["mensagens"])
+    st.session_state.chat_ultimo_seq = dados["ultimo_seq"]
+    st.session_state.chat_iniciado = True
+
+    if dados["mensagens"] and dados["mensagens"][-1]["role"] == "assistant":
+        st.session_state.mensagem_bot = dados["mensagens"][-1]["content"]
+
+    return True
@@ -0,0 +1,111 @@
+"""
+Configuração comum dos testes: banco SQLite e pastas temporários, definidos
+antes de importar o backend (os módulos leem as variáveis de ambiente ao
+serem importados), e um event loop único para a sessão de testes (o engine
+async guarda conexões presas ao loop em que foram abertas).
+
+    python -m pytest -q
+"""
+
+import asyncio
+import os
+import tempfile
+
+PASTA_TESTES = tempfile.mkdtemp(prefix="sigma-testes-")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{PASTA_TESTES}/testes.db"
+os.environ["BLOBS_DIR"] = os.path.join(PASTA_TESTES, "blobs")
+os.environ["CASSETE_DIR"] = os.path.join(PASTA_TESTES, "cassetes")
+os.environ["LLM_TAXA_POR_SEGUNDO"] = "0"
+
+import pytest  # noqa: E402
+
+from backend import busca  # noqa: E402
+from backend.database import (  # noqa: E402
+    AsyncSessionLocal,
+    Base,
+    criar_tabelas,
+    engine,
+)
+
+
+async def _criar_banco():
+    # Como na inicialização do backend: tabelas e o índice de busca (FTS5)
+    await criar_tabelas()
+    async with AsyncSessionLocal() as db:
+        await busca.criar_indice(db)
+
+
+@pytest.fixture(scope="session")
+def loop():
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(_criar_banco())
+    yield loop
+    loop.run_until_complete(engine.dispose())
+    loop.close()
+
+
+async def _esvaziar_tabelas():
+    async with engine.begin() as conexao:
+        for tabela in reversed(Base.metadata.sorted_tables):
+            await conexao.execute(tabela.delete())
+
+
+@pytest.fixture
+def rodar(loop):
+    """Executa uma corrotina no loop dos testes; o banco é esvaziado no fim."""
+    yield loop.run_until_complete
+    loop.run_until_complete(_esvaziar_tabelas())
+
+
+@pytest.fixture(scope="session")
+def app():
+    """O app FastAPI, sem carregar o modelo do Whisper (os testes não transcrevem)."""
+    import whisper
+
+    carregar = whisper.load_model
+    whisper.load_model = lambda *args, **kwargs: None
+    try:
+        from backend.main import app
+    finally:
+        whisper.load_model = carregar
+    return app
+
+
+@pytest.fixture
+def cliente(app):
+    """Cria um cliente HTTP do app para usar dentro de uma corrotina (`rodar`)."""
+    import httpx
+
+    def criar():
+        return httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://teste"
+        )
+
+    return criar
+
+
+@pytest.fixture
+def nova_sessao():
+    """Grava uma sessão de tutoria no início, como o /its/iniciar; devolve o id."""
+    from backend import its, progresso
+    from backend.database import AsyncSessionLocal, TutoriaSession
+
+    async def criar(modelo_dominio, audio_ids=(1,), status="aguardando_resposta_exercicio"):
+        modelo_aluno = its.etapa_0_inicializar_aluno(modelo_dominio)
+        async with AsyncSessionLocal() as db:
+            sessao = TutoriaSession(
+                modelo_dominio=its.salvar_json(modelo_dominio),
+                modelo_aluno=its.salvar_json(
+                    progresso.modelo_aluno_para_salvar(modelo_aluno)
+                ),
+                topico_atual=modelo_dominio["_sequencia"][0],
+                status=status,
+                audio_ids=its.salvar_json(list(audio_ids)),
+            )
+            db.add(sessao)
+            await db.flush()
+            progresso.criar_progresso(db, sessao.id, modelo_aluno["topicos_status"])
+            await db.commit()
+            return sessao.id
+
+    return criar
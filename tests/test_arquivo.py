@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+from backend import arquivo, concorrencia, historico
+from backend.database import (
+    AsyncSessionLocal,
+    ChatMessage,
+    SessaoArquivada,
+    TopicProgress,
+    TutoriaSession,
+)
+
+DOMINIO = {
+    "_sequencia": ["Frações", "Decimais"],
+    "Frações": {"exercicio": "1/2 + 1/2?"},
+    "Decimais": {"exercicio": "0,5 + 0,5?"},
+}
+DAQUI_A_UM_ANO = datetime.utcnow() + timedelta(days=365)
+
+
+async def _sessao_com_historico(nova_sessao, status="concluido", aluno=None):
+    session_id = await nova_sessao(DOMINIO, status=status)
+    async with AsyncSessionLocal() as db:
+        sessao = await db.get(TutoriaSession, session_id)
+        sessao.aluno = aluno
+        await historico.adicionar_mensagens(
+            db, session_id, [("model", "Bem-vindo!"), ("user", "1")]
+        )
+        await db.commit()
+    return session_id
+
+
+async def _contar(modelo, session_id):
+    coluna = modelo.session_id if hasattr(modelo, "session_id") else modelo.id
+    async with AsyncSessionLocal() as db:
+        return await db.scalar(
+            select(func.count()).select_from(modelo).where(coluna == session_id)
+        )
+
+
+def test_arquivar_e_restaurar(rodar, nova_sessao):
+    async def cenario():
+        session_id = await _sessao_com_historico(nova_sessao, aluno="Ana")
+        async with AsyncSessionLocal() as db:
+            versao = (await db.get(TutoriaSession, session_id)).versao
+
+        assert await arquivo.arquivar(DAQUI_A_UM_ANO) == 1
+        assert await _contar(TutoriaSession, session_id) == 0
+        assert await _contar(ChatMessage, session_id) == 0
+        assert await _contar(TopicProgress, session_id) == 0
+
+        async with AsyncSessionLocal() as db:
+            arquivada = await db.get(SessaoArquivada, session_id)
+            assert (arquivada.status, arquivada.aluno) == ("concluido", "Ana")
+            documento = await arquivo.obter(db, session_id)
+            assert [m["texto"] for m in documento["mensagens"]] == ["Bem-vindo!", "1"]
+
+            sessao = await arquivo.restaurar(db, session_id)
+            await db.commit()
+            assert sessao.versao == versao + 1  # Estados antigos em memória deixam de valer
+            assert sessao.aluno == "Ana"
+
+        assert await _contar(SessaoArquivada, session_id) == 0
+        assert await _contar(ChatMessage, session_id) == 2
+        assert await _contar(TopicProgress, session_id) == 2
+
+    rodar(cenario())
+
+
+def test_sessao_ocupada_ou_recente_fica(rodar, nova_sessao):
+    async def cenario():
+        ocupada = await _sessao_com_historico(nova_sessao)
+        em_andamento = await _sessao_com_historico(
+            nova_sessao, status="aguardando_resposta_exercicio"
+        )
+
+        # Concluída há pouco e em andamento há pouco: nenhuma candidata
+        assert await arquivo.arquivar() == 0
+
+        async with concorrencia.turno_exclusivo(ocupada):
+            assert await arquivo.arquivar_sessao(ocupada) is False
+        assert await _contar(TutoriaSession, ocupada) == 1
+
+        # Daqui a um ano as duas vão (a ociosa pelo prazo de sessão parada)
+        assert await arquivo.arquivar(DAQUI_A_UM_ANO) == 2
+        assert await _contar(TutoriaSession, em_andamento) == 0
+
+    rodar(cenario())
+
+
+def test_sessao_nova_nao_herda_id_de_arquivada(rodar, nova_sessao):
+    async def cenario():
+        ultima = await _sessao_com_historico(nova_sessao)
+        assert await arquivo.arquivar(DAQUI_A_UM_ANO) == 1
+        return ultima, await nova_sessao(DOMINIO)
+
+    ultima, nova = rodar(cenario())
+    assert nova > ultima
@@ -0,0 +1,230 @@
+import json
+from types import SimpleNamespace
+
+from sqlalchemy import select
+
+from backend import its
+from backend.database import AsyncSessionLocal, TopicProgress
+
+DOMINIO = {
+    "_sequencia": ["Frações"],
+    "Frações": {"explicacao": "Partes de um todo.", "exercicio": "Quanto é 1/2 + 1/2?"},
+}
+OUTRO_DOMINIO = {
+    "_sequencia": ["Frações"],
+    "Frações": {"explicacao": "Outra aula.", "exercicio": "Quanto é 1/3 + 1/3?"},
+}
+
+
+def _avaliar_todas(respostas, topico, modelo_dominio):
+    return [
+        {"avaliado": True, "acertou": True, "compreensao": 90, "mensagem_ao_aluno": "Isso!"}
+        for _ in respostas
+    ]
+
+
+async def _tentativas(session_id):
+    async with AsyncSessionLocal() as db:
+        return await db.scalar(
+            select(TopicProgress.tentativas).where(TopicProgress.session_id == session_id)
+        )
+
+
+def test_aplica_so_nas_sessoes_do_mesmo_modelo(rodar, cliente, nova_sessao, monkeypatch):
+    monkeypatch.setattr(its, "etapa_3_avaliacao_em_lote", _avaliar_todas)
+
+    async def cenario():
+        referencia = await nova_sessao(DOMINIO)
+        colega = await nova_sessao(DOMINIO)
+        outra_turma = await nova_sessao(OUTRO_DOMINIO)
+        async with cliente() as c:
+            resposta = await c.post(
+                "/its/avaliar-lote",
+                json={
+                    "sessao_referencia_id": referencia,
+                    "topico": "Frações",
+                    "aplicar": True,
+                    "respostas": [
+                        {"aluno": "Ana", "resposta": "1", "session_id": colega},
+                        {"aluno": "Bia", "resposta": "um", "session_id": outra_turma},
+                        {"aluno": "Caio", "resposta": "1 inteiro", "session_id": 9999},
+                    ],
+                },
+            )
+        return resposta, colega, outra_turma
+
+    resposta, colega, outra_turma = rodar(cenario())
+    assert resposta.status_code == 200
+    dados = resposta.json()
+    assert dados["aplicadas"] == 1
+    assert [r["aplicada"] for r in dados["resultados"]] == [True, False, False]
+    assert rodar(_tentativas(colega)) == 1
+    assert rodar(_tentativas(outra_turma)) == 0
+
+
+def test_sem_aplicar_nao_altera_progresso(rodar, cliente, nova_sessao, monkeypatch):
+    monkeypatch.setattr(its, "etapa_3_avaliacao_em_lote", _avaliar_todas)
+
+    async def cenario():
+        referencia = await nova_sessao(DOMINIO)
+        async with cliente() as c:
+            resposta = await c.post(
+                "/its/avaliar-lote",
+                json={
+                    "sessao_referencia_id": referencia,
+                    "topico": "Frações",
+                    "respostas": [
+                        {"aluno": "Ana", "resposta": "1", "session_id": referencia},
+                        {"aluno": "Bia", "resposta": "1", "session_id": referencia},
+                    ],
+                },
+            )
+        return resposta, referencia
+
+    resposta, referencia = rodar(cenario())
+    assert resposta.json()["aplicadas"] == 0
+    assert rodar(_tentativas(referencia)) == 0
+
+
+def test_itens_malformados_do_llm_voltam_como_nao_avaliados(
+    rodar, cliente, nova_sessao, monkeypatch
+):
+    avaliacoes = [
+        {"indice": 0, "acertou": "false", "compreensao": "85", "mensagem_ao_aluno": "Quase."},
+        {"indice": 1, "acertou": True, "compreensao": None, "mensagem_ao_aluno": "?"},
+        {"indice": 2, "acertou": "talvez", "compreensao": 50},
+        {"indice": 3, "acertou": True, "compreensao": 250, "mensagem_ao_aluno": 7},
+        "não é um objeto",
+    ]
+    monkeypatch.setattr(
+        its,
+        "_gerar",
+        lambda etapa, prompt, prioridade: SimpleNamespace(
+            text=json.dumps({"avaliacoes": avaliacoes})
+        ),
+    )
+
+    async def cenario():
+        referencia = await nova_sessao(DOMINIO)
+        colega = await nova_sessao(DOMINIO)
+        async with cliente() as c:
+            resposta = await c.post(
+                "/its/avaliar-lote",
+                json={
+                    "sessao_referencia_id": referencia,
+                    "topico": "Frações",
+                    "aplicar": True,
+                    "respostas": [
+                        {"aluno": aluno, "resposta": texto, "session_id": colega}
+                        for aluno, texto in [
+                            ("Ana", "1"),
+                            ("Bia", "dois meios"),
+                            ("Caio", "não sei"),
+                            ("Davi", "um inteiro"),
+                        ]
+                    ],
+                },
+            )
+        return resposta, colega
+
+    resposta, colega = rodar(cenario())
+    assert resposta.status_code == 200
+    resultados = resposta.json()["resultados"]
+    assert [r["avaliado"] for r in resultados] == [True, False, False, True]
+    assert resultados[0]["acertou"] is False
+    assert resultados[0]["compreensao"] == 85
+    assert resultados[3]["compreensao"] == 100
+    assert resultados[3]["mensagem_ao_aluno"] == ""
+    # Só os itens válidos entram no progresso do aluno
+    assert resposta.json()["aplicadas"] == 2
+    assert rodar(_tentativas(colega)) == 2
+
+
+def test_sessao_com_turno_em_andamento_fica_sem_aplicar(
+    rodar, cliente, nova_sessao, monkeypatch
+):
+    from backend import arquivo, concorrencia
+
+    monkeypatch.setattr(its, "etapa_3_avaliacao_em_lote", _avaliar_todas)
+
+    async def cenario():
+        referencia = await nova_sessao(DOMINIO)
+        livre = await nova_sessao(DOMINIO)
+        ocupada = await nova_sessao(DOMINIO)
+        # A referência vem do arquivo frio e volta para as tabelas quentes
+        assert await arquivo.arquivar_sessao(referencia)
+        async with concorrencia.turno_exclusivo(ocupada), cliente() as c:
+            resposta = await c.post(
+                "/its/avaliar-lote",
+                json={
+                    "sessao_referencia_id": referencia,
+                    "topico": "Frações",
+                    "aplicar": True,
+                    "respostas": [
+                        {"aluno": "Ana", "resposta": "1", "session_id": livre},
+                        {"aluno": "Bia", "resposta": "1", "session_id": ocupada},
+                    ],
+                },
+            )
+        return resposta, livre, ocupada
+
+    resposta, livre, ocupada = rodar(cenario())
+    assert resposta.status_code == 200
+    dados = resposta.json()
+    assert [r["aplicada"] for r in dados["resultados"]] == [True, False]
+    assert dados["sessoes_ocupadas"] == [ocupada]
+    assert rodar(_tentativas(livre)) == 1
+    assert rodar(_tentativas(ocupada)) == 0
+
+
+def test_prompt_do_lote_respeita_o_orcamento(monkeypatch):
+    from backend import prompts
+
+    enviados = []
+
+    def gerar(etapa, prompt, prioridade):
+        enviados.append(prompt)
+        return SimpleNamespace(text='{"avaliacoes": []}')
+
+    monkeypatch.setattr(its, "_gerar", gerar)
+    monkeypatch.setattr(its, "ORCAMENTO_LOTE", 600)
+    respostas = [
+        " ".join(f"Frase {n} da resposta do aluno {i}." for n in range(40))
+        for i in range(5)
+    ]
+
+    its.etapa_3_avaliacao_em_lote(respostas, "Frações", DOMINIO)
+
+    (prompt,) = enviados
+    assert prompts.estimar_tokens(prompt) <= 600 + 6 * prompts.estimar_tokens(
+        prompts.MARCA_CORTE
+    )
+    # Todas as respostas continuam no prompt, cada uma encurtada
+    for i in range(5):
+        assert f"--- Resposta [{i}] ---\nFrase 0 da resposta do aluno {i}." in prompt
+    assert "Quanto é 1/2 + 1/2?" in prompt
+
+
+def test_pergunta_longa_do_lote_tem_teto(monkeypatch):
+    from backend import prompts
+
+    enviados = []
+    monkeypatch.setattr(
+        its,
+        "_gerar",
+        lambda etapa, prompt, prioridade: enviados.append(prompt)
+        or SimpleNamespace(text='{"avaliacoes": []}'),
+    )
+    monkeypatch.setattr(its, "ORCAMENTO_LOTE", 600)
+    exercicio = " ".join(f"Parte {n} do enunciado." for n in range(200))
+    dominio = {"_sequencia": ["Frações"], "Frações": {"exercicio": exercicio}}
+
+    its.etapa_3_avaliacao_em_lote(["1", "2"], "Frações", dominio)
+
+    (prompt,) = enviados
+    assert "Pergunta: Parte 0 do enunciado." in prompt
+    assert prompts.MARCA_CORTE in prompt
+    assert "--- Resposta [1] ---\n2" in prompt
+    assert prompts.estimar_tokens(prompt) <= 600 + prompts.estimar_tokens(
+        prompts.MARCA_CORTE
+    )
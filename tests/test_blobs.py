@@ -0,0 +1,89 @@
+import io
+import json
+import os
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from sqlalchemy import select
+
+from backend import blobs
+from backend.database import AsyncSessionLocal, Blob, ModeloDominioCache
+
+
+async def _guardar(conteudo, nome="apostila.pdf"):
+    async with AsyncSessionLocal() as db:
+        blob = await blobs.guardar(
+            db, SimpleNamespace(file=io.BytesIO(conteudo), filename=nome)
+        )
+        return blob.id
+
+
+async def _gravar_modelo(chave, blob_ids, ultimo_uso):
+    """Como o pipeline ao gravar um modelo de domínio gerado a partir de PDFs."""
+    async with AsyncSessionLocal() as db:
+        db.add(
+            ModeloDominioCache(
+                impressao=chave,
+                modelo_dominio="{}",
+                blob_ids=json.dumps(blob_ids),
+                ultimo_uso=ultimo_uso,
+            )
+        )
+        await blobs.adicionar_referencias(db, set(blob_ids))
+        await db.commit()
+
+
+async def _estado(blob_id):
+    async with AsyncSessionLocal() as db:
+        blob = await db.get(Blob, blob_id)
+        modelos = (await db.scalars(select(ModeloDominioCache.impressao))).all()
+        return (blob.referencias if blob else None), sorted(modelos)
+
+
+def test_blob_sem_referencia_coletado_depois_da_retencao(rodar):
+    async def cenario():
+        blob_id = await _guardar(b"%PDF-1.4 sem referencia")
+        agora = datetime.utcnow()
+        recente = await blobs.coletar_lixo(agora)
+        existe_recente = os.path.exists(blobs.caminho(blob_id))
+        vencido = await blobs.coletar_lixo(agora + timedelta(hours=blobs.RETENCAO_HORAS + 1))
+        return blob_id, recente, existe_recente, vencido
+
+    blob_id, recente, existe_recente, vencido = rodar(cenario())
+    assert recente == 0 and existe_recente
+    assert vencido == 1
+    assert not os.path.exists(blobs.caminho(blob_id))
+
+
+def test_modelo_dominio_podado_devolve_referencias(rodar):
+    async def cenario():
+        compartilhado = await _guardar(b"%PDF-1.4 usado pelos dois modelos")
+        exclusivo = await _guardar(b"%PDF-1.4 usado por um modelo")
+        agora = datetime.utcnow()
+        antigo = agora - timedelta(days=blobs.MODELOS_RETENCAO_DIAS + 1)
+        await _gravar_modelo("antigo", [compartilhado, exclusivo, exclusivo], antigo)
+        await _gravar_modelo("recente", [compartilhado], agora)
+
+        antes = await _estado(compartilhado)
+        apagados = await blobs.coletar_lixo(
+            agora + timedelta(hours=blobs.RETENCAO_HORAS + 1)
+        )
+        return (
+            compartilhado,
+            exclusivo,
+            antes,
+            apagados,
+            await _estado(compartilhado),
+            await _estado(exclusivo),
+        )
+
+    compartilhado, exclusivo, antes, apagados, depois, depois_exclusivo = rodar(cenario())
+    assert antes[0] == 2
+    # O modelo antigo saiu do cache e devolveu uma referência por arquivo
+    assert depois[1] == ["recente"]
+    assert depois[0] == 1
+    assert os.path.exists(blobs.caminho(compartilhado))
+    # O arquivo que só ele usava ficou sem referência e foi coletado na mesma rodada
+    assert apagados == 1
+    assert depois_exclusivo[0] is None
+    assert not os.path.exists(blobs.caminho(exclusivo))
@@ -0,0 +1,110 @@
+from backend import busca
+from backend.database import AsyncSessionLocal, AudioLog
+
+
+async def _gravar_aula(nome, transcricao):
+    async with AsyncSessionLocal() as db:
+        aula = AudioLog(
+            filename_original=nome,
+            caminho_arquivo=nome,
+            transcricao=transcricao,
+            transcricao_editada=None,
+        )
+        db.add(aula)
+        await db.commit()
+        return aula.id
+
+
+async def _buscar(c, termos):
+    resposta = await c.get("/buscar-audios", params={"q": termos})
+    assert resposta.status_code == 200
+    return resposta.json()["itens"]
+
+
+def test_busca_por_prefixo_sem_acentos(rodar, cliente):
+    async def cenario():
+        fotossintese = await _gravar_aula(
+            "biologia.mp3", "Hoje vamos estudar a fotossíntese das plantas verdes."
+        )
+        await _gravar_aula("matematica.mp3", "Frações representam partes de um todo.")
+        async with cliente() as c:
+            sem_acento = await _buscar(c, "fotossintese")
+            prefixo = await _buscar(c, "fotoss plantas")
+            nenhuma = await _buscar(c, "fotossíntese frações")
+        return fotossintese, sem_acento, prefixo, nenhuma
+
+    fotossintese, sem_acento, prefixo, nenhuma = rodar(cenario())
+    assert [r["id"] for r in sem_acento] == [fotossintese]
+    assert "**fotossíntese**" in sem_acento[0]["snippet"]
+    assert [r["id"] for r in prefixo] == [fotossintese]
+    # Todos os termos precisam aparecer
+    assert nenhuma == []
+
+
+def test_nome_da_aula_pesa_mais_no_ranking(rodar, cliente):
+    async def cenario():
+        no_texto = await _gravar_aula("aula1.mp3", "Começamos pelas frações equivalentes.")
+        no_nome = await _gravar_aula("frações.mp3", "Começamos pelas frações equivalentes.")
+        async with cliente() as c:
+            return no_nome, no_texto, await _buscar(c, "frações")
+
+    no_nome, no_texto, resultados = rodar(cenario())
+    assert [r["id"] for r in resultados] == [no_nome, no_texto]
+
+
+def test_indice_segue_edicao_e_remocao(rodar, cliente):
+    async def cenario():
+        aula = await _gravar_aula("aula.mp3", "O professor falou sobre mitocôndria.")
+        async with cliente() as c:
+            resposta = await c.put(
+                f"/editar-transcricao/{aula}",
+                json={"transcricao": "O professor falou sobre o cloroplasto."},
+            )
+            assert resposta.status_code == 200
+            depois_da_edicao = (
+                await _buscar(c, "mitocondria"),
+                await _buscar(c, "cloroplasto"),
+            )
+            async with AsyncSessionLocal() as db:
+                await db.delete(await db.get(AudioLog, aula))
+                await db.commit()
+            return aula, depois_da_edicao, await _buscar(c, "cloroplasto")
+
+    aula, (antigo, novo), depois_da_remocao = rodar(cenario())
+    assert antigo == []
+    assert [r["id"] for r in novo] == [aula]
+    assert depois_da_remocao == []
+
+
+def test_termos_com_sintaxe_do_fts_sao_tratados_como_texto(rodar, cliente):
+    async def cenario():
+        aula = await _gravar_aula("aula.mp3", "Frações NOT decimais.")
+        async with cliente() as c:
+            resultados = await _buscar(c, 'frações" NOT (decimais*')
+            sem_palavras = await _buscar(c, "?!")
+        return aula, resultados, sem_palavras
+
+    aula, resultados, sem_palavras = rodar(cenario())
+    assert [r["id"] for r in resultados] == [aula]
+    assert sem_palavras == []
+
+
+def test_sem_fts_busca_com_like(rodar, monkeypatch):
+    monkeypatch.setattr(busca, "fts_disponivel", lambda db: False)
+
+    async def cenario():
+        primeira = await _gravar_aula("frações.mp3", "Partes de um todo.")
+        segunda = await _gravar_aula("aula2.mp3", "Mais sobre frações e decimais.")
+        await _gravar_aula("aula3.mp3", "Decimais apenas.")
+        async with AsyncSessionLocal() as db:
+            pagina, ha_mais = await busca.buscar(db, "frações", limite=1)
+            resto, _ = await busca.buscar(db, "frações", limite=1, offset=1)
+            todos, _ = await busca.buscar(db, "frações decimais", limite=10)
+        return primeira, segunda, pagina, ha_mais, resto, todos
+
+    primeira, segunda, pagina, ha_mais, resto, todos = rodar(cenario())
+    # Sem ranking: as mais novas primeiro
+    assert [r["id"] for r in pagina] == [segunda] and ha_mais
+    assert [r["id"] for r in resto] == [primeira]
+    assert [r["id"] for r in todos] == [segunda]
+    assert pagina[0]["score"] is None and pagina[0]["snippet"] is None
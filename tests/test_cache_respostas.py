@@ -0,0 +1,123 @@
+from sqlalchemy import select
+
+from backend import cache_respostas
+from backend.database import AsyncSessionLocal, RespostaCache
+
+ESCOPO = cache_respostas.escopo("dominio-v1", "Frações")
+OUTRO_ESCOPO = cache_respostas.escopo("dominio-v2", "Frações")
+
+RESPOSTA = (
+    "quando somamos um meio com outro meio as duas metades formam juntas "
+    "exatamente um inteiro completo sem sobrar nada"
+)
+
+
+async def _guardar(escopo, *respostas):
+    async with AsyncSessionLocal() as db:
+        for resposta in respostas:
+            await cache_respostas.guardar(db, escopo, resposta, {"resposta": resposta})
+        await db.commit()
+
+
+async def _buscar(escopo, resposta):
+    async with AsyncSessionLocal() as db:
+        return await cache_respostas.buscar(db, escopo, resposta)
+
+
+async def _guardadas():
+    async with AsyncSessionLocal() as db:
+        return set(
+            (await db.scalars(select(RespostaCache.resposta_normalizada))).all()
+        )
+
+
+def test_igual_depois_de_normalizada(rodar):
+    async def cenario():
+        await _guardar(ESCOPO, "O resultado é 1 inteiro!")
+        return await _buscar(ESCOPO, "o RESULTADO e 1   inteiro")
+
+    resultado, similaridade, id_entrada = rodar(cenario())
+    assert resultado == {"resposta": "O resultado é 1 inteiro!"}
+    assert similaridade == 1.0 and id_entrada is not None
+
+
+def test_quase_igual_reaproveita_a_avaliacao(rodar):
+    async def cenario():
+        await _guardar(ESCOPO, RESPOSTA)
+        return (
+            await _buscar(ESCOPO, "Então, " + RESPOSTA),
+            await _buscar(OUTRO_ESCOPO, "Então, " + RESPOSTA),
+            await _buscar(ESCOPO, "um meio mais um meio dá dois quartos"),
+        )
+
+    quase_igual, outro_escopo, diferente = rodar(cenario())
+    assert quase_igual[0] == {"resposta": RESPOSTA}
+    assert cache_respostas.LIMIAR_SIMILARIDADE <= quase_igual[1] < 1.0
+    # Um modelo de domínio regerado não reaproveita avaliações antigas
+    assert outro_escopo[0] is None
+    assert diferente[0] is None and diferente[1] < cache_respostas.LIMIAR_SIMILARIDADE
+
+
+def test_negacao_diferente_nunca_casa(rodar, monkeypatch):
+    # Limiar baixo: só a regra das negações separa as duas respostas
+    monkeypatch.setattr(cache_respostas, "LIMIAR_SIMILARIDADE", 0.5)
+    afirmacao = (
+        "a soma de um meio com um meio resulta em um inteiro porque as duas "
+        "metades completam o todo"
+    )
+
+    async def cenario():
+        await _guardar(ESCOPO, afirmacao)
+        return (
+            await _buscar(ESCOPO, afirmacao.replace("resulta", "não resulta")),
+            await _buscar(ESCOPO, afirmacao.replace("resulta", "sempre resulta")),
+        )
+
+    negada, parecida = rodar(cenario())
+    assert negada[0] is None
+    assert parecida[0] == {"resposta": afirmacao}
+
+
+def test_resposta_curta_so_casa_exata(rodar, monkeypatch):
+    monkeypatch.setattr(cache_respostas, "LIMIAR_SIMILARIDADE", 0.0)
+
+    async def cenario():
+        await _guardar(ESCOPO, "um inteiro")
+        return (
+            await _buscar(ESCOPO, "um inteiro só"),
+            await _buscar(ESCOPO, "Um inteiro."),
+        )
+
+    curta, exata = rodar(cenario())
+    assert curta[0] is None
+    assert exata[0] == {"resposta": "um inteiro"}
+
+
+def test_despejo_por_escopo_tira_a_usada_ha_mais_tempo(rodar, monkeypatch):
+    monkeypatch.setattr(cache_respostas, "MAX_POR_ESCOPO", 2)
+
+    async def cenario():
+        await _guardar(ESCOPO, "resposta um", "resposta dois")
+        # Reaproveitada: passa a ser a mais recente
+        _, _, id_um = await _buscar(ESCOPO, "resposta um")
+        async with AsyncSessionLocal() as db:
+            await cache_respostas.registrar_uso(db, id_um)
+            await db.commit()
+        await _guardar(ESCOPO, "resposta tres")
+        await _guardar(OUTRO_ESCOPO, "resposta quatro")
+        return await _guardadas()
+
+    assert rodar(cenario()) == {"resposta um", "resposta tres", "resposta quatro"}
+
+
+def test_despejo_pelo_limite_total(rodar, monkeypatch):
+    monkeypatch.setattr(cache_respostas, "MAX_TOTAL", 3)
+
+    async def cenario():
+        await _guardar(ESCOPO, "resposta um", "resposta dois")
+        await _guardar(OUTRO_ESCOPO, "resposta tres", "resposta quatro")
+        # A mesma resposta de novo não cria outra entrada
+        await _guardar(OUTRO_ESCOPO, "Resposta quatro!")
+        return await _guardadas()
+
+    assert rodar(cenario()) == {"resposta dois", "resposta tres", "resposta quatro"}
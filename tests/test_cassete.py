@@ -0,0 +1,88 @@
+from collections import defaultdict
+from types import SimpleNamespace
+
+import pytest
+
+from backend import cassete
+
+
+@pytest.fixture
+def modo(monkeypatch, tmp_path):
+    """Liga o cassete em `gravar` ou `reproduzir`, com um arquivo novo por teste."""
+    monkeypatch.setattr(cassete, "PASTA", str(tmp_path))
+    monkeypatch.setattr(cassete, "NOME", "teste")
+    monkeypatch.setattr(cassete, "VELOCIDADE", 0)
+
+    def ligar(nome):
+        monkeypatch.setattr(cassete, "GRAVANDO", nome == "gravar")
+        monkeypatch.setattr(cassete, "REPRODUZINDO", nome == "reproduzir")
+        monkeypatch.setattr(cassete, "_gravacoes", None)
+        monkeypatch.setattr(cassete, "_posicoes", defaultdict(int))
+
+    return ligar
+
+
+def _resposta(texto):
+    return SimpleNamespace(
+        text=texto,
+        usage_metadata=SimpleNamespace(prompt_token_count=10, candidates_token_count=3),
+    )
+
+
+def test_reproduz_as_respostas_na_ordem_gravada(modo):
+    modo("gravar")
+    respostas = iter(["primeira", "segunda"])
+    for _ in range(2):
+        cassete.llm("Qual o próximo exercício?", lambda: _resposta(next(respostas)))
+    cassete.transcricao("abc123", "base", lambda: "Hoje vamos estudar frações.")
+
+    modo("reproduzir")
+
+    def chamar():
+        raise AssertionError("Reproduzindo, nenhuma chamada sai do processo")
+
+    textos = [cassete.llm("Qual o próximo exercício?", chamar).text for _ in range(3)]
+    # Depois da última gravação, a última se repete
+    assert textos == ["primeira", "segunda", "segunda"]
+    resposta = cassete.llm("Qual o próximo exercício?", chamar)
+    assert resposta.usage_metadata.prompt_token_count == 10
+    assert cassete.transcricao("abc123", "base", chamar) == "Hoje vamos estudar frações."
+
+
+def test_requisicao_sem_gravacao(modo):
+    modo("gravar")
+    cassete.llm("Gravada", lambda: _resposta("ok"))
+    cassete.transcricao("abc123", "base", lambda: "texto")
+
+    modo("reproduzir")
+    with pytest.raises(cassete.CasseteSemGravacaoError):
+        cassete.llm("Nunca gravada", lambda: _resposta("x"))
+    # O modelo do Whisper faz parte da chave
+    with pytest.raises(cassete.CasseteSemGravacaoError):
+        cassete.transcricao("abc123", "large", lambda: "x")
+
+
+def test_arquivo_enviado_identificado_pelo_conteudo(modo, tmp_path):
+    pdf = tmp_path / "apostila.pdf"
+    pdf.write_bytes(b"%PDF-1.4 fracoes")
+    arquivo_remoto = SimpleNamespace(name="files/abc", display_name="apostila")
+
+    modo("gravar")
+    cassete.envio_arquivo(str(pdf), lambda: arquivo_remoto)
+    cassete.llm(["Resuma", arquivo_remoto], lambda: _resposta("resumo"))
+
+    modo("reproduzir")
+    copia = tmp_path / "copia.pdf"
+    copia.write_bytes(pdf.read_bytes())
+    reproduzido = cassete.envio_arquivo(str(copia), lambda: None)
+    assert reproduzido.name == "files/abc"
+    assert reproduzido.state.name == "ACTIVE"
+    # O nome remoto muda a cada envio; a chave usa o nome de exibição
+    outro_envio = SimpleNamespace(name="files/xyz", display_name="apostila")
+    assert cassete.llm(["Resuma", outro_envio], lambda: None).text == "resumo"
+
+
+def test_desligado_so_repassa(modo, tmp_path):
+    modo("")
+    assert cassete.llm("Oi", lambda: _resposta("olá")).text == "olá"
+    assert not list(tmp_path.iterdir())
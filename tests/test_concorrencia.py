@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.orm.exc import StaleDataError
+
+from backend import concorrencia
+from backend.database import AsyncSessionLocal, SessaoLease, TutoriaSession
+
+DOMINIO = {"_sequencia": ["Frações"], "Frações": {"exercicio": "1/2 + 1/2?"}}
+
+
+def test_um_turno_por_sessao(rodar):
+    async def cenario():
+        async with concorrencia.turno_exclusivo(1):
+            with pytest.raises(concorrencia.SessaoOcupadaError):
+                async with concorrencia.turno_exclusivo(1, espera=0):
+                    pass
+            # Outra sessão segue em paralelo
+            async with concorrencia.turno_exclusivo(2, espera=0):
+                pass
+        # Liberada no fim do turno
+        async with concorrencia.turno_exclusivo(1, espera=0):
+            pass
+
+    rodar(cenario())
+
+
+def test_lease_liberado_mesmo_com_erro_no_turno(rodar):
+    async def cenario():
+        with pytest.raises(RuntimeError):
+            async with concorrencia.turno_exclusivo(1):
+                raise RuntimeError("LLM fora do ar")
+        async with concorrencia.turno_exclusivo(1, espera=0):
+            pass
+
+    rodar(cenario())
+
+
+def test_lease_expirado_pode_ser_tomado(rodar):
+    async def cenario():
+        async with AsyncSessionLocal() as db:
+            db.add(
+                SessaoLease(
+                    session_id=1,
+                    dono="processo-que-morreu",
+                    expira_em=datetime.utcnow() - timedelta(seconds=1),
+                )
+            )
+            await db.commit()
+        async with concorrencia.turno_exclusivo(1, espera=0):
+            pass
+
+    rodar(cenario())
+
+
+def test_versao_otimista_rejeita_escrita_sobre_leitura_antiga(rodar, nova_sessao):
+    async def cenario():
+        session_id = await nova_sessao(DOMINIO)
+        async with AsyncSessionLocal() as primeiro, AsyncSessionLocal() as segundo:
+            a = await primeiro.get(TutoriaSession, session_id)
+            b = await segundo.get(TutoriaSession, session_id)
+            a.status = "aguardando_transicao"
+            await primeiro.commit()
+            b.status = "concluido"
+            with pytest.raises(StaleDataError):
+                await segundo.commit()
+
+    rodar(cenario())
+
+
+def test_lease_renovado_durante_turno_longo(rodar, monkeypatch):
+    import asyncio
+
+    monkeypatch.setattr(concorrencia, "LEASE_SEGUNDOS", 0.3)
+
+    async def cenario():
+        async with concorrencia.turno_exclusivo(1):
+            # Um turno bem mais longo que o prazo (fila do LLM, novas tentativas)
+            await asyncio.sleep(1)
+            with pytest.raises(concorrencia.SessaoOcupadaError):
+                async with concorrencia.turno_exclusivo(1, espera=0):
+                    pass
+
+    rodar(cenario())
@@ -0,0 +1,140 @@
+import contextvars
+import threading
+import time
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+from backend import governador as modulo
+from backend.governador import Disjuntor, Governador, LLMIndisponivelError
+
+
+def _governador(**kwargs):
+    padrao = dict(
+        max_concorrencia=1,
+        taxa_por_segundo=0,
+        rajada=1,
+        max_tentativas=3,
+        backoff_base=0,
+        limite_falhas=2,
+        espera_circuito=60,
+        espera_maxima=5,
+    )
+    return Governador(**{**padrao, **kwargs})
+
+
+def test_disjuntor_conta_uma_falha_por_chamada():
+    gov = _governador()
+    tentativas = []
+
+    def instavel():
+        tentativas.append(1)
+        raise google_exceptions.ServiceUnavailable("fora do ar")
+
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        gov.executar(instavel)
+    assert len(tentativas) == 3
+    assert gov.disjuntor.estado == Disjuntor.FECHADO
+
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        gov.executar(instavel)
+    assert gov.disjuntor.estado == Disjuntor.ABERTO
+
+    with pytest.raises(LLMIndisponivelError):
+        gov.executar(instavel)
+    assert len(tentativas) == 6
+
+
+def test_erro_local_nao_fecha_nem_zera_o_disjuntor():
+    gov = _governador(espera_circuito=0)
+
+    def fora_do_ar():
+        raise google_exceptions.ServiceUnavailable("fora do ar")
+
+    def prompt_invalido():
+        raise ValueError("prompt inválido")
+
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        gov.executar(fora_do_ar)
+    # Um erro nosso não apaga a falha já contada
+    with pytest.raises(ValueError):
+        gov.executar(prompt_invalido)
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        gov.executar(fora_do_ar)
+    assert gov.disjuntor.estado == Disjuntor.ABERTO
+
+    # Meio-aberto: o erro nosso libera o teste sem fechar o disjuntor
+    with pytest.raises(ValueError):
+        gov.executar(prompt_invalido)
+    assert gov.disjuntor.estado == Disjuntor.MEIO_ABERTO
+    assert gov.executar(lambda: "ok") == "ok"
+    assert gov.disjuntor.estado == Disjuntor.FECHADO
+
+
+def test_nova_tentativa_depois_de_erro_retentavel():
+    gov = _governador()
+    respostas = iter([google_exceptions.TooManyRequests("429"), "ok"])
+
+    def chamada():
+        resposta = next(respostas)
+        if isinstance(resposta, Exception):
+            raise resposta
+        return resposta
+
+    assert gov.executar(chamada) == "ok"
+    assert gov.disjuntor.estado == Disjuntor.FECHADO
+
+
+def test_espera_pela_taxa_nao_segura_a_vaga():
+    gov = _governador(taxa_por_segundo=1, rajada=1)
+    gov.executar(lambda: None)  # Gasta o único token
+
+    lote = threading.Thread(
+        target=gov.executar,
+        args=(lambda: None,),
+        kwargs={"prioridade": modulo.PRIORIDADE_LOTE},
+    )
+    lote.start()
+    time.sleep(0.05)
+    try:
+        # A chamada em lote espera o token sem ocupar a única vaga
+        gov.semaforo.adquirir(modulo.PRIORIDADE_INTERATIVA, time.monotonic() + 0.2)
+        gov.semaforo.liberar()
+    finally:
+        lote.join()
+
+
+def test_espera_por_vaga_tem_limite():
+    gov = _governador(espera_maxima=0.1)
+    gov.semaforo.adquirir(modulo.PRIORIDADE_LOTE)
+    try:
+        with pytest.raises(LLMIndisponivelError):
+            gov.executar(lambda: None)
+        assert gov.semaforo.em_espera() == 0
+    finally:
+        gov.semaforo.liberar()
+
+    # A desistência não conta como falha nem prende o disjuntor
+    assert gov.executar(lambda: "ok") == "ok"
+    assert gov.disjuntor.estado == Disjuntor.FECHADO
+
+
+def test_espera_pela_taxa_tem_limite():
+    gov = _governador(taxa_por_segundo=0.1, rajada=1, espera_maxima=0.1)
+    gov.executar(lambda: None)
+    with pytest.raises(LLMIndisponivelError):
+        gov.executar(lambda: None)
+
+
+def test_em_thread_usa_threads_proprias_e_o_contexto(loop):
+    variavel = contextvars.ContextVar("variavel", default=None)
+
+    async def chamar():
+        variavel.set("requisicao-1")
+        return await modulo.em_thread(
+            lambda: (threading.current_thread().name, variavel.get())
+        )
+
+    nome, valor = loop.run_until_complete(chamar())
+    assert nome.startswith("llm")
+    assert valor == "requisicao-1"
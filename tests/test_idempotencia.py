@@ -0,0 +1,148 @@
+import asyncio
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from backend import idempotencia
+from backend.pipeline import impressao
+
+CORPO = {"session_id": 1, "mensagem": "1/2"}
+# Como idempotencia.executar identifica o corpo
+IMPRESSAO_CORPO = impressao(json.dumps(CORPO, ensure_ascii=False, sort_keys=True))
+
+
+def _calculo(chamadas, resposta=None, espera=0, falhar=False):
+    async def calcular():
+        chamadas.append(1)
+        await asyncio.sleep(espera)
+        if falhar:
+            raise RuntimeError("LLM fora do ar")
+        return resposta or {"resposta_tutor": "Muito bem!", "n": len(chamadas)}
+
+    return calcular
+
+
+def test_repeticao_recebe_a_resposta_guardada(rodar):
+    chamadas = []
+
+    async def cenario():
+        primeira = await idempotencia.executar("chat", "k1", CORPO, _calculo(chamadas))
+        repetida = await idempotencia.executar("chat", "k1", CORPO, _calculo(chamadas))
+        outra_rota = await idempotencia.executar("iniciar", "k1", CORPO, _calculo(chamadas))
+        return primeira, repetida, outra_rota
+
+    primeira, repetida, outra_rota = rodar(cenario())
+    assert primeira == repetida == {"resposta_tutor": "Muito bem!", "n": 1}
+    # A chave vale por rota
+    assert outra_rota["n"] == 2
+
+
+def test_repeticoes_simultaneas_esperam_a_mesma_computacao(rodar):
+    chamadas = []
+
+    async def cenario():
+        return await asyncio.gather(
+            *[
+                idempotencia.executar("chat", "k1", CORPO, _calculo(chamadas, espera=0.1))
+                for _ in range(5)
+            ]
+        )
+
+    respostas = rodar(cenario())
+    assert len(chamadas) == 1
+    assert all(r == respostas[0] for r in respostas)
+
+
+def test_mesma_chave_com_outro_corpo(rodar):
+    chamadas = []
+
+    outro_corpo = {**CORPO, "mensagem": "2/3"}
+
+    async def cenario():
+        original = asyncio.ensure_future(
+            idempotencia.executar("chat", "k1", CORPO, _calculo(chamadas, espera=0.1))
+        )
+        await asyncio.sleep(0.01)
+        with pytest.raises(idempotencia.ChaveReutilizadaError):
+            await idempotencia.executar("chat", "k1", outro_corpo, _calculo(chamadas))
+        await original
+        # Também depois que a original terminou
+        with pytest.raises(idempotencia.ChaveReutilizadaError):
+            await idempotencia.executar("chat", "k1", outro_corpo, _calculo(chamadas))
+
+    rodar(cenario())
+    assert len(chamadas) == 1
+
+
+def test_falha_libera_a_chave(rodar):
+    chamadas = []
+
+    async def cenario():
+        with pytest.raises(RuntimeError):
+            await idempotencia.executar("chat", "k1", CORPO, _calculo(chamadas, falhar=True))
+        return await idempotencia.executar("chat", "k1", CORPO, _calculo(chamadas))
+
+    assert rodar(cenario())["n"] == 2
+
+
+def test_espera_a_original_de_outro_worker(rodar, monkeypatch):
+    monkeypatch.setattr(idempotencia, "INTERVALO_CONSULTA", 0.01)
+    chamadas = []
+
+    async def outro_worker():
+        # Reserva e responde sem passar por _em_andamento deste worker
+        assert await idempotencia._reservar("chat:k1", IMPRESSAO_CORPO, "outro")
+        await asyncio.sleep(0.1)
+        await idempotencia._guardar("chat:k1", "outro", {"resposta_tutor": "De lá"})
+
+    async def cenario():
+        original = asyncio.ensure_future(outro_worker())
+        await asyncio.sleep(0.01)
+        resposta = await idempotencia.executar("chat", "k1", CORPO, _calculo(chamadas))
+        await original
+        return resposta
+
+    assert rodar(cenario()) == {"resposta_tutor": "De lá"}
+    assert chamadas == []
+
+
+def test_original_de_outro_worker_sem_resposta_no_prazo(rodar, monkeypatch):
+    monkeypatch.setattr(idempotencia, "INTERVALO_CONSULTA", 0.01)
+    monkeypatch.setattr(idempotencia, "ESPERA_SEGUNDOS", 0.05)
+
+    async def cenario():
+        await idempotencia._reservar("chat:k1", IMPRESSAO_CORPO, "outro")
+        with pytest.raises(idempotencia.EmAndamentoError):
+            await idempotencia.executar("chat", "k1", CORPO, _calculo([]))
+
+    rodar(cenario())
+
+
+def test_coletar_expiradas(rodar):
+    chamadas = []
+
+    async def cenario():
+        await idempotencia.executar("chat", "k1", CORPO, _calculo(chamadas))
+        agora = datetime.utcnow()
+        ainda_valida = await idempotencia.coletar_expiradas(agora)
+        vencidas = await idempotencia.coletar_expiradas(
+            agora + timedelta(hours=idempotencia.RETENCAO_HORAS + 1)
+        )
+        await idempotencia.executar("chat", "k1", CORPO, _calculo(chamadas))
+        return ainda_valida, vencidas
+
+    assert rodar(cenario()) == (0, 1)
+    # Depois da coleta a chave roda de novo
+    assert len(chamadas) == 2
+
+
+def test_sem_chave_so_executa(rodar):
+    chamadas = []
+
+    async def cenario():
+        for _ in range(2):
+            await idempotencia.executar("chat", None, CORPO, _calculo(chamadas))
+
+    rodar(cenario())
+    assert len(chamadas) == 2
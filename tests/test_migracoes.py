@@ -0,0 +1,87 @@
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.schema import CreateTable
+
+from backend import migracoes
+from backend.database import (
+    Base,
+    ChatMessage,
+    SessaoArquivada,
+    TutoriaSession,
+    criar_engine,
+)
+
+
+def _criar_banco_antigo(conexao):
+    """Tabelas atuais, mas `sessoes_tutoria` como era antes do AUTOINCREMENT."""
+    sessoes = TutoriaSession.__table__
+    Base.metadata.create_all(
+        conexao, tables=[t for t in Base.metadata.sorted_tables if t is not sessoes]
+    )
+    ddl = str(CreateTable(sessoes).compile(dialect=conexao.dialect))
+    conexao.exec_driver_sql(ddl.replace(" AUTOINCREMENT", ""))
+
+
+def test_sessoes_refeitas_com_autoincrement(loop, tmp_path):
+    engine = criar_engine(f"sqlite+aiosqlite:///{tmp_path}/antigo.db")
+    Sessao = async_sessionmaker(engine, expire_on_commit=False)
+
+    async def cenario():
+        async with engine.begin() as conexao:
+            await conexao.run_sync(_criar_banco_antigo)
+        async with Sessao() as db:
+            for session_id in (1, 2, 3):
+                db.add(
+                    TutoriaSession(id=session_id, status="concluido", aluno=f"A{session_id}")
+                )
+            db.add(SessaoArquivada(id=4, status="concluido", conteudo=b""))
+            await db.flush()
+            db.add(ChatMessage(session_id=2, seq=1, role="user", texto="1/2"))
+            await db.commit()
+
+        async with Sessao() as db:
+            refeita = await migracoes.sessoes_com_autoincrement(db)
+            de_novo = await migracoes.sessoes_com_autoincrement(db)
+            await migracoes.criar_indices_faltantes(db)
+
+            nova = TutoriaSession(status="ativo")
+            db.add(nova)
+            await db.commit()
+            definicao = await db.scalar(
+                text("SELECT sql FROM sqlite_master WHERE name = 'sessoes_tutoria'")
+            )
+            return (
+                refeita,
+                de_novo,
+                definicao,
+                nova.id,
+                (
+                    await db.scalars(
+                        select(TutoriaSession.aluno).order_by(TutoriaSession.id)
+                    )
+                ).all(),
+                await db.scalar(select(ChatMessage.texto).where(ChatMessage.session_id == 2)),
+                await db.scalar(text("PRAGMA foreign_keys")),
+                await db.scalar(
+                    text(
+                        "SELECT count(*) FROM sqlite_master"
+                        " WHERE type = 'index' AND tbl_name = 'sessoes_tutoria'"
+                    )
+                ),
+            )
+
+    try:
+        refeita, de_novo, definicao, novo_id, alunos, mensagem, chaves, indices = (
+            loop.run_until_complete(cenario())
+        )
+    finally:
+        loop.run_until_complete(engine.dispose())
+
+    assert (refeita, de_novo) == (True, False)
+    assert "AUTOINCREMENT" in definicao
+    # Depois do maior id usado, inclusive o do arquivo frio
+    assert novo_id == 5
+    assert alunos == ["A1", "A2", "A3", None]
+    assert mensagem == "1/2"
+    assert chaves == 1
+    assert indices >= 2
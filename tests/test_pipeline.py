@@ -0,0 +1,133 @@
+import sqlite3
+
+from backend import pipeline
+from backend.database import engine
+
+
+def _escrever_em_outra_conexao():
+    """Uma escrita de outra conexão, sem esperar: falha se o banco estiver travado."""
+    conexao = sqlite3.connect(engine.url.database, timeout=0)
+    try:
+        conexao.execute("BEGIN IMMEDIATE")
+        conexao.rollback()
+    finally:
+        conexao.close()
+
+
+def test_transcricao_sem_transacao_de_escrita_aberta(
+    rodar, cliente, monkeypatch, tmp_path
+):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "uploads").mkdir()
+
+    def transcrever(caminho, modelo, nome_modelo, impressao_audio):
+        _escrever_em_outra_conexao()
+        return "Hoje vamos estudar frações. Uma fração representa partes de um todo."
+
+    monkeypatch.setattr(pipeline, "_decodificar_e_transcrever", transcrever)
+
+    async def cenario():
+        async with cliente() as c:
+            return await c.post(
+                "/transcrever-e-salvar", files={"file": ("aula.mp3", b"\x00" * 2048)}
+            )
+
+    resposta = rodar(cenario())
+    assert resposta.status_code == 200
+    assert resposta.json()["transcricao"].startswith("Hoje vamos estudar frações.")
+
+
+TRANSCRICAO = (
+    "Hoje vamos estudar frações. Uma fração representa partes de um todo. "
+    "O numerador indica quantas partes tomamos. O denominador indica em quantas "
+    "partes o todo foi dividido."
+)
+
+
+async def _gravar_aula():
+    from backend.database import AsyncSessionLocal, AudioLog
+
+    async with AsyncSessionLocal() as db:
+        aula = AudioLog(
+            filename_original="aula.mp3",
+            caminho_arquivo="aula.mp3",
+            transcricao=TRANSCRICAO,
+            transcricao_editada=None,
+        )
+        db.add(aula)
+        await db.flush()
+        # Como no /transcrever-e-salvar: as etapas de texto saem junto com a aula
+        await pipeline.processar_texto(db, aula)
+        await db.commit()
+        return aula.id
+
+
+async def _obter_modelo(audio_id, gerar):
+    from sqlalchemy.orm import undefer_group
+
+    from backend.database import CONTEUDO, AsyncSessionLocal, AudioLog
+
+    async with AsyncSessionLocal() as db:
+        aula = await db.get(AudioLog, audio_id, options=[undefer_group(CONTEUDO)])
+        resultado = await pipeline.obter_modelo_dominio(
+            db, [aula], [], 3, "Ensino médio", gerar
+        )
+        await db.commit()
+        return resultado
+
+
+def test_modelo_dominio_gerado_uma_vez_para_pedidos_simultaneos(rodar):
+    import asyncio
+    import threading
+    import time
+
+    from sqlalchemy import func, select
+
+    from backend.database import AsyncSessionLocal, ModeloDominioCache
+
+    chamadas = []
+    trava = threading.Lock()
+
+    def gerar(texto):
+        with trava:
+            chamadas.append(texto)
+        time.sleep(0.2)
+        return {"_sequencia": ["Frações"], "Frações": {"exercicio": "1/2 + 1/2?"}}
+
+    async def cenario():
+        audio_id = await _gravar_aula()
+        resultados = await asyncio.gather(
+            *[_obter_modelo(audio_id, gerar) for _ in range(5)]
+        )
+        async with AsyncSessionLocal() as db:
+            linhas = await db.scalar(select(func.count()).select_from(ModeloDominioCache))
+        depois = await _obter_modelo(audio_id, gerar)
+        return resultados, linhas, depois
+
+    resultados, linhas, depois = rodar(cenario())
+    assert len(chamadas) == 1
+    assert linhas == 1
+    assert {r[0]["Frações"]["exercicio"] for r in resultados} == {"1/2 + 1/2?"}
+    assert sorted(r[1] for r in resultados) == [False, True, True, True, True]
+    assert depois[1] is True
+
+
+def test_limpeza_tira_palavras_repetidas_mas_nao_numeros():
+    assert (
+        pipeline.limpar_transcricao("Então que que a a a fração é é isso.")
+        == "Então que a fração é isso."
+    )
+    assert (
+        pipeline.limpar_transcricao("A sequência é 0, 1, 1, 2, 3, 5, 8, 13.")
+        == "A sequência é 0, 1, 1, 2, 3, 5, 8, 13."
+    )
+    assert pipeline.limpar_transcricao("Multiplique 11 11 vezes.") == "Multiplique 11 11 vezes."
+    # Vírgula entre palavras iguais é enumeração, não hesitação
+    assert pipeline.limpar_transcricao("Muito, muito bem.") == "Muito, muito bem."
+
+
+def test_limpeza_tira_muletas_e_frases_repetidas():
+    texto = "Ãh, a fração tem numerador, né? A fração tem numerador. Hum depois vem o denominador."
+    assert pipeline.limpar_transcricao(texto) == (
+        "A fração tem numerador. Depois vem o denominador."
+    )
@@ -0,0 +1,39 @@
+from backend import progresso
+from backend.database import AsyncSessionLocal
+
+DOMINIO = {
+    "_sequencia": ["Frações", "Decimais", "Porcentagem", "Razão"],
+    "Frações": {"exercicio": "1/2 + 1/2?"},
+    "Decimais": {"exercicio": "0,5 + 0,5?"},
+    "Porcentagem": {"exercicio": "10% de 50?"},
+    "Razão": {"exercicio": "2 para 4?"},
+}
+
+
+def test_percentual_compreendido_agregado_no_banco(rodar, nova_sessao):
+    async def cenario():
+        session_id = await nova_sessao(DOMINIO)
+        async with AsyncSessionLocal() as db:
+            inicial = await progresso.percentual_compreendido(db, session_id)
+            await progresso.aplicar_resultado(
+                db, session_id, "Frações", {"acertou": True, "compreensao": 90}
+            )
+            await progresso.aplicar_resultado(
+                db, session_id, "Decimais", {"acertou": False, "compreensao": 40}
+            )
+            depois = await progresso.percentual_compreendido(db, session_id)
+            sem_sessao = await progresso.percentual_compreendido(db, session_id + 1)
+        return inicial, depois, sem_sessao
+
+    assert rodar(cenario()) == (0, 25, 0)
+
+
+def test_aplicar_resultado_sem_linha_do_topico(rodar, nova_sessao):
+    async def cenario():
+        session_id = await nova_sessao(DOMINIO)
+        async with AsyncSessionLocal() as db:
+            return await progresso.aplicar_resultado(
+                db, session_id, "Geometria", {"acertou": True, "compreensao": 90}
+            )
+
+    assert rodar(cenario()) == 0
@@ -0,0 +1,65 @@
+import pytest
+
+from backend import prompts
+
+
+def test_estimar_tokens():
+    # Palavras curtas valem 1, longas 1 a cada 4 caracteres, pontuação 1
+    assert prompts.estimar_tokens("Olá, mundo! paralelepípedo") == 9
+    assert prompts.estimar_tokens("") == 0
+    assert prompts.estimar_tokens(None) == 0
+
+
+def test_cortar_mantem_texto_dentro_do_limite():
+    assert prompts.cortar("Uma frase curta.", 100) == "Uma frase curta."
+
+
+def test_cortar_divide_o_limite_entre_as_aulas():
+    primeira = " ".join(f"Frase número {i} da primeira aula." for i in range(60))
+    segunda = " ".join(f"Frase número {i} da segunda aula." for i in range(20))
+    texto = f"--- Aula: a1 ---\n{primeira}\n--- Aula: a2 ---\n{segunda}"
+
+    cortado = prompts.cortar(texto, 200)
+
+    assert prompts.estimar_tokens(cortado) <= 200 + 2 * prompts.estimar_tokens(
+        prompts.MARCA_CORTE
+    )
+    secao_1, secao_2 = cortado.split("--- Aula: a2 ---")
+    # As duas aulas continuam no prompt, cortadas em fim de frase
+    assert secao_1.startswith("--- Aula: a1 ---\nFrase número 0 da primeira aula.")
+    assert secao_2.strip().startswith("Frase número 0 da segunda aula.")
+    for secao in (secao_1, secao_2):
+        assert secao.strip().endswith(f". {prompts.MARCA_CORTE}")
+    # A fatia de cada aula é proporcional ao tamanho dela
+    assert secao_1.count("primeira aula") > secao_2.count("segunda aula")
+
+
+def test_prompt_corta_so_as_partes_ajustaveis():
+    instrucoes = "Gere o modelo de domínio em JSON."
+    aula = " ".join(f"Frase {i} da aula sobre frações." for i in range(200))
+    prompt = (
+        prompts.Prompt("teste", orcamento=120)
+        .fixa("instrucoes", instrucoes)
+        .ajustavel("aula", aula)
+        .fixa("formato", "Responda só com o JSON.")
+    )
+
+    texto = prompt.montar()
+
+    assert texto.startswith(instrucoes + "\n")
+    assert texto.endswith("\nResponda só com o JSON.")
+    assert prompts.MARCA_CORTE in texto
+    assert prompts.estimar_tokens(texto) <= 120 + prompts.estimar_tokens(
+        prompts.MARCA_CORTE
+    )
+
+
+def test_prompt_dentro_do_orcamento_vai_inteiro():
+    prompt = prompts.Prompt("teste", orcamento=1000).fixa("a", "Um.").ajustavel("b", "Dois.")
+    assert prompt.montar() == "Um.\nDois."
+
+
+def test_prompt_rejeita_parte_repetida():
+    prompt = prompts.Prompt("teste", orcamento=100).fixa("aula", "x")
+    with pytest.raises(ValueError):
+        prompt.ajustavel("aula", "y")
@@ -0,0 +1,130 @@
+import pytest
+from sqlalchemy import func, select
+
+from backend import historico, its
+from backend.database import AsyncSessionLocal, AudioLog, ChatMessage, TutoriaSession
+
+DOMINIO = {
+    "_sequencia": ["Frações", "Decimais"],
+    "Frações": {"explicacao": "Partes de um todo.", "exercicio": "1/2 + 1/2?"},
+    "Decimais": {"explicacao": "Frações de base dez.", "exercicio": "0,5 + 0,5?"},
+}
+
+
+@pytest.fixture
+def geracoes(monkeypatch):
+    """O LLM do modelo de domínio trocado por `DOMINIO`; conta as chamadas."""
+    chamadas = []
+
+    def gerar(**kwargs):
+        chamadas.append(kwargs)
+        return DOMINIO
+
+    monkeypatch.setattr(its, "etapa_0_prep_modelo_dominio", gerar)
+    return chamadas
+
+
+async def _gravar_aula():
+    async with AsyncSessionLocal() as db:
+        aula = AudioLog(
+            filename_original="aula.mp3",
+            caminho_arquivo="aula.mp3",
+            transcricao="Hoje vamos estudar frações. Uma fração representa partes de um todo.",
+            transcricao_editada=None,
+        )
+        db.add(aula)
+        await db.commit()
+        return aula.id
+
+
+async def _iniciar_turma(cliente, alunos):
+    audio_id = await _gravar_aula()
+    async with cliente() as c:
+        return await c.post(
+            "/its/iniciar-turma", json={"audio_ids": [audio_id], "alunos": alunos}
+        )
+
+
+async def _contar(modelo):
+    async with AsyncSessionLocal() as db:
+        return await db.scalar(select(func.count()).select_from(modelo))
+
+
+def test_uma_sessao_por_aluno(rodar, cliente, geracoes):
+    async def cenario():
+        resposta = await _iniciar_turma(cliente, [" Ana ", "", "Bia", "Caio"])
+        async with AsyncSessionLocal() as db:
+            gravadas = {
+                s.id: (s.aluno, s.topico_atual)
+                for s in await db.scalars(select(TutoriaSession))
+            }
+            mensagens = (
+                await db.execute(select(ChatMessage.session_id, ChatMessage.seq))
+            ).all()
+        return resposta, gravadas, mensagens
+
+    resposta, gravadas, mensagens = rodar(cenario())
+    assert resposta.status_code == 200
+    corpo = resposta.json()
+    # Nomes sem espaços nas pontas; linhas vazias não viram sessão
+    assert [s["aluno"] for s in corpo["sessoes"]] == ["Ana", "Bia", "Caio"]
+    assert {s["session_id"]: (s["aluno"], "Frações") for s in corpo["sessoes"]} == gravadas
+    assert corpo["topico_atual"] == "Frações"
+    assert corpo["exercicio"] == "1/2 + 1/2?"
+    # O modelo de domínio é gerado uma vez para a turma toda
+    assert len(geracoes) == 1
+    assert sorted(mensagens) == sorted((session_id, 1) for session_id in gravadas)
+
+
+def test_nome_repetido_sem_diferenciar_maiusculas(rodar, cliente, geracoes):
+    async def cenario():
+        resposta = await _iniciar_turma(cliente, ["Ana", "Bia", "ANA ", "bia"])
+        return resposta, await _contar(TutoriaSession)
+
+    resposta, sessoes = rodar(cenario())
+    assert resposta.status_code == 400
+    assert resposta.json()["detail"] == "Nomes repetidos na turma: ANA, bia"
+    assert sessoes == 0
+    assert geracoes == []
+
+
+def test_turma_acima_do_limite(rodar, app, cliente, geracoes, monkeypatch):
+    from backend import main  # Depois da fixture `app`, sem carregar o Whisper
+
+    monkeypatch.setattr(main, "MAX_ALUNOS_TURMA", 2)
+
+    async def cenario():
+        acima = await _iniciar_turma(cliente, ["Ana", "Bia", "Caio"])
+        sessoes = await _contar(TutoriaSession)
+        # Linhas vazias não contam para o limite
+        no_limite = await _iniciar_turma(cliente, ["Ana", " ", "Bia"])
+        return acima, sessoes, no_limite
+
+    acima, sessoes, no_limite = rodar(cenario())
+    assert acima.status_code == 400
+    assert acima.json()["detail"] == "No máximo 2 alunos por turma"
+    assert sessoes == 0
+    assert no_limite.status_code == 200
+    assert [s["aluno"] for s in no_limite.json()["sessoes"]] == ["Ana", "Bia"]
+
+
+def test_falha_no_meio_nao_deixa_turma_pela_metade(rodar, cliente, geracoes, monkeypatch):
+    adicionar = historico.adicionar_mensagens
+    gravadas = []
+
+    async def falhar_na_segunda(db, session_id, mensagens, **kwargs):
+        if gravadas:
+            raise RuntimeError("Disco cheio")
+        gravadas.append(session_id)
+        return await adicionar(db, session_id, mensagens, **kwargs)
+
+    monkeypatch.setattr(historico, "adicionar_mensagens", falhar_na_segunda)
+
+    async def cenario():
+        with pytest.raises(RuntimeError):
+            await _iniciar_turma(cliente, ["Ana", "Bia", "Caio"])
+        return await _contar(TutoriaSession), await _contar(ChatMessage)
+
+    # Sessões, progresso e mensagens entram numa transação só
+    assert rodar(cenario()) == (0, 0)
+    assert len(gravadas) == 1